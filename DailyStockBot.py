@@ -1,16 +1,33 @@
-import os, yfinance as yf, pandas as pd, requests, time, datetime
+import os, yfinance as yf, pandas as pd, requests, time, argparse, threading
 import numpy as np
 import gspread
 import json
 from oauth2client.service_account import ServiceAccountCredentials
 from FinMind.data import DataLoader
+import price_store
+import ticker_resolver
+import inst_store
+import fundamentals_store
+import scan_checkpoint
+import scan_shard
+import strategy_engine
+from indicator_panel import IndicatorPanel, panel_for
+from stock_common import tw_now, parallel_map, add_workers_arg, timed_stage, count_retry, stage_summary, save_run_report
 
 # ==========================================
 # 設定與環境變數
 # ==========================================
 LINE_ACCESS_TOKEN = os.getenv("LINE_ACCESS_TOKEN")
 LINE_USER_ID = os.getenv("LINE_USER_ID") or "U2e9b79c2f71cb2a3db62e5d75254270c"
+INDICATOR_PANEL = None  # 全市場指標表 (main 批次下載後一次算好)
+SCREEN_SIGNALS = None  # strategies.json「v14_screen」在全市場的計算結果
+SIGNALS = None  # strategies.json「v14」在全市場的計算結果 (法人資料庫無資料時為 None，改逐檔計算)
+FUNNEL_STAGES = ("價量初篩", "基本面", "籌碼")
+FUNNEL = dict.fromkeys(FUNNEL_STAGES, 0)  # 各階段通過檔數 (並行掃描時以鎖保護)
+FUNNEL_REACHED = {}  # 代號 → 最後通過的漏斗階段 (斷點續跑時據此還原漏斗統計)
+_FUNNEL_LOCK = threading.Lock()
 
+@timed_stage("line")
 def send_line(msg):
     if not LINE_ACCESS_TOKEN: return
     url = "https://api.line.me/v2/bot/message/push"
@@ -22,6 +39,7 @@ def send_line(msg):
 # ==========================================
 # LINE 官方帳號免費發送額度查詢
 # ==========================================
+@timed_stage("line")
 def get_line_quota_report():
     """透過 LINE API 自動查詢本月已發送則數與剩餘免費額度"""
     if not LINE_ACCESS_TOKEN:
@@ -68,6 +86,7 @@ def get_gspread_client():
 # ==========================================
 # 1. 法人精選監測同步 (具備自動擴增與高亮)
 # ==========================================
+@timed_stage("sheets")
 def sync_to_sheets(data_list):
     """將結果寫入 '法人精選監測' 報表，具備自動擴增行數與高亮最新資料功能"""
     try:
@@ -109,6 +128,7 @@ def sync_to_sheets(data_list):
 # ==========================================
 # 2. WATCH_LIST 同步 (具備自動擴增與高亮)
 # ==========================================
+@timed_stage("sheets")
 def update_watch_list_sheet(recommended_stocks, name_map):
     """將推薦標的匯入 'WATCH_LIST'、自動檢查容量、清除舊底色，並高亮今日最新加入的潛力股"""
     try:
@@ -145,7 +165,7 @@ def update_watch_list_sheet(recommended_stocks, name_map):
 
         if recommended_stocks:
             new_rows = []
-            tw_time = datetime.datetime.utcnow() + datetime.timedelta(hours=8)
+            tw_time = tw_now()
             now_str = tw_time.strftime('%Y-%m-%d %H:%M')
             print(f"📋 準備將 {len(recommended_stocks)} 檔潛力股匯入 WATCH_LIST...")
 
@@ -184,116 +204,85 @@ def update_watch_list_sheet(recommended_stocks, name_map):
 # 3. 籌碼數據與技術指標運算
 # ==========================================
 def get_inst_stats(sid_clean):
-    """一次獲取外資投信連續買超天數，以及近20天合計買超天數，節省 API 配額"""
-    try:
-        dl = DataLoader()
-        start = (datetime.date.today() - datetime.timedelta(days=35)).strftime('%Y-%m-%d')
-        df = dl.taiwan_stock_institutional_investors(stock_id=sid_clean, start_date=start)
-        if df is None or df.empty: return 0, 0, 0, 0
-        
-        def analyze_investor(name):
-            d = df[df['name'] == name].sort_values('date', ascending=False).head(20)
-            if d.empty: return 0, 0
-            streak = 0
-            buy_days = 0
-            for idx, (_, r) in enumerate(d.iterrows()):
-                net = r['buy'] - r['sell']
-                if net > 0:
-                    buy_days += 1
-                    if streak == idx:
-                        streak += 1
-            return streak, buy_days
-
-        fs_streak, fs_days = analyze_investor('Foreign_Investor')
-        ss_streak, ss_days = analyze_investor('Investment_Trust')
-        return fs_streak, ss_streak, fs_days, ss_days
+    """一次獲取外資投信連續買超天數，以及近20天合計買超天數 (查詢全市場向量化連買表，不再逐檔呼叫 API)"""
+    try: return inst_store.get_streaks(sid_clean)
     except: return 0, 0, 0, 0
 
-def calculate_indicators(df):
-    close = df['Close']
-    low_min = df['Low'].rolling(window=9).min()
-    high_max = df['High'].rolling(window=9).max()
-    delta = close.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rsi = 100 - (100 / (1 + (gain / loss)))
-    rsv = (close - low_min) / (high_max - low_min) * 100
-    k = rsv.ewm(com=2).mean() 
-    d = k.ewm(com=2).mean()
-    return rsi, k, d
-
 # ==========================================
 # ✨ 【全新功能】雙保險後綴智慧對接辨識器 (防止 404 Error)
 # ==========================================
 def get_tw_stock(sid):
-    """智慧型代號對接器：根據代碼特徵排序優先級，並透過快速 K 線測試確保 100% 成功連線"""
-    clean_id = str(sid).strip().upper()
-    # 3, 4, 5, 6, 8 開頭通常是上櫃(.TWO)；其他通常是上市(.TW)
-    suffixes = [".TWO", ".TW"] if clean_id.startswith(('3', '4', '5', '6', '8')) else [".TW", ".TWO"]
-    for suffix in suffixes:
-        target = f"{clean_id}{suffix}"
-        try:
-            hist = yf.Ticker(target).history(period="5d")
-            if not hist.empty: 
-                return yf.Ticker(target), target
-        except: 
-            continue
-    return None, None
+    """智慧型代號對接器：先查本地後綴對照表，查不到才以 K 線探測 (結果寫回對照表)"""
+    target = ticker_resolver.resolve(sid)
+    if not target: return None, None
+    return yf.Ticker(target), target
 
 # ==========================================
 # 4. 核心三軌策略過濾篩選引擎
 # ==========================================
+def _funnel_pass(stage, sid):
+    with _FUNNEL_LOCK:
+        FUNNEL[stage] += 1
+        FUNNEL_REACHED[sid] = stage
+
+def cheap_screen(panel):
+    """① 價量初篩：strategies.json 的 v14_screen 在全市場指標表上一次算完 (站上季線、量比 > 1.0、至少 60 根K棒)。
+    這是後面兩種入選條件共同的必要條件，先剔除不影響最終結果，只省下基本面與籌碼查詢"""
+    global SCREEN_SIGNALS
+    SCREEN_SIGNALS = strategy_engine.evaluate("v14_screen", panel)
+    return set(SCREEN_SIGNALS.passing("prescreen"))
+
+def build_signals(panel):
+    """全市場法人連買對齊指標表後，一次算完 v14 所有策略遮罩"""
+    chips = inst_store.streak_vectors([t.split('.')[0] for t in panel.tickers])
+    return strategy_engine.evaluate("v14", panel, extra=chips) if chips else None
+
+def _in_stage1(sid, stage1):
+    full_id = ticker_resolver.lookup(sid)
+    return full_id is None or not INDICATOR_PANEL.has(full_id) or full_id in stage1
+
 def analyze_v14(sid, name):
     try:
         # 🚀 呼叫全新雙保險對接引擎，徹底阻斷 404 找不到股票的錯誤
         s, full_id = get_tw_stock(sid)
         if not s: 
             return None, None, None
-            
-        i = s.info
+
+        # 📐 ① 價量初篩：指標直接查全市場指標表 (不在表內才臨時單檔計算)
+        panel = panel_for(INDICATOR_PANEL, full_id, "1y")
+        if not panel.has(full_id): return None, None, None
+        if not strategy_engine.row_for(SCREEN_SIGNALS, "v14_screen", panel, full_id)["prescreen"]: return None, None, None
+        _funnel_pass("價量初篩", sid)
+
+        # ② 基本面：通過價量初篩才查 .info (走 TTL 快取，過期才連網並經全域節流器)
+        i = fundamentals_store.get_info(full_id)
         m = i.get('grossMargins', 0) or 0
         e = i.get('trailingEps', 0) or 0
         if m < 0.10 or e <= 0: return None, None, None
-
-        df = s.history(period="1y")
-        if len(df) < 60: return None, None, None
-        
-        cp = df.iloc[-1]['Close']
-        ma5 = df['Close'].rolling(5).mean().iloc[-1]
-        ma20 = df['Close'].rolling(20).mean().iloc[-1]
-        
-        ma60_series = df['Close'].rolling(60).mean()
-        ma60 = ma60_series.iloc[-1]
-        ma60_prev = ma60_series.iloc[-2] if len(ma60_series) > 1 else ma60
-        
-        rsi_series, k_series, d_series = calculate_indicators(df)
-        rsi_val = rsi_series.iloc[-1]
-        k_val = k_series.iloc[-1]
-        
-        vol_today = df.iloc[-1]['Volume']
-        vol_avg = df['Volume'].iloc[-11:-1].mean()
-        vol_ratio = vol_today / vol_avg if vol_avg > 0 else 0
+        _funnel_pass("基本面", sid)
         
-        bias_5 = ((cp - ma5) / ma5) * 100
-        status_label = "✅安全"
-        if bias_5 > 7 or rsi_val > 75 or k_val > 85: status_label = "⚠️過熱"
+        cp = panel.get(full_id, 'close')
+        rsi_val = panel.get(full_id, 'rsi')
+        k_val = panel.get(full_id, 'k')
+        vol_ratio = panel.get(full_id, 'vol_ratio10')
         
+        # ③ 籌碼：通過基本面才查法人連買
         pure_id = str(sid).strip()
-        fs_streak, ss_streak, fs_days, ss_days = get_inst_stats(pure_id)
+        chips = get_inst_stats(pure_id)
+        fs_streak, ss_streak, fs_days, ss_days = chips
         
-        # 1. 短線穩健策略條件
-        is_stable = ((ss_streak >= 2 or fs_streak >= 3) and (vol_ratio > 1.2) and (50 <= rsi_val <= 75) and (k_val <= 80) and cp > ma60)
-        # 2. 短線強勢飆股策略條件
-        is_aggressive = ((ss_streak >= 1 or fs_streak >= 2) and (vol_ratio > 2.5) and (rsi_val > 60) and (cp > ma5) and cp > ma60)
-        # 3. 🌊 長線主升浪飆股策略條件（完美對接強茂體系：無RSI天花板、20日區間法人合計吸籌 >= 12天、季線上揚）
-        is_long_term_trend = (cp > ma20 and cp > ma60 and ma60 > ma60_prev and (fs_days + ss_days >= 12) and vol_ratio > 1.0)
+        # 短線穩健 / 短線強勢飆股 / 🌊 長線主升浪 三軌策略條件定義在 strategies.json 的 v14 群組 (全市場一次算好，這裡只查表)
+        sig = strategy_engine.row_for(SIGNALS, "v14", panel, full_id, dict(zip(inst_store.STREAK_COLUMNS, chips)))
+        is_stable, is_aggressive, is_long_term_trend = sig['is_stable'], sig['is_aggressive'], sig['is_long_term_trend']
+        status_label = "⚠️過熱" if sig['is_overheated'] else "✅安全"
         
-        if ((fs_streak >= 2 or ss_streak >= 1) and cp > ma60 and vol_ratio > 1.1) or is_long_term_trend:
+        if sig['is_pick']:
+            _funnel_pass("籌碼", sid)
             type_tag = "🔍法人掃貨"
             if ss_streak >= 2: type_tag = "🌟投信認養"
             if is_long_term_trend and not (is_stable or is_aggressive): type_tag = "🚀長線飆股"
             
-            tw_today = (datetime.datetime.utcnow() + datetime.timedelta(hours=8)).strftime('%Y-%m-%d')
+            tw_today = tw_now().strftime('%Y-%m-%d')
             sheet_data = [tw_today, pure_id, name, type_tag, fs_streak, ss_streak, round(vol_ratio, 2), status_label, round(rsi_val, 1), round(k_val, 1), cp]
 
             recommendation = None
@@ -314,7 +303,14 @@ def analyze_v14(sid, name):
 # ==========================================
 # 5. 主程式執行區塊 (全市場無死角掃描解封版)
 # ==========================================
-def main():
+def _restore_funnel(stage):
+    """續跑時把已完成代號的漏斗階段加回統計"""
+    if stage:
+        for s in FUNNEL_STAGES[:FUNNEL_STAGES.index(stage) + 1]: FUNNEL[s] += 1
+
+def scan_market(workers=1, resume=False, shard=None):
+    """下載清單並掃描 (shard 指定時只掃該分片)：回傳 {universe, name_map, funnel, results=[[全市場順序, 報表列, 推薦]]}"""
+    global INDICATOR_PANEL, SIGNALS
     dl = DataLoader()
     stock_df = None
     max_retries = 3
@@ -322,40 +318,80 @@ def main():
     
     for attempt in range(max_retries):
         try:
-            stock_df = dl.taiwan_stock_info()
+            with timed_stage("stock_list"): stock_df = dl.taiwan_stock_info()
             if stock_df is not None and not stock_df.empty:
                 print("✅ 台股清單下載成功")
                 break
         except Exception as e:
             print(f"⚠️ FinMind 連線失敗 (第 {attempt+1}/{max_retries} 次): {e}")
             if attempt < max_retries - 1:
+                count_retry("stock_list")
                 print("⏳ 等待 5 秒後重試...")
                 time.sleep(5)
             else:
                 print("❌ 無法獲取台股清單。程式終止。")
-                return
+                return None
 
-    if stock_df is None: return
+    if stock_df is None: return None
 
     name_map = dict(zip(stock_df['stock_id'], stock_df['stock_name']))
-    m_col = 'market_type' if 'market_type' in stock_df.columns else 'type'
+    ticker_resolver.update_from_stock_info(stock_df)
     
     # 🔓 拔除 .head(1000) 枷鎖，全面掃描全市場 1700+ 檔標的
     targets = stock_df[stock_df['stock_id'].str.len() == 4] 
-    
-    sheet_results, watch_list_candidates, seen_ids = [], [], set()
-    print(f"🚀 啟動全市場【短線雙軌策略 ＋ 長線浪潮飆股】全面大掃描 (共 {len(targets)} 檔)...")
-    
-    for _, row in targets.iterrows():
-        sid = row['stock_id']
-        if sid in seen_ids: continue
-        seen_ids.add(sid)
-        
-        # 🚀 這裡直接傳入純股票代號，讓內部全新的智慧型雙保險對接器處理
-        _, s_res, rec_obj = analyze_v14(sid, row['stock_name'])
-        if s_res: sheet_results.append(s_res)
-        if rec_obj: watch_list_candidates.append(rec_obj)
-        time.sleep(0.4)
+    # 去除重複代號後依原順序分析；--workers N 時並行，結果仍按原順序彙整 (報表與序列執行完全相同)
+    unique_rows = list(targets.drop_duplicates('stock_id')[['stock_id', 'stock_name']].itertuples(index=False, name=None))
+    order = {r[0]: i for i, r in enumerate(unique_rows)}
+    # 🧩 分片：只保留本分片的代號 (K線、指標表都只處理這一份)
+    rows = [r for r in unique_rows if scan_shard.in_shard(r[0], shard)]
+    if shard: print(f"🧩 分片 {shard[0]}/{shard[1]}：負責 {len(rows)} / {len(unique_rows)} 檔")
+
+    # 🏦 一次同步全市場近 35 天法人買賣超，之後籌碼查詢全部走記憶體
+    inst_store.sync()
+
+    # 📦 批次預先下載全市場K線至本地快取 (後綴查對照表)，取代逐檔 history() 請求
+    prefetch_ids = [t for t in (ticker_resolver.lookup(r[0]) for r in rows) if t]
+    price_store.prefetch(prefetch_ids, "1y")
+
+    # 📐 全市場 RSI/KD/均線/量比 由增量狀態只推進新K棒，逐檔分析只查表
+    t0 = time.time()
+    INDICATOR_PANEL = IndicatorPanel.from_store(prefetch_ids, "1y")
+    print(f"📐 全市場指標表建立完成：{len(INDICATOR_PANEL.tickers)} 檔，耗時 {time.time() - t0:.1f} 秒")
+
+    # 🔻 漏斗式篩選：① 價量初篩先用指標表一次刷掉大部分標的 (不在表內的代號交給 analyze_v14 自行判斷)
+    stage1 = cheap_screen(INDICATOR_PANEL)
+    SIGNALS = build_signals(INDICATOR_PANEL)
+    screened = [r for r in rows if _in_stage1(r[0], stage1)]
+    for stage in FUNNEL_STAGES: FUNNEL[stage] = 0
+
+    # 💾 斷點續跑：每完成一批就把結果寫入快取目錄；--resume 時略過今天已完成的代號
+    checkpoint = scan_checkpoint.Checkpoint(scan_shard.shard_name("DailyStockBot", shard) if shard else "DailyStockBot")
+    if resume and checkpoint.load():
+        # 只還原今天初篩仍入選的代號 (初篩結果自斷點寫入後有變動時，漏斗計數才不會灌水)
+        restored = [r[0] for r in screened if checkpoint.done(r[0])]
+        for sid in restored: _restore_funnel(checkpoint.results[sid]["stage"])
+        print(f"💾 從斷點續跑：今日已完成 {len(restored)} 檔，略過不重掃")
+    pending = [r for r in screened if not checkpoint.done(r[0])]
+    print(f"🚀 啟動全市場【短線雙軌策略 ＋ 長線浪潮飆股】全面大掃描 (共 {len(rows)} 檔，初篩後 {len(screened)} 檔，待掃 {len(pending)} 檔，{workers} 執行緒)...")
+
+    def scan(row):
+        _, sheet_data, recommendation = analyze_v14(*row)
+        checkpoint.add(row[0], {"stage": FUNNEL_REACHED.get(row[0]), "sheet": sheet_data, "rec": recommendation})
+
+    # 🚀 這裡直接傳入純股票代號，讓內部全新的智慧型雙保險對接器處理
+    parallel_map(scan, pending, workers)
+    checkpoint.flush()
+    results = [[order[r[0]], checkpoint.results[r[0]]["sheet"], checkpoint.results[r[0]]["rec"]] for r in screened]
+    return {"universe": len(unique_rows), "name_map": name_map, "funnel": dict(FUNNEL), "results": results, "checkpoint": checkpoint}
+
+def publish(universe, name_map, funnel, results):
+    """同步兩張報表並發 LINE 完成通知 (單機掃描或合併分片後只執行一次)"""
+    # 依原本全市場順序彙整 (續跑、分片合併與一次跑完的報表完全相同)
+    results = sorted(results, key=lambda r: r[0])
+    sheet_results = [s_res for _, s_res, _ in results if s_res]
+    watch_list_candidates = [rec_obj for _, _, rec_obj in results if rec_obj]
+    funnel_report = " → ".join([f"全市場 {universe}"] + [f"{stage} {funnel[stage]}" for stage in FUNNEL_STAGES])
+    print(f"🔻 篩選漏斗：{funnel_report}")
 
     monitor_sheet_url = "無法獲取連結"
     if sheet_results:
@@ -367,17 +403,42 @@ def main():
     if real_watch_url: watch_list_url = real_watch_url
 
     line_quota_report = get_line_quota_report()
-    tw_date = (datetime.datetime.utcnow() + datetime.timedelta(hours=8)).strftime('%Y-%m-%d')
+    tw_date = tw_now().strftime('%Y-%m-%d')
 
     msg = (f"🔍 【{tw_date} 全市場量化選股雷達掃描完成】\n\n"
            f"今日台股全市場 1700+ 檔篩選已順利結束！\n"
-           f"📈 共篩選出 {len(sheet_results)} 檔符合法人多頭/長線飆股標的，並已自動過濾更新潛力股至您的雲端觀察名單。\n\n"
+           f"📈 共篩選出 {len(sheet_results)} 檔符合法人多頭/長線飆股標的，並已自動過濾更新潛力股至您的雲端觀察名單。\n"
+           f"🔻 篩選漏斗：{funnel_report}\n\n"
            f"🔗 點擊查看法人精選監測：\n{monitor_sheet_url}\n\n"
            f"📋 點擊查看最新 WATCH_LIST：\n{watch_list_url}\n\n"
-           f"{line_quota_report}")
+           f"{line_quota_report}\n\n"
+           f"{stage_summary()}")
     
     send_line(msg)
     print("✅ 雙報表自動化控制 + 全市場雙保險長線飆股監測部署成功！")
 
+def main(workers=1, resume=False, shard=None):
+    scanned = scan_market(workers, resume, shard)
+    if not scanned: return
+    checkpoint = scanned.pop("checkpoint")
+    if shard: scan_shard.write_shard("DailyStockBot", shard, scanned)
+    else: publish(**scanned)
+    checkpoint.clear()  # 報表與推播 (或分片檔) 完成後斷點作廢
+
+def merge(patterns):
+    """合併各分片的結果：漏斗逐階段相加、報表列依全市場順序排列，再統一同步報表與推播"""
+    shards = scan_shard.load_shards("DailyStockBot", patterns)
+    name_map = {}
+    for s in shards: name_map.update(s["name_map"])
+    funnel = {stage: sum(s["funnel"][stage] for s in shards) for stage in FUNNEL_STAGES}
+    FUNNEL.update(funnel)
+    publish(max(s["universe"] for s in shards), name_map, funnel, [r for s in shards for r in s["results"]])
+
 if __name__ == "__main__":
-    main()
+    parser = scan_shard.add_shard_args(add_workers_arg(argparse.ArgumentParser(description="全市場量化選股雷達")))
+    parser.add_argument("--resume", action="store_true", help="從今天的斷點續跑，略過已完成的代號")
+    args = parser.parse_args()
+    try:
+        if args.merge: merge(args.merge)
+        else: main(args.workers, args.resume, args.shard)
+    finally: save_run_report(scan_shard.shard_name("DailyStockBot", args.shard) if args.shard else "DailyStockBot", workers=args.workers, funnel=FUNNEL)
@@ -1,4 +1,5 @@
-import os, yfinance as yf, pandas as pd, requests, time, datetime, sys
+import os, yfinance as yf, pandas as pd, requests, time, datetime, sys, copy, argparse, hashlib, random, threading
+import numpy as np
 import gspread
 import logging
 import json
@@ -8,6 +9,15 @@ from email.mime.multipart import MIMEMultipart
 from google import genai
 from oauth2client.service_account import ServiceAccountCredentials
 from FinMind.data import DataLoader
+import price_store
+import ticker_resolver
+import inst_store
+import fundamentals_store
+import strategy_engine
+import indicator_state
+import gemini_cache
+from indicator_panel import IndicatorPanel, panel_for
+from stock_common import cache_path, tw_now, is_market_open, throttle, parallel_map, timed_stage, count_retry, stage_summary, save_run_report
 
 # ==========================================
 # 0. 靜音設定與全域變數
@@ -34,13 +44,56 @@ MODEL_CANDIDATES = [
 
 HAS_GENAI = False
 AI_CLIENT = None
+AI_WORKERS = int(os.getenv("AI_WORKERS", "4"))  # 同時進行的 Gemini 請求數 (整體速率仍受 GEMINI_RPM 節流)
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))  # 同一模型遇到流量限制 / 暫時性錯誤的重試次數
+AI_BACKOFF_SECONDS = float(os.getenv("AI_BACKOFF_SECONDS", "2"))
+HEALTHY_MODEL = None  # 最近一次成功回應的模型，之後優先使用
+FAILED_MODELS = set()  # 本次執行已確認無法使用的模型 (非流量限制的錯誤)，不再對每檔股票重試
+_AI_LOCK = threading.Lock()
+_AI_INIT_LOCK = threading.Lock()
+_AI_CHECKED = False
+_STOCK_INFO_MAP = None
+INDICATOR_PANEL = None  # WATCH_LIST 指標表 (main 批次下載後一次算好)
+SIGNALS = None  # strategies.json「push」在 WATCH_LIST 指標表上的計算結果
 GLOBAL_TOKEN_BILLING = {
     "prompt_tokens": 0,
     "completion_tokens": 0,
     "total_tokens": 0,
-    "api_calls": 0
+    "api_calls": 0,
+    "cache_hits": 0,  # Gemini 回應快取 (gemini_cache) 命中 / 未命中次數與省下的 Token
+    "cache_misses": 0,
+    "saved_prompt_tokens": 0,
+    "saved_completion_tokens": 0
 }
 
+# ==========================================
+# 🚦 Gemini 呼叫：流量限制退避 + 記住健康的模型
+# ==========================================
+# 429 / RESOURCE_EXHAUSTED 與 5xx 視為暫時性錯誤，同一模型指數退避後重試；其他錯誤 (模型下架、權限等)
+# 直接把該模型標記為不可用，本次執行後續的股票不再浪費請求在它身上。
+def is_transient_error(err):
+    code = getattr(err, "code", None)
+    if isinstance(code, int) and (code == 429 or code >= 500): return True
+    text = str(err)
+    return any(tag in text for tag in ("429", "RESOURCE_EXHAUSTED", "UNAVAILABLE", "503"))
+
+def mark_model(model_name, err):
+    """err 為 None 代表成功；只有非暫時性錯誤才把模型列入不可用"""
+    global HEALTHY_MODEL
+    with _AI_LOCK:
+        if err is None:
+            HEALTHY_MODEL = model_name
+            FAILED_MODELS.discard(model_name)
+        elif not is_transient_error(err):
+            FAILED_MODELS.add(model_name)
+            if HEALTHY_MODEL == model_name: HEALTHY_MODEL = None
+
+def models_to_try():
+    """健康的模型排第一，其餘依 MODEL_CANDIDATES 順序並略過已確認失敗的"""
+    with _AI_LOCK:
+        ordered = ([HEALTHY_MODEL] if HEALTHY_MODEL else []) + [m for m in MODEL_CANDIDATES if m != HEALTHY_MODEL]
+        return [m for m in ordered if m not in FAILED_MODELS]
+
 # ==========================================
 # [啟動檢查] AI 自我診斷與環境變數開關
 # ==========================================
@@ -65,24 +118,39 @@ def check_ai_health():
         client = genai.Client(api_key=GEMINI_API_KEY)
         for model_name in MODEL_CANDIDATES:
             try:
-                response = client.models.generate_content(model=model_name, contents="Hi")
+                with timed_stage("gemini"): response = client.models.generate_content(model=model_name, contents="Hi")
                 if response and response.text:
                     print(f"✅ AI 測試成功！將使用模型: {model_name}")
                     HAS_GENAI = True
                     AI_CLIENT = client
+                    mark_model(model_name, None)
                     return
             except Exception as model_err: 
+                count_retry("gemini")
+                mark_model(model_name, model_err)
                 continue
         print("❌ 失敗: 所有候選模型皆無法連線。")
         HAS_GENAI = False
     except Exception as e:
         HAS_GENAI = False
 
-check_ai_health()
+def ai_requested():
+    """本次是否要求 AI (ENABLE_AI 開關 + 金鑰)：只看設定不連網，結果快取指紋與快取命中前的判斷用這個"""
+    return str(os.getenv("ENABLE_AI", "true")).lower() == "true" and bool(GEMINI_API_KEY)
+
+def ai_ready():
+    """第一次需要 AI 時才做連線測試 (結果記住)，回傳 AI 是否可用；import 本模組不連網"""
+    global _AI_CHECKED
+    with _AI_INIT_LOCK:
+        if not _AI_CHECKED:
+            check_ai_health()
+            _AI_CHECKED = True
+    return HAS_GENAI and AI_CLIENT is not None
 
 # ==========================================
 # LINE 官方帳號免費發送額度查詢
 # ==========================================
+@timed_stage("line")
 def get_line_quota_report():
     if not LINE_ACCESS_TOKEN: return "⚠️ 未設定 LINE Token"
     headers = {"Authorization": f"Bearer {LINE_ACCESS_TOKEN}"}
@@ -99,21 +167,67 @@ def get_line_quota_report():
         return f"📊 ── LINE 本月額度診斷 ──\n🔹 當月免費總量：{total_limit} 則\n🔹 本月已發送量：{total_consumed} 則\n🔹 目前剩餘額度：{remaining_quota} 則 [{alert_tag}]"
     except: return "⚠️ LINE 額度查詢失敗"
 
-def calculate_twd_cost():
+def calculate_twd_cost(prompt_key="prompt_tokens", completion_key="completion_tokens"):
     USD_PER_M_INPUT, USD_PER_M_OUTPUT, FX_USD_TO_TWD = 0.075, 0.30, 32.5      
-    usd_cost = ((GLOBAL_TOKEN_BILLING["prompt_tokens"] / 1_000_000) * USD_PER_M_INPUT) + ((GLOBAL_TOKEN_BILLING["completion_tokens"] / 1_000_000) * USD_PER_M_OUTPUT)
+    usd_cost = ((GLOBAL_TOKEN_BILLING[prompt_key] / 1_000_000) * USD_PER_M_INPUT) + ((GLOBAL_TOKEN_BILLING[completion_key] / 1_000_000) * USD_PER_M_OUTPUT)
     return round(usd_cost * FX_USD_TO_TWD, 4)
 
+def calculate_saved_twd():
+    """回應快取命中省下的費用"""
+    return calculate_twd_cost("saved_prompt_tokens", "saved_completion_tokens")
+
+def token_usage(response):
+    meta = getattr(response, 'usage_metadata', None)
+    if not meta: return {}
+    return {"prompt_tokens": meta.prompt_token_count or 0, "completion_tokens": meta.candidates_token_count or 0, "total_tokens": meta.total_token_count or 0}
+
 def record_token_usage(response):
     try:
-        if response and hasattr(response, 'usage_metadata') and response.usage_metadata:
-            meta = response.usage_metadata
-            GLOBAL_TOKEN_BILLING["prompt_tokens"] += meta.prompt_token_count
-            GLOBAL_TOKEN_BILLING["completion_tokens"] += meta.candidates_token_count
-            GLOBAL_TOKEN_BILLING["total_tokens"] += meta.total_token_count
-            GLOBAL_TOKEN_BILLING["api_calls"] += 1
+        usage = token_usage(response)
+        if usage:
+            with _AI_LOCK:
+                for key, value in usage.items(): GLOBAL_TOKEN_BILLING[key] += value
+                GLOBAL_TOKEN_BILLING["api_calls"] += 1
     except: pass
 
+def ask_gemini(model_name, prompt, config=None):
+    """先查回應快取，未命中才呼叫 Gemini 並寫回快取；回傳文字，失敗時拋出例外 (由呼叫端換下一個模型)"""
+    hit = gemini_cache.get(model_name, prompt, config)
+    if hit:
+        with _AI_LOCK:
+            GLOBAL_TOKEN_BILLING["cache_hits"] += 1
+            GLOBAL_TOKEN_BILLING["saved_prompt_tokens"] += hit["usage"].get("prompt_tokens", 0)
+            GLOBAL_TOKEN_BILLING["saved_completion_tokens"] += hit["usage"].get("completion_tokens", 0)
+        return hit["text"]
+    if not ai_ready(): raise RuntimeError("AI 服務暫停")  # 快取未命中才需要連線測試
+    kwargs = {"config": config} if config else {}
+    throttle("gemini")
+    with timed_stage("gemini"): response = AI_CLIENT.models.generate_content(model=model_name, contents=prompt, **kwargs)
+    record_token_usage(response)
+    with _AI_LOCK: GLOBAL_TOKEN_BILLING["cache_misses"] += 1
+    gemini_cache.put(model_name, prompt, response.text, token_usage(response), config)
+    return response.text
+
+def call_gemini(prompt, config=None):
+    """依序嘗試可用模型並回傳文字；全部失敗回傳 None。可由多個執行緒同時呼叫"""
+    for model_name in models_to_try():
+        for attempt in range(AI_MAX_RETRIES + 1):
+            try:
+                text = ask_gemini(model_name, prompt, config)
+                mark_model(model_name, None)
+                return text
+            except Exception as e:
+                if not ai_ready(): return None  # AI 未啟用或連線測試失敗 (快取未命中時才會測試)，不算模型故障
+                count_retry("gemini")
+                mark_model(model_name, e)
+                if not is_transient_error(e) or attempt == AI_MAX_RETRIES: break
+                time.sleep(AI_BACKOFF_SECONDS * 2 ** attempt + random.uniform(0, 1))
+    return None
+
+def cache_report():
+    hits, misses = GLOBAL_TOKEN_BILLING["cache_hits"], GLOBAL_TOKEN_BILLING["cache_misses"]
+    return f"♻️ AI 快取命中 {hits} 次 / 未命中 {misses} 次，省下 NT$ {calculate_saved_twd()} 元"
+
 def get_gspread_client():
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     json_key_str = os.environ.get('GOOGLE_SHEETS_JSON')
@@ -124,6 +238,7 @@ def get_gspread_client():
         return gspread.authorize(creds)
     except: return None
 
+@timed_stage("sheets")
 def sync_to_sheets(data_list):
     try:
         client = get_gspread_client()
@@ -141,27 +256,38 @@ def sync_to_sheets(data_list):
 
 def log_execution_cost_to_sheets(spreadsheet, current_time, twd_cost):
     try:
+        header = ['執行時間', 'AI 呼叫總次數', '輸入 Token (Prompt)', '輸出 Token (Completion)', '總 Token 消耗', '預估台幣費用 (TWD)', '快取命中', '快取未命中', '快取省下費用 (TWD)']
         try: cost_sheet = spreadsheet.worksheet("Token與費用統計")
         except:
-            cost_sheet = spreadsheet.add_worksheet(title="Token與費用統計", rows=1000, cols=6)
-            cost_sheet.append_row(['執行時間', 'AI 呼叫總次數', '輸入 Token (Prompt)', '輸出 Token (Completion)', '總 Token 消耗', '預估台幣費用 (TWD)'])
-            cost_sheet.format("A1:F1", {"textFormat": {"bold": True}, "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9}, "horizontalAlignment": "CENTER"})
+            cost_sheet = spreadsheet.add_worksheet(title="Token與費用統計", rows=1000, cols=len(header))
+            cost_sheet.append_row(header)
+            cost_sheet.format("A1:I1", {"textFormat": {"bold": True}, "backgroundColor": {"red": 0.9, "green": 0.9, "blue": 0.9}, "horizontalAlignment": "CENTER"})
+        if cost_sheet.row_values(1) != header:  # 舊版分頁只有 6 欄，補上快取統計欄位
+            if cost_sheet.col_count < len(header): cost_sheet.resize(cols=len(header))
+            cost_sheet.update(values=[header], range_name='A1')
         
-        cost_sheet.append_row([current_time, GLOBAL_TOKEN_BILLING["api_calls"], GLOBAL_TOKEN_BILLING["prompt_tokens"], GLOBAL_TOKEN_BILLING["completion_tokens"], GLOBAL_TOKEN_BILLING["total_tokens"], f"NT$ {twd_cost} 元"], value_input_option='USER_ENTERED')
+        cost_sheet.append_row([current_time, GLOBAL_TOKEN_BILLING["api_calls"], GLOBAL_TOKEN_BILLING["prompt_tokens"], GLOBAL_TOKEN_BILLING["completion_tokens"], GLOBAL_TOKEN_BILLING["total_tokens"], f"NT$ {twd_cost} 元",
+                               GLOBAL_TOKEN_BILLING["cache_hits"], GLOBAL_TOKEN_BILLING["cache_misses"], f"NT$ {calculate_saved_twd()} 元"], value_input_option='USER_ENTERED')
     except: pass
 
 def get_global_stock_info():
     dl = DataLoader()
     for _ in range(3):
         try:
-            df = dl.taiwan_stock_info()
+            with timed_stage("stock_list"): df = dl.taiwan_stock_info()
             if df is not None and not df.empty:
+                ticker_resolver.update_from_stock_info(df)
                 return {str(row['stock_id']): (row['stock_name'], row['industry_category']) for _, row in df.iterrows()}
-        except: time.sleep(2)
+        except: count_retry("stock_list"); time.sleep(2)
     return {}
 
-STOCK_INFO_MAP = get_global_stock_info()
+def stock_info_map():
+    """台股代號 → (名稱, 產業)；第一次使用時才下載 (同時更新 ticker_resolver 的市場別)，之後沿用"""
+    global _STOCK_INFO_MAP
+    if _STOCK_INFO_MAP is None: _STOCK_INFO_MAP = get_global_stock_info()
+    return _STOCK_INFO_MAP
 
+@timed_stage("sheets")
 def get_watch_list_from_sheet():
     try:
         client = get_gspread_client()
@@ -213,26 +339,7 @@ def get_watch_list_from_sheet():
         return []
 
 def get_inst_stats(sid_clean):
-    try:
-        dl = DataLoader()
-        start = (datetime.date.today() - datetime.timedelta(days=35)).strftime('%Y-%m-%d')
-        df = dl.taiwan_stock_institutional_investors(stock_id=sid_clean, start_date=start)
-        if df is None or df.empty: return 0, 0, 0, 0
-        
-        def analyze_investor(name):
-            d = df[df['name'] == name].sort_values('date', ascending=False).head(20)
-            if d.empty: return 0, 0
-            streak, buy_days = 0, 0
-            for idx, (_, r) in enumerate(d.iterrows()):
-                net = r['buy'] - r['sell']
-                if net > 0:
-                    buy_days += 1
-                    if streak == idx: streak += 1
-            return streak, buy_days
-
-        fs_streak, fs_days = analyze_investor('Foreign_Investor')
-        ss_streak, ss_days = analyze_investor('Investment_Trust')
-        return fs_streak, ss_streak, fs_days, ss_days
+    try: return inst_store.get_streaks(sid_clean)
     except: return 0, 0, 0, 0
 
 def get_vol_status_str(ratio):
@@ -281,171 +388,232 @@ def get_limit_up_potential(r):
     if r['d1'] > 0.03: score += 20; reasons.append("🚀長紅棒")
     return score, " | ".join(reasons)
 
+def _profit_info(data):
+    if not data['is_hold']: return "目前無庫存，純觀察"
+    roi = ((data['p'] - data['cost']) / data['cost']) * 100
+    return f"🔴庫存持有中 (成本:{data['cost']} | 現價:{data['p']} | 損益:{roi:+.2f}%)"
+
 def get_gemini_strategy(data):
     if data.get('skip_ai'): return "⏸️ 已手動關閉 AI 分析"
-    if not HAS_GENAI or not AI_CLIENT: return "AI 服務暫停"
+    if not ai_ready(): return AI_OFF_TEXT
     
-    profit_info = "目前無庫存，純觀察"
-    if data['is_hold']:
-        roi = ((data['p'] - data['cost']) / data['cost']) * 100
-        profit_info = f"🔴庫存持有中 (成本:{data['cost']} | 現價:{data['p']} | 損益:{roi:+.2f}%)"
-    prompt = f"針對個股 {data['name']} ({data['id']}) 進行短線診斷。現價：{data['p']}，5日線: {data['ma5']}，20日線: {data['ma20']}。{profit_info}。請給出約 80 字操作建議與明確防守價。"
-    for model_name in MODEL_CANDIDATES:
-        try:
-            response = AI_CLIENT.models.generate_content(model=model_name, contents=prompt)
-            record_token_usage(response)  
-            return response.text.replace('\n', ' ').strip()
-        except: time.sleep(1); continue
-    return "AI 連線忙碌中"
+    prompt = f"針對個股 {data['name']} ({data['id']}) 進行短線診斷。現價：{data['p']}，5日線: {data['ma5']}，20日線: {data['ma20']}。{_profit_info(data)}。請給出約 80 字操作建議與明確防守價。"
+    text = call_gemini(prompt)
+    return text.replace('\n', ' ').strip() if text else "AI 連線忙碌中"
+
+# ==========================================
+# 4-1. 📦 批次 AI 策略：多檔合併成一次請求，要求回傳 JSON 陣列
+# ==========================================
+# 每 AI_BATCH_SIZE 檔只發一次 generate_content (省下逐檔的提示詞開銷與重試等待)；
+# 回傳內容逐項檢查，缺漏或格式錯誤的股票才退回 get_gemini_strategy 逐檔補問。AI_BATCH_SIZE <= 1 即恢復逐檔模式。
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", "20"))
+
+def build_batch_prompt(batch):
+    lines = [f"- id={d['id']}｜{d['name']}｜現價 {d['p']}｜5日線 {d['ma5']}｜20日線 {d['ma20']}｜{_profit_info(d)}" for d in batch]
+    return (f"針對以下 {len(batch)} 檔個股分別進行短線診斷，每檔給出約 80 字操作建議與明確防守價。\n"
+            '只回傳 JSON 陣列，每檔一個元素：{"id": "代號", "strategy": "操作建議"}，id 必須與下列代號完全相同。\n' + "\n".join(lines))
+
+def parse_batch_strategies(text, ids):
+    """回傳 {代號: 策略}；只收 id 屬於本批、strategy 為非空字串的項目"""
+    text = (text or "").strip()
+    if text.startswith("```"): text = text.strip("`").removeprefix("json").strip()
+    try: items = json.loads(text)
+    except ValueError: return {}
+    answers = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict): continue
+        sid, strategy = str(item.get("id", "")).strip(), item.get("strategy")
+        if sid in ids and isinstance(strategy, str) and strategy.strip(): answers[sid] = strategy.replace('\n', ' ').strip()
+    return answers
+
+def get_gemini_strategies_batch(batch):
+    prompt = build_batch_prompt(batch)
+    ids = {d['id'] for d in batch}
+    return parse_batch_strategies(call_gemini(prompt, {"response_mime_type": "application/json"}), ids)
+
+def fill_ai_strategies(results):
+    """把 ai_strategy 為 None 的結果補上 AI 策略 (就地修改)：先批次詢問，缺漏的再逐檔補問；各請求以 AI_WORKERS 個執行緒並行"""
+    pending = [r for r in results if r.get('ai_strategy') is None]
+    ask = [r for r in pending if not r.get('skip_ai')]
+    if AI_BATCH_SIZE > 1 and len(ask) > 1 and ai_ready():
+        batches = [ask[i:i + AI_BATCH_SIZE] for i in range(0, len(ask), AI_BATCH_SIZE)]
+        for batch, answers in zip(batches, parallel_map(get_gemini_strategies_batch, batches, AI_WORKERS)):
+            for r in batch: r['ai_strategy'] = answers.get(r['id'])
+        missing = sum(1 for r in ask if r['ai_strategy'] is None)
+        print(f"📦 批次 AI 策略：{len(ask)} 檔，{len(batches)} 次請求，逐檔補問 {missing} 檔")
+    rest = [r for r in pending if r['ai_strategy'] is None]
+    for r, strategy in zip(rest, parallel_map(get_gemini_strategy, rest, AI_WORKERS)): r['ai_strategy'] = strategy
 
 # ==========================================
 # 5. ✨ 全域戰略報告生成器
 # ==========================================
-def generate_and_save_summary(data_list, report_time_str):
-    if not HAS_GENAI or not AI_CLIENT: return "本次報告未包含 AI 總結"
-    
-    inventory_txt, watchlist_txt = "", ""
-    golden_candidates, limit_up_candidates_txt, long_term_candidates_txt = "", "", ""
-    incubation_txt, first_golden_cross_txt, intraday_breakout_txt = "", "", ""
-    
+# 提示詞壓縮：每檔股票只在一張精簡數據表出現一次，各引擎分類只列代號；送出前量測 Token 數，
+# 超過 SUMMARY_TOKEN_BUDGET 時依優先順序 (起漲引擎訊號 > 漲停潛力分 > 總分 > 成交量) 從尾端刪減候選股。
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "6000"))
+SUMMARY_SECTIONS = [  # (標籤, 分類標題, 無標的時的說明)
+    ("A", "🌱 引擎A：底部主力潛伏區 (提早1~3天卡位)", "今日無符合 [底部潛伏] 標準之標的。"),
+    ("B", "✨ 引擎B：均線初升第一根 (MA5剛上穿MA20)", "今日無符合 [黃金交叉第一根] 之標的。"),
+    ("C", "⚡ 引擎C：動能即時爆發雷達", "今日無符合 [動能爆發] 之標的。"),
+    ("G", "🔥 今日黃金進場公式篩選 (量縮回後買上漲)", "今日無符合 [黃金進場公式] 之標的。"),
+    ("L", "🚀 今日漲停潛力股獵殺 (已經噴發之強勢股)", "今日無明顯漲停特徵股。"),
+    ("W", "🌊 長線主升浪大妖股 (主力大週期鎖籌碼)", "今日無符合長線主升浪標準之標的。"),
+]
+SUMMARY_COLUMNS = "代號|名稱|現價|今日量(張)|5日均量(張)|量比|日漲跌|MA5|MA10|MA20|MA60|外資/投信連買天數|月線乖離|均線訊號"
+SUMMARY_RULES = """
+【❌ 鐵律：違反直接扣薪 ❌】：
+1. 報告前段請依序精簡列出上述各大分類的標的狀態 (分類只列代號，數值請對照個股數據表)。
+2. ✨【★ 明日券商 APP 智慧單下單精確設定】：
+    深度交叉比對上述所有引擎數據。
+    【優先級】：AI 總監必須「優先」從【引擎A】、【引擎B】、【引擎C】與【黃金公式】中挑選 A 與 B 級標的，以達到「買在起漲點」的目的；已噴發的強勢股盡量安排在 C 級。
+    你必須依據個股位階，將挑選出的標的嚴格分類為 A、B、C 三種等級，並必須維持這三個等級標題的輸出！
+
+    【🚨 關鍵流動性與防漏空缺鐵律】：
+    - 必須在下單設定內明確標示【今日實際成交量】。
+    - 如果推薦的股票今日成交量【小於 500 張】，必須在標題一字不漏強制加上：
+      "⚠️ [冷門股防範：注意此股今日成交量低於500張，流動性極差，請嚴格控管資金或改採零股少量試單！]"
+    - 若某等級無符合標的，請在該等級標題下方強制輸出一行宣示文字：「今日無符合 [該等級名稱] 之推薦標的，嚴格控管資金風險。」
+
+==========【等級 A 專屬模板 (底部潛伏/黃金交叉)】==========
+🎯 獵殺目標：[股票名稱] (代號) - ✨ 特選：低位階尚未起飛股 [今日成交: XX張] 
+- 📊 進場邏輯深度解析：
+  【流動性檢視】：今日成交量為 [張數]張 (對比5日均量 [張數]張)。
+  1. 【提早卡位】：符合引擎A或B，主力剛開始吸籌或均線剛交叉。
+  2. 【位階安全防禦】：股價距離月線極近，防守容易。
+- 實戰設定步驟：
+  1. 觸發條件設定：當股價小於或等於 [MA5 + 0.1] 時。
+  2. 下單動作設定：以「限價 [MA5]」買入。
+  3. 終極安全帶（停損設定）：收盤跌破 MA20: [MA20] 立刻砍出。
+
+==========【等級 B 專屬模板 (動能爆發/回測買點)】==========
+🎯 獵殺目標：[股票名稱] (代號) - ⚡ 衝刺：初升段爆發/量縮回測股 [今日成交: XX張] 
+- 📊 進場邏輯深度解析：
+  【流動性檢視】：今日成交量放大至 [張數]張。
+  1. 【動能確認】：符合引擎C 或 黃金公式，有明確攻擊量或完美的量縮回測。
+- 實戰設定步驟：(同上，以MA5買進，跌破MA20停損)
+
+==========【等級 C 專屬模板 (長線/強勢追擊)】==========
+🎯 獵殺目標：[股票名稱] (代號) - 🌊 破浪：長線主升浪大妖股 [今日成交: XX張] 
+- 📊 進場邏輯深度解析：
+  【流動性檢視】：今日成交量為 [張數]張。
+  1. 【大人鎖碼護航】：過去20日法人強勢吸籌，季線向上發散，無視短線指標過熱。
+- 實戰設定步驟：(強勢股不輕易拉回，逢 MA5 或 MA10 買進，跌破 MA20 停損)
+
+請嚴格依照以上章節輸出（繁體中文），並保留所有特殊符號。
+"""
+SUMMARY_STATS = {}  # 最近一次總結提示詞的 Token 量測與刪減結果 (成本報告用)
+
+def estimate_tokens(text):
+    """粗估 Gemini Token 數：中日韓文字與符號約 1 字 1 Token，其餘約 4 字元 1 Token"""
+    wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+def count_prompt_tokens(prompt):
+    """送出前量測 Token 數：回應快取有同一份提示詞就直接用當時的計費數量，否則用 Gemini count_tokens (不計費)，
+    失敗時改用本地估算；回傳 (數量, 來源)"""
+    model = (models_to_try() or MODEL_CANDIDATES)[0]
+    hit = gemini_cache.get(model, prompt)
+    if hit: return int(hit["usage"].get("prompt_tokens") or estimate_tokens(prompt)), "快取"
+    if not ai_ready(): return estimate_tokens(prompt), "估算"
+    try:
+        throttle("gemini")
+        with timed_stage("gemini"): result = AI_CLIENT.models.count_tokens(model=model, contents=prompt)
+        return int(result.total_tokens), "count_tokens"
+    except Exception: return estimate_tokens(prompt), "估算"
+
+def _summary_tags(r):
+    """{分類標籤: 附註}"""
+    tags = {}
+    if r.get('is_incubation'): tags["A"] = ""
+    if r.get('is_first_golden_cross'): tags["B"] = ""
+    if r.get('is_intraday_breakout'): tags["C"] = ""
+    if r['is_golden']: tags["G"] = f"({r['golden_msg']})" if r.get('golden_msg') else ""
+    limit_up_score = get_limit_up_potential(r)[0]
+    if limit_up_score >= 60: tags["L"] = f"(潛力分{limit_up_score})"  # 加分理由 (均線/法人/量/漲幅) 都能由數據表看出，不再重複
+    if r.get('is_long_term'): tags["W"] = ""
+    return tags
+
+def _summary_rank(item):
+    r, tags = item
+    limit_up_score = get_limit_up_potential(r)[0]
+    return (-sum(1 for t in "ABCG" if t in tags), -limit_up_score, -r['score'], -r.get('v_today', 0))
+
+def _summary_row(r):
+    return (f"{r['id']}|{r['name']}|{r['p']}|{r.get('v_today', 0)}|{r.get('v_ma5', 0)}|{r['vol_r']}x|{r['d1']:+.2%}|"
+            f"{r['ma5']}|{r['ma10']}|{r['ma20']}|{r['ma60']}|{r['fs']}/{r['ss']}|{r['bias_20_str']}|{r.get('ma_alert') or '-'}")
+
+def render_summary_prompt(rows, omitted=0):
+    table = "\n".join(_summary_row(r) for r, _ in rows) or "(今日無任何分類候選股)"
+    if omitted: table += f"\n(另有 {omitted} 檔排序較後的候選股因篇幅省略)"
+    sections = []
+    for tag, title, empty in SUMMARY_SECTIONS:
+        ids = [f"{r['id']}{tags[tag]}" for r, tags in rows if tag in tags]
+        sections.append(f"【{title}】{'、'.join(ids) if ids else empty}")
+    return ("角色：你是頂尖、冷酷、極度重視風險管理的台股短線與波段量化操盤總監。\n"
+            "任務：根據今日技術數據，撰寫極度精準、具備絕對數據顆粒度(必須寫出實際價格與張數)的【戰略總結報告】。\n\n"
+            f"【最新市場數據庫】\n【個股數據表】{SUMMARY_COLUMNS}\n{table}\n\n" + "\n".join(sections) + "\n" + SUMMARY_RULES)
+
+def build_summary_prompt(data_list, budget=SUMMARY_TOKEN_BUDGET):
+    """回傳 (提示詞, 收錄檔數, 省略檔數)；本地估算超過 budget 時從排序尾端刪減候選股"""
+    rows = []
     for r in data_list:
-        if r.get('skip_ai'): continue 
-        
-        try:
-            stock_info = (
-                f"- {r['name']}({r['id']}) | 現價:{r['p']} | 分數:{r['score']} | "
-                f"MA5:{r['ma5']} | MA10:{r['ma10']} | MA20:{r['ma20']} | MA60:{r['ma60']} | "
-                f"日漲跌:{r['d1']:.2%} | 外資:{r['fs']}d 投信:{r['ss']}d | "
-                f"今日量:{r.get('v_today',0)}張 (量比:{r['vol_r']}x) | 訊號:{r['ma_alert']}\n"
-            )
-            if r['is_hold']: inventory_txt += stock_info
-            else: watchlist_txt += stock_info
-                
-            if r['is_golden']: golden_candidates += f"- {r['name']}({r['id']}) [今日成交:{r.get('v_today',0)}張]: {r['golden_msg']} (防守MA20: {r['ma20']})\n"
-            
-            if r.get('is_long_term'):
-                long_term_candidates_txt += f"- {r['name']}({r['id']}) [今日成交:{r.get('v_today',0)}張]: 🌊主力大週期鎖籌碼 (量{r['vol_r']}x) | 防守: {r['ma20']}\n"
-            
-            limit_up_score, limit_up_reason = get_limit_up_potential(r)
-            if limit_up_score >= 60:
-                limit_up_candidates_txt += f"- {r['name']}({r['id']}) [今日成交:{r.get('v_today',0)}張]: 潛力分{limit_up_score} ({limit_up_reason}) | 外:{r['fs']}d 投:{r['ss']}d\n"
-
-            if r.get('is_incubation'):
-                incubation_txt += f"- {r['name']}({r['id']}) [今日成交:{r.get('v_today',0)}張]: 籌碼連買(外{r['fs']}投{r['ss']}) | 乖離月線僅{r['bias_20_str']} | 量能溫和{r['vol_r']}x\n"
-                
-            if r.get('is_first_golden_cross'):
-                first_golden_cross_txt += f"- {r['name']}({r['id']}) [今日成交:{r.get('v_today',0)}張]: MA5({r['ma5']}) 剛穿越 MA20({r['ma20']}) 第一天 | 今日漲幅:{r['d1']:.2%}\n"
-                
-            if r.get('is_intraday_breakout'):
-                intraday_breakout_txt += f"- {r['name']}({r['id']}) [今日成交:{r.get('v_today',0)}張]: ⚡動能異動！漲幅達{r['d1']:.2%} | 量暴增{r['vol_r']}x\n"
+        if r.get('skip_ai'): continue
+        try: tags = _summary_tags(r)
+        except Exception: continue
+        if tags: rows.append((r, tags))
+    rows.sort(key=_summary_rank)
+    keep = len(rows)
+    while True:
+        prompt = render_summary_prompt(rows[:keep], len(rows) - keep)
+        if keep == 0 or estimate_tokens(prompt) <= budget: return prompt, keep, len(rows) - keep
+        keep -= 1
 
-        except: continue
-
-    if not incubation_txt: incubation_txt = "今日無符合 [底部潛伏] 標準之標的。"
-    if not first_golden_cross_txt: first_golden_cross_txt = "今日無符合 [黃金交叉第一根] 之標的。"
-    if not intraday_breakout_txt: intraday_breakout_txt = "今日無符合 [動能爆發] 之標的。"
-    if not limit_up_candidates_txt: limit_up_candidates_txt = "今日無明顯漲停特徵股。"
-    if not long_term_candidates_txt: long_term_candidates_txt = "今日無符合長線主升浪標準之標的。"
+def generate_and_save_summary(data_list, report_time_str):
+    if not ai_requested(): return "本次報告未包含 AI 總結"
 
-    prompt = f"""
-    角色：你是頂尖、冷酷、極度重視風險管理的台股短線與波段量化操盤總監。
-    任務：根據今日技術數據，撰寫極度精準、具備絕對數據顆粒度(必須寫出實際價格與張數)的【戰略總結報告】。
-    
-    【最新市場數據庫】
-    【🌱 引擎A：底部主力潛伏區 (提早1~3天卡位)】
-    {incubation_txt}
-    【✨ 引擎B：均線初升第一根 (MA5剛上穿MA20)】
-    {first_golden_cross_txt}
-    【⚡ 引擎C：動能即時爆發雷達】
-    {intraday_breakout_txt}
-    【🔥 今日黃金進場公式篩選】
-    {golden_candidates}
-    【🚀 今日漲停潛力股獵殺 (已經噴發之強勢股)】
-    {limit_up_candidates_txt}
-    【🌊 長線主升浪大妖股】
-    {long_term_candidates_txt}
-    
-    【❌ 鐵律：違反直接扣薪 ❌】：
-    1. 報告前段請依序精簡列出上述各大分類的標的狀態。
-    2. ✨【★ 明日券商 APP 智慧單下單精確設定】：
-        深度交叉比對上述所有引擎數據。
-        【優先級】：AI 總監必須「優先」從【引擎A】、【引擎B】、【引擎C】與【黃金公式】中挑選 A 與 B 級標的，以達到「買在起漲點」的目的；已噴發的強勢股盡量安排在 C 級。
-        你必須依據個股位階，將挑選出的標的嚴格分類為 A、B、C 三種等級，並必須維持這三個等級標題的輸出！
-        
-        【🚨 關鍵流動性與防漏空缺鐵律】：
-        - 必須在下單設定內明確標示【今日實際成交量】。
-        - 如果推薦的股票今日成交量【小於 500 張】，必須在標題一字不漏強制加上：
-          "⚠️ [冷門股防範：注意此股今日成交量低於500張，流動性極差，請嚴格控管資金或改採零股少量試單！]"
-        - 若某等級無符合標的，請在該等級標題下方強制輸出一行宣示文字：「今日無符合 [該等級名稱] 之推薦標的，嚴格控管資金風險。」
-        
-    ==========【等級 A 專屬模板 (底部潛伏/黃金交叉)】==========
-    🎯 獵殺目標：[股票名稱] (代號) - ✨ 特選：低位階尚未起飛股 [今日成交: XX張] 
-    - 📊 進場邏輯深度解析：
-      【流動性檢視】：今日成交量為 [張數]張 (對比5日均量 [張數]張)。
-      1. 【提早卡位】：符合引擎A或B，主力剛開始吸籌或均線剛交叉。
-      2. 【位階安全防禦】：股價距離月線極近，防守容易。
-    - 實戰設定步驟：
-      1. 觸發條件設定：當股價小於或等於 [MA5 + 0.1] 時。
-      2. 下單動作設定：以「限價 [MA5]」買入。
-      3. 終極安全帶（停損設定）：收盤跌破 MA20: [MA20] 立刻砍出。
-      
-    ==========【等級 B 專屬模板 (動能爆發/回測買點)】==========
-    🎯 獵殺目標：[股票名稱] (代號) - ⚡ 衝刺：初升段爆發/量縮回測股 [今日成交: XX張] 
-    - 📊 進場邏輯深度解析：
-      【流動性檢視】：今日成交量放大至 [張數]張。
-      1. 【動能確認】：符合引擎C 或 黃金公式，有明確攻擊量或完美的量縮回測。
-    - 實戰設定步驟：(同上，以MA5買進，跌破MA20停損)
-
-    ==========【等級 C 專屬模板 (長線/強勢追擊)】==========
-    🎯 獵殺目標：[股票名稱] (代號) - 🌊 破浪：長線主升浪大妖股 [今日成交: XX張] 
-    - 📊 進場邏輯深度解析：
-      【流動性檢視】：今日成交量為 [張數]張。
-      1. 【大人鎖碼護航】：過去20日法人強勢吸籌，季線向上發散，無視短線指標過熱。
-    - 實戰設定步驟：(強勢股不輕易拉回，逢 MA5 或 MA10 買進，跌破 MA20 停損)
-
-    請嚴格依照以上章節輸出（繁體中文），並保留所有特殊符號。
-    """
-
-    for model_name in MODEL_CANDIDATES:
-        try:
-            response = AI_CLIENT.models.generate_content(model=model_name, contents=prompt)
-            record_token_usage(response)  
-            return response.text
-        except:
-            time.sleep(2)
-            continue
-    return "AI 生成總結報告失敗"
+    budget = SUMMARY_TOKEN_BUDGET
+    for _ in range(3):
+        prompt, kept, omitted = build_summary_prompt(data_list, budget)
+        measured, source = count_prompt_tokens(prompt)
+        if measured <= SUMMARY_TOKEN_BUDGET or kept == 0: break
+        budget = int(budget * SUMMARY_TOKEN_BUDGET / measured)  # 本地估算偏低：依實測比例收緊估算上限後重新刪減
+    before = GLOBAL_TOKEN_BILLING["prompt_tokens"]
+    text = call_gemini(prompt)
+    SUMMARY_STATS.update({"prompt_tokens": measured, "source": source, "budget": SUMMARY_TOKEN_BUDGET, "stocks": kept, "omitted": omitted,
+                          "actual_prompt_tokens": GLOBAL_TOKEN_BILLING["prompt_tokens"] - before})  # 快取命中時實際用量為 0
+    return text or "AI 生成總結報告失敗"
+
+def summary_token_report():
+    if not SUMMARY_STATS: return "總結提示詞：本次未送出"
+    s = SUMMARY_STATS
+    return (f"總結提示詞：送出前量測 {s['prompt_tokens']:,} Tokens ({s['source']}，上限 {s['budget']:,})｜"
+            f"實際計費 {s['actual_prompt_tokens']:,} Tokens｜收錄 {s['stocks']} 檔、省略 {s['omitted']} 檔")
 
 # ==========================================
 # 6. 行情數據抓取核心
 # ==========================================
-def fetch_pro_metrics(stock_data):
+def fetch_pro_metrics(stock_data, with_ai=True):
+    """with_ai=False 時 ai_strategy 先留 None，由 fill_ai_strategies 批次補上"""
     sid, passed_name, is_hold, cost = stock_data['sid'], stock_data['name'], stock_data['is_hold'], stock_data['cost']
     stock, full_id = get_tw_stock(sid)
     if not stock: return None
     try:
-        df_hist = stock.history(period="8mo")
+        df_hist = price_store.get_history(full_id, "8mo")
         if len(df_hist) < 120: return None
-        info = stock.info
+        info = fundamentals_store.get_info(full_id)
         latest = df_hist.iloc[-1]
         prev = df_hist.iloc[-2]
         curr_p, curr_vol = latest['Close'], latest['Volume']
         today_amount = (curr_vol * curr_p) / 100_000_000
         
-        delta = df_hist['Close'].diff()
-        gain, loss = delta.where(delta > 0, 0).rolling(14).mean(), (-delta.where(delta < 0, 0)).rolling(14).mean()
-        clean_rsi = round(100 - (100 / (1 + (gain.iloc[-1] / loss.iloc[-1]))), 1) if loss.iloc[-1] != 0 else 50.0
+        # 📐 RSI 與均線直接查指標表
+        panel = panel_for(INDICATOR_PANEL, full_id, "8mo")
+        clean_rsi = round(panel.get(full_id, 'rsi'), 1) if panel.get(full_id, 'rsi_loss') != 0 else 50.0
         
         # 取得均線
-        ma5 = round(df_hist['Close'].rolling(5).mean().iloc[-1], 2)
-        ma10 = round(df_hist['Close'].rolling(10).mean().iloc[-1], 2)
-        ma20 = round(df_hist['Close'].rolling(20).mean().iloc[-1], 2)
-        ma60 = round(df_hist['Close'].rolling(60).mean().iloc[-1], 2)
-        
-        # 昨日均線
-        ma5_prev = round(df_hist['Close'].rolling(5).mean().iloc[-2], 2)
-        ma20_prev = round(df_hist['Close'].rolling(20).mean().iloc[-2], 2)
-        ma60_prev = round(df_hist['Close'].rolling(60).mean().iloc[-2], 2)
+        ma5 = round(panel.get(full_id, 'ma5'), 2)
+        ma10 = round(panel.get(full_id, 'ma10'), 2)
+        ma20 = round(panel.get(full_id, 'ma20'), 2)
+        ma60 = round(panel.get(full_id, 'ma60'), 2)
         
         bias_60 = ((curr_p - ma60) / ma60) * 100
         bias_20 = ((curr_p - ma20) / ma20) * 100
@@ -454,22 +622,18 @@ def fetch_pro_metrics(stock_data):
         is_golden, golden_msg = check_golden_entry(df_hist)
         raw_yield = info.get('dividendYield', 0) or 0
         
-        vol_ma5_val = df_hist['Volume'].iloc[-6:-1].mean()
-        vol_ratio = curr_vol / vol_ma5_val if vol_ma5_val > 0 else 0
+        vol_ma5_val = panel.get(full_id, 'vol_avg5')
+        vol_ratio = panel.get(full_id, 'vol_ratio5')
         pure_id = ''.join(filter(str.isdigit, sid))
         
         # 籌碼引擎
         fs_streak, ss_streak, fs_days, ss_days = get_inst_stats(pure_id) 
 
-        # 🚀【新增引擎 A】底部主力潛伏區
-        is_incubation = (abs(bias_20) <= 3.0) and (fs_streak >= 3 or ss_streak >= 3) and (1.0 <= vol_ratio <= 1.6)
-        
-        # 🚀【新增引擎 B】均線初升第一根
-        is_first_golden_cross = (ma5_prev <= ma20_prev) and (ma5 > ma20) and (curr_p > latest['Open'])
-        
-        # 🚀【新增引擎 C】盤中動能即時雷達
+        # 🚀 引擎 A 底部主力潛伏區 / B 均線初升第一根 / C 盤中動能即時雷達 / 長線大妖股：條件定義在 strategies.json 的 push 群組
+        sig = strategy_engine.row_for(SIGNALS, "push", panel, full_id, dict(zip(inst_store.STREAK_COLUMNS, (fs_streak, ss_streak, fs_days, ss_days))))
+        is_incubation, is_first_golden_cross = sig['is_incubation'], sig['is_first_golden_cross']
+        is_intraday_breakout, is_long_term_trend = sig['is_intraday_breakout'], sig['is_long_term_trend']
         d1_change = (curr_p / prev['Close']) - 1
-        is_intraday_breakout = (d1_change > 0.025) and (vol_ratio > 2.0)
 
         score = 5
         if (info.get('profitMargins', 0) or 0) > 0: score += 1
@@ -480,7 +644,7 @@ def fetch_pro_metrics(stock_data):
         if is_golden or is_incubation or is_first_golden_cross: score += 3
 
         # 加入 yfinance 備用產業資料，防止 FinMind 失效
-        map_name, industry = STOCK_INFO_MAP.get(str(sid), (sid, "其他/ETF"))
+        map_name, industry = stock_info_map().get(str(sid), (sid, "其他/ETF"))
         if not industry or industry == "其他/ETF":
             industry = info.get('sector', info.get('industry', '其他/ETF'))
         final_stock_name = passed_name if passed_name else map_name
@@ -488,9 +652,6 @@ def fetch_pro_metrics(stock_data):
 
         vol_today_lots = int(curr_vol / 1000) if not pd.isna(curr_vol) else 0
         vol_ma5_lots = int(vol_ma5_val / 1000) if not pd.isna(vol_ma5_val) else 0
-        
-        # 長線大妖股
-        is_long_term_trend = (curr_p > ma20 and curr_p > ma60 and ma60 > ma60_prev and (fs_days + ss_days >= 12) and vol_ratio > 1.0)
 
         res = {
             "id": f"{sid}{market_label}", "name": final_stock_name, "score": score, "rsi": clean_rsi, "industry": industry,
@@ -525,20 +686,50 @@ def fetch_pro_metrics(stock_data):
         elif score >= 8: res["hint"] = "🚀強勢進攻"
         else: res["hint"] = "👀持續追蹤"
         
-        res['ai_strategy'] = get_gemini_strategy(res)
+        res['ai_strategy'] = get_gemini_strategy(res) if with_ai else None
         return res
     except: return None
 
+# ==========================================
+# 6-1. ♻️ 結果快取：資料沒變的股票直接沿用上次的結果列與 AI 策略
+# ==========================================
+# 指紋 = 最新K棒 (日期/收盤/量) + 籌碼資料日期 + WATCH_LIST 該列輸入 + 策略規則 + 是否要求 AI；
+# 同一天手動重跑時，指紋相同的股票不再抓資料、不再呼叫 Gemini (連 AI 連線測試都不做)，也不用逐檔等待。
+AI_RETRY_TEXTS = ("AI 連線忙碌中",)  # 暫時性失敗不寫入快取，下次重新詢問
+AI_OFF_TEXT = "AI 服務暫停"  # 要求 AI 但連線測試失敗時同樣不寫入快取
+
+def _result_cache_path():
+    return cache_path("push_results.json")
+
+def load_result_cache():
+    try:
+        with open(_result_cache_path(), "r", encoding="utf-8") as f: return json.load(f)
+    except Exception: return {}
+
+def save_result_cache(cache):
+    path = _result_cache_path()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(cache, f, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+    os.replace(tmp, path)
+
+def rules_digest():
+    try:
+        with open(strategy_engine.STRATEGY_FILE, "rb") as f: return hashlib.sha1(f.read()).hexdigest()
+    except OSError: return None
+
+def result_fingerprint(stock_data, full_id, chip_date, rules):
+    """無法取得本地K線時回傳 None (一律重新計算)"""
+    df, _ = price_store.read_cached(full_id)
+    if df is None or df.empty: return None
+    last = df.iloc[-1]
+    inputs = [stock_data['sid'], stock_data['name'], stock_data['is_hold'], stock_data['cost'], stock_data.get('skip_ai', False)]
+    key = [full_id, df.index[-1].strftime('%Y-%m-%d'), float(last['Close']), float(last['Volume']), chip_date, rules, ai_requested(), inputs]
+    return hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()
+
 def get_tw_stock(sid):
-    clean_id = str(sid).strip().upper()
-    suffixes = [".TWO", ".TW"] if clean_id.startswith(('3', '4', '5', '6', '8')) else [".TW", ".TWO"]
-    for suffix in suffixes:
-        target = f"{clean_id}{suffix}"
-        try:
-            hist = yf.Ticker(target).history(period="5d")
-            if not hist.empty: return yf.Ticker(target), target
-        except: continue
-    return None, None
+    target = ticker_resolver.resolve(sid)
+    if not target: return None, None
+    return yf.Ticker(target), target
 
 def send_email(subject, body):
     if not MAIL_USER or not MAIL_PASS: return
@@ -550,24 +741,153 @@ def send_email(subject, body):
         print("✅ 郵件發送成功")
     except: print("❌ 郵件失敗")
 
+def push_line(text):
+    if not LINE_ACCESS_TOKEN: return
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {LINE_ACCESS_TOKEN}"}
+    payload = {"to": LINE_USER_ID, "messages": [{"type": "text", "text": text}]}
+    with timed_stage("line"): requests.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload)
+
+# ==========================================
+# 7. ⏱️ 盤中即時監控 (--watch)
+# ==========================================
+# 開盤期間每 WATCH_INTERVAL 秒批次抓一次 WATCH_LIST 的當日K棒，只把「今天這一根」套到昨天收盤的指標狀態上
+# (indicator_state 增量計算，不重算 8 個月歷史)；動能爆發 / 均線突破 / 黃金買點由 False 轉 True 的當下推播 LINE，
+# 訊號消失後重新待命，再次成立會再推播一次。
+WATCH_INTERVAL = int(os.getenv("WATCH_INTERVAL", "60"))
+WATCH_END = datetime.time(14, 30)
+WATCH_SIGNALS = [("is_intraday_breakout", "⚡動能爆發"), ("is_first_golden_cross", "✨均線突破"), ("is_golden", "🔥黃金買點")]
+GOLDEN_TAIL = 70  # check_golden_entry 至少需要 65 根
+
+def prepare_watch(watch_data_list):
+    """監控開始前一次性準備：每檔指標狀態推進到昨天收盤，保留黃金買點需要的近期K棒與籌碼連買數 (盤中不變)"""
+    today = tw_now().date()
+    stock_info_map()  # 先載入台股清單，代號後綴直接查表不必逐檔探測
+    targets = {}
+    for d in watch_data_list:
+        t = ticker_resolver.resolve(d['sid'])
+        if t: targets.setdefault(t, d)
+    price_store.prefetch(list(targets), "8mo")
+
+    base = {}
+    with timed_stage("indicators"):
+        for t, d in targets.items():
+            df = price_store.get_history(t, "8mo")
+            committed = df[df.index.date < today]
+            if len(committed) < 2: continue
+            name = d['name'] or stock_info_map().get(str(d['sid']), (d['sid'], ""))[0]
+            base[t] = {"sid": d['sid'], "name": name, "state": indicator_state.advance(t, committed),
+                       "tail": committed.iloc[-GOLDEN_TAIL:], "length": len(committed) + 1}
+        indicator_state.save()
+
+    sids = [''.join(filter(str.isdigit, t.split('.')[0])) for t in base]
+    chips = inst_store.streak_vectors(sids)
+    for j, (t, sid) in enumerate(zip(base, sids)):
+        values = [v[j] for v in chips.values()] if chips else get_inst_stats(sid)
+        base[t]["chips"] = dict(zip(inst_store.STREAK_COLUMNS, values))
+    return base
+
+def watch_tick(base, flags):
+    """抓一次今日K棒並更新訊號，回傳本次新成立的 [(代號, [訊號], 前一根, 最新一根)]；flags 記錄各檔目前成立的訊號"""
+    today = tw_now().date()
+    tickers = list(base)
+    quotes = {}
+    for i in range(0, len(tickers), price_store.BATCH_SIZE):
+        quotes.update(price_store.download_batch(tickers[i:i + price_store.BATCH_SIZE], today.strftime('%Y-%m-%d')))
+
+    live, rows, lengths, golden = [], [], [], {}
+    with timed_stage("indicators"):
+        for t in tickers:
+            bar = quotes.get(t)
+            if bar is None or bar.empty or bar.index[-1].date() != today: continue  # 尚未開盤或今日無成交
+            b = base[t]
+            latest = indicator_state.step(copy.deepcopy(b["state"]), today.strftime('%Y-%m-%d'), *(float(bar[c].iloc[-1]) for c in price_store.PRICE_COLUMNS))
+            live.append(t); rows.append((dict(b["state"]["out"]), latest)); lengths.append(b["length"])
+            golden[t] = check_golden_entry(pd.concat([b["tail"], bar.iloc[-1:]]))[0]
+        if not live: return []
+        panel = indicator_state.rows_to_panel(live, rows, lengths)
+        chips = {c: np.array([base[t]["chips"][c] for t in live], dtype=float) for c in inst_store.STREAK_COLUMNS}
+        signals = strategy_engine.evaluate("push", panel, extra=chips)
+
+    fired = []
+    for t, (prev, latest) in zip(live, rows):
+        row = dict(signals.row(t), is_golden=golden[t])
+        active = {key for key, _ in WATCH_SIGNALS if row[key]}
+        new = [label for key, label in WATCH_SIGNALS if key in active and key not in flags.get(t, set())]
+        flags[t] = active
+        if new: fired.append((t, new, prev, latest))
+    return fired
+
+def format_watch_alert(base, fired):
+    lines = [f"🚨 【盤中即時訊號】{tw_now().strftime('%H:%M')}"]
+    for t, labels, prev, latest in fired:
+        b = base[t]
+        change = latest['close'] / prev['close'] - 1
+        lines.append(f"\n{b['name']} ({b['sid']}) {' '.join(labels)}\n現價 {latest['close']:.2f} ({change:+.1%})｜量比 {latest['vol_ratio5']:.1f}x")
+    return "\n".join(lines)
+
+def watch(interval=WATCH_INTERVAL, once=False):
+    """盤中監控主迴圈：開盤前啟動會等到開盤，收盤後自動結束；once 只跑一輪 (測試用)"""
+    watch_data_list = get_watch_list_from_sheet()
+    if not watch_data_list: return
+    base = prepare_watch(watch_data_list)
+    print(f"⏱️ 盤中監控啟動：{len(base)} 檔，每 {interval} 秒更新一次")
+    flags, alerts = {}, 0
+    while True:
+        if once or is_market_open():
+            try:
+                fired = watch_tick(base, flags)
+            except Exception as e:
+                print(f"⚠️ 盤中行情更新失敗，下一輪重試: {e}")
+                fired = []
+            if fired:
+                push_line(format_watch_alert(base, fired))
+                alerts += len(fired)
+                print(f"🚨 {', '.join(base[t]['name'] for t, *_ in fired)} 觸發盤中訊號")
+        now = tw_now()
+        if once or now.weekday() >= 5 or now.time() >= WATCH_END: break
+        time.sleep(interval)
+    print(f"⏱️ 盤中監控結束：共推播 {alerts} 檔次訊號")
+
 # ==========================================
 # 8. 主程式執行區塊
 # ==========================================
 def main():
-    current_time = (datetime.datetime.utcnow() + datetime.timedelta(hours=8)).strftime('%Y-%m-%d %H:%M')
+    global INDICATOR_PANEL, SIGNALS
+    current_time = tw_now().strftime('%Y-%m-%d %H:%M')
     watch_data_list = get_watch_list_from_sheet()
     if not watch_data_list: return
 
-    results_line, results_sheet = [], []
-    for idx, stock_data in enumerate(watch_data_list):
-        res = fetch_pro_metrics(stock_data)
-        if res:
-            results_line.append(res)
-            results_sheet.append([current_time, res['id'], res['name'], "📦庫存" if res['is_hold'] else "👀觀察", res['score'], res['rsi'], res['industry'], res['bias_str'], res['vol_str'], res['fs'], res['ss'], res['p'], res['yield'], res['amt_t'], res['d1'], res['d5'], res['m1'], res['m6'], res['risk'], res['trend'], res['hint'], res['ai_strategy']])
-        if idx < len(watch_data_list) - 1: time.sleep(2.0)
+    # 📦 WATCH_LIST 一次批次更新K線並算好指標表 (先載入台股清單，代號後綴直接查表不必逐檔探測)
+    stock_info_map()
+    tickers = [t for t in (ticker_resolver.resolve(d['sid']) for d in watch_data_list) if t]
+    price_store.prefetch(tickers, "8mo")
+    INDICATOR_PANEL = IndicatorPanel.from_store(tickers, "8mo")
+    chips = inst_store.streak_vectors([''.join(filter(str.isdigit, t.split('.')[0])) for t in INDICATOR_PANEL.tickers])
+    SIGNALS = strategy_engine.evaluate("push", INDICATOR_PANEL, extra=chips) if chips else None
+
+    result_cache, entries = load_result_cache(), []
+    chip_date, rules = inst_store.latest_date(), rules_digest()
+    reused = computed = 0
+    for stock_data in watch_data_list:
+        full_id = ticker_resolver.resolve(stock_data['sid'])
+        fp = result_fingerprint(stock_data, full_id, chip_date, rules) if full_id else None
+        cached = result_cache.get(stock_data['sid'])
+        if fp and cached and cached.get("fp") == fp:
+            res = cached["res"]
+            reused += 1
+        else:
+            res = fetch_pro_metrics(stock_data, with_ai=False)
+            computed += 1
+        if res: entries.append((stock_data['sid'], fp, res))
+
+    results_line = [res for _, _, res in entries]
+    fill_ai_strategies(results_line)
+    retry_texts = AI_RETRY_TEXTS + ((AI_OFF_TEXT,) if ai_requested() else ())
+    save_result_cache({sid: {"fp": fp, "res": res} for sid, fp, res in entries if fp and res['ai_strategy'] not in retry_texts})
+    results_sheet = [[current_time, res['id'], res['name'], "📦庫存" if res['is_hold'] else "👀觀察", res['score'], res['rsi'], res['industry'], res['bias_str'], res['vol_str'], res['fs'], res['ss'], res['p'], res['yield'], res['amt_t'], res['d1'], res['d5'], res['m1'], res['m6'], res['risk'], res['trend'], res['hint'], res['ai_strategy']] for res in results_line]
+    print(f"♻️ 資料未變動沿用上次結果 {reused} 檔，重新計算 {computed} 檔")
     
     if results_line:
-        time.sleep(10) 
         summary_text = generate_and_save_summary(results_line, current_time)
         
         report_sheet_url = sync_to_sheets(results_sheet)
@@ -583,41 +903,50 @@ def main():
         print(f"🔹 AI API 呼叫總次數：{GLOBAL_TOKEN_BILLING['api_calls']} 次")
         print(f"🔹 總消耗 Tokens：{GLOBAL_TOKEN_BILLING['total_tokens']:,}")
         print(f"🔹 預估本次花費台幣：NT$ {twd_cost} 元")
+        print(f"🔹 {cache_report()}")
+        print(f"🔹 {summary_token_report()}")
         print("==========================================\n")
         
-        try:
-            client = get_gspread_client()
-            if client:
-                spreadsheet = client.open("全能金流診斷報表")
-                log_execution_cost_to_sheets(spreadsheet, current_time, twd_cost)
+        with timed_stage("sheets"):  # 戰略分頁排版 (含成本紀錄)
+            try:
+                client = get_gspread_client()
+                if client:
+                    spreadsheet = client.open("全能金流診斷報表")
+                    log_execution_cost_to_sheets(spreadsheet, current_time, twd_cost)
                 
-                try: s_sheet = spreadsheet.worksheet(current_time); s_sheet.clear()
-                except: s_sheet = spreadsheet.add_worksheet(title=current_time, rows=150, cols=10)
+                    try: s_sheet = spreadsheet.worksheet(current_time); s_sheet.clear()
+                    except: s_sheet = spreadsheet.add_worksheet(title=current_time, rows=150, cols=10)
                 
-                lines_list = [[line] for line in summary_text.split('\n')]
-                s_sheet.update(values=lines_list, range_name='A1')  
+                    lines_list = [[line] for line in summary_text.split('\n')]
+                    s_sheet.update(values=lines_list, range_name='A1')  
                 
-                body_requests = []
-                for row_idx in range(1, len(lines_list) + 1):
-                    body_requests.append({"mergeCells": {"range": {"sheetId": s_sheet.id, "startRowIndex": row_idx - 1, "endRowIndex": row_idx, "startColumnIndex": 0, "endColumnIndex": 5}, "mergeType": "MERGE_ROWS"}})
-                body_requests.append({"updateDimensionProperties": {"range": {"sheetId": s_sheet.id, "dimension": "COLUMNS", "startIndex": 0, "endIndex": 5}, "properties": {"pixelSize": 140}, "fields": "pixelSize"}})
+                    body_requests = []
+                    for row_idx in range(1, len(lines_list) + 1):
+                        body_requests.append({"mergeCells": {"range": {"sheetId": s_sheet.id, "startRowIndex": row_idx - 1, "endRowIndex": row_idx, "startColumnIndex": 0, "endColumnIndex": 5}, "mergeType": "MERGE_ROWS"}})
+                    body_requests.append({"updateDimensionProperties": {"range": {"sheetId": s_sheet.id, "dimension": "COLUMNS", "startIndex": 0, "endIndex": 5}, "properties": {"pixelSize": 140}, "fields": "pixelSize"}})
                 
-                if body_requests: spreadsheet.batch_update({"requests": body_requests})
-                s_sheet.format("A1:E150", {"wrapStrategy": "WRAP", "verticalAlignment": "TOP", "textFormat": {"fontSize": 10, "fontFamily": "Microsoft JhengHei"}})
-        except Exception as e: print(f"⚠️ 建立圖2排版戰略分頁失敗: {e}")
+                    if body_requests: spreadsheet.batch_update({"requests": body_requests})
+                    s_sheet.format("A1:E150", {"wrapStrategy": "WRAP", "verticalAlignment": "TOP", "textFormat": {"fontSize": 10, "fontFamily": "Microsoft JhengHei"}})
+            except Exception as e: print(f"⚠️ 建立圖2排版戰略分頁失敗: {e}")
 
         line_quota_html = line_quota_report.replace('\n', '<br>')
-        cost_report_html = f"<div style='background-color:#fff9db; padding:15px; border-left:5px solid #fcc419; margin-top:20px; font-family:sans-serif;'><h3 style='margin-top:0; color:#e67e22;'>💰 今日運作成本診斷報告</h3><p><b>【雲端主報表連結】</b><br>- 🔗 <a href='{report_sheet_url}'>點擊前往查看數據報表</a></p><p><b>【Gemini API 帳單】</b><br>- 消耗總 Tokens：<span style='color:#d9480f;'>{GLOBAL_TOKEN_BILLING['total_tokens']:,}</span><br>- 預估台幣費用：<span style='color:#c92a2a;'><b>NT$ {twd_cost} 元</b></span></p><p style='margin-bottom:0;'><b>【LINE Bot 免費額度】</b><br>{line_quota_html}</p></div>"
+        cost_report_html = f"<div style='background-color:#fff9db; padding:15px; border-left:5px solid #fcc419; margin-top:20px; font-family:sans-serif;'><h3 style='margin-top:0; color:#e67e22;'>💰 今日運作成本診斷報告</h3><p><b>【雲端主報表連結】</b><br>- 🔗 <a href='{report_sheet_url}'>點擊前往查看數據報表</a></p><p><b>【Gemini API 帳單】</b><br>- 消耗總 Tokens：<span style='color:#d9480f;'>{GLOBAL_TOKEN_BILLING['total_tokens']:,}</span><br>- 預估台幣費用：<span style='color:#c92a2a;'><b>NT$ {twd_cost} 元</b></span><br>- {cache_report()}</p><p style='margin-bottom:0;'><b>【LINE Bot 免費額度】</b><br>{line_quota_html}</p></div>"
 
         email_body = f"<html><body><h2>📊 {current_time} 提前攔截戰略報告</h2><pre style='font-family:sans-serif; white-space:pre-wrap;'>{summary_text}</pre><hr>{cost_report_html}</body></html>"
         send_email(f"[{current_time}] 台股 AI 初升段戰報 (附成本與 LINE 額度)", email_body)
 
         if LINE_ACCESS_TOKEN:
-            line_msg = f"📊 【{current_time} 戰略報告已更新】\n\n全新【提前攔截初升段】引擎已發動！AI 總監已為您優先從底部潛伏與剛突破的標的中進行精選。\n\n🔗 點擊直達雲端主報表：\n{report_sheet_url}\n\n── 💸 今日 AI 帳單明細 ──\n🔹 總消耗 Tokens：{GLOBAL_TOKEN_BILLING['total_tokens']:,}\n💰 今日預估費用：NT$ {twd_cost} 元\n\n{line_quota_report}"
-            headers = {"Content-Type": "application/json", "Authorization": f"Bearer {LINE_ACCESS_TOKEN}"}
-            payload = {"to": LINE_USER_ID, "messages": [{"type": "text", "text": line_msg}]}
-            requests.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload)
+            line_msg = f"📊 【{current_time} 戰略報告已更新】\n\n全新【提前攔截初升段】引擎已發動！AI 總監已為您優先從底部潛伏與剛突破的標的中進行精選。\n\n🔗 點擊直達雲端主報表：\n{report_sheet_url}\n\n── 💸 今日 AI 帳單明細 ──\n🔹 總消耗 Tokens：{GLOBAL_TOKEN_BILLING['total_tokens']:,}\n💰 今日預估費用：NT$ {twd_cost} 元\n{cache_report()}\n\n{line_quota_report}\n\n{stage_summary()}"
+            push_line(line_msg)
             print("✅ 終極完全體【初升段攔截雷達】已全面部署成功！")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="WATCH_LIST 戰略報告 / 盤中即時監控")
+    parser.add_argument("--watch", action="store_true", help="盤中即時監控：每隔 --interval 秒更新最新K棒，訊號成立當下推播 LINE")
+    parser.add_argument("--interval", type=int, default=WATCH_INTERVAL, help=f"監控更新間隔秒數 (預設 {WATCH_INTERVAL})")
+    parser.add_argument("--once", action="store_true", help="監控只跑一輪 (不論是否開盤)")
+    args = parser.parse_args()
+    try:
+        if args.watch: watch(args.interval, args.once)
+        else: main()
+    finally: save_run_report("DailyStockPush_watch" if args.watch else "DailyStockPush", ai_calls=GLOBAL_TOKEN_BILLING["api_calls"], ai_cache_hits=GLOBAL_TOKEN_BILLING["cache_hits"], summary_prompt=SUMMARY_STATS)
@@ -1,9 +1,13 @@
-import os, yfinance as yf, pandas as pd, requests, datetime, time, sys
+import os, pandas as pd, requests, datetime, time, sys
 import gspread
 import json
 import logging  # [新增] 引入 logging 模組
 from oauth2client.service_account import ServiceAccountCredentials
 from ta.momentum import RSIIndicator
+import price_store
+import ticker_resolver
+import inst_store
+import fundamentals_store
 
 # ==========================================
 # 0. Log 設定 (新增部分)
@@ -46,11 +50,18 @@ def get_stock_name_map():
     try:
         df, _ = get_finmind_data("TaiwanStockInfo", "", "2025-01-01")
         if not df.empty and 'stock_id' in df.columns:
+            ticker_resolver.update_from_stock_info(df)
             return {str(row['stock_id']): row['stock_name'] for _, row in df.iterrows()}
         return {}
     except: return {}
 
-STOCK_NAME_MAP = get_stock_name_map()
+_STOCK_NAME_MAP = None
+
+def stock_name_map():
+    """第一次診斷時才下載台股清單 (同時更新 ticker_resolver 的市場別)，之後沿用；import 本模組不連網"""
+    global _STOCK_NAME_MAP
+    if _STOCK_NAME_MAP is None: _STOCK_NAME_MAP = get_stock_name_map()
+    return _STOCK_NAME_MAP
 
 def get_gspread_client():
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
@@ -104,9 +115,9 @@ def get_detailed_chips(sid_clean, specific_ticker=None):
     try:
         start_d = (datetime.date.today() - datetime.timedelta(days=40)).strftime('%Y-%m-%d')
         
-        # --- 1. 法人買賣超 (FinMind) ---
-        df_i, _ = get_finmind_data("TaiwanStockInstitutionalInvestorsBuySell", sid_clean, start_d)
-        if not df_i.empty:
+        # --- 1. 法人買賣超 (本地法人資料庫已齊全就直接查，否則單檔查詢) ---
+        df_i = inst_store.get_stock_frame(sid_clean, sync=False)
+        if df_i is not None and not df_i.empty:
             def streak(name):
                 d = df_i[df_i['name'] == name].sort_values('date', ascending=False)
                 c = 0
@@ -145,8 +156,8 @@ def get_detailed_chips(sid_clean, specific_ticker=None):
 
     # --- 3. 量能計算 (Yahoo Finance) ---
     try:
-        target = specific_ticker if specific_ticker else (f"{sid_clean}.TW" if int(sid_clean) < 9000 else f"{sid_clean}.TWO")
-        h = yf.Ticker(target).history(period="10d")
+        target = specific_ticker or ticker_resolver.resolve(sid_clean)
+        h = price_store.get_history(target, "10d")
         if not h.empty and len(h) >= 2:
             v_today, v_avg = h['Volume'].iloc[-1], h['Volume'].iloc[-6:-1].mean()
             chips["v_ratio"] = round(v_today / v_avg, 1) if v_avg > 0 else 0
@@ -159,27 +170,22 @@ def run_diagnostic(sid):
     try:
         logging.info(f"🔎 開始診斷股票: {sid}")
         clean_id = str(sid).split('.')[0].strip()
+        names = stock_name_map()
         
-        # --- 市場判斷邏輯 ---
-        tk_str = f"{clean_id}.TW"
-        stock = yf.Ticker(tk_str)
-        df = stock.history(period="1y")
-        
-        if df.empty:
-            tk_str = f"{clean_id}.TWO"
-            stock = yf.Ticker(tk_str)
-            df = stock.history(period="1y")
+        # --- 市場判斷邏輯 (後綴對照表，查不到才探測) ---
+        tk_str = ticker_resolver.resolve(clean_id)
+        df = price_store.get_history(tk_str, "1y") if tk_str else None
             
-        if df.empty:
+        if df is None or df.empty:
             logging.warning(f"❌ 找不到股票 {clean_id} 的數據")
             return None, None
+        info = fundamentals_store.get_info(tk_str)
         
-        ch_name = STOCK_NAME_MAP.get(clean_id, stock.info.get('shortName', '未知'))
+        ch_name = names.get(clean_id, info.get('shortName', '未知'))
         curr_p = round(df.iloc[-1]['Close'], 2)
         ma60 = df['Close'].rolling(60).mean().iloc[-1]
         rsi = round(RSIIndicator(df['Close']).rsi().iloc[-1], 1)
         
-        info = stock.info
         eps = info.get('trailingEps', 0) or 0
         margin = round((info.get('grossMargins', 0) or 0) * 100, 1)
         pe = info.get('trailingPE', 0) or "N/A"
@@ -0,0 +1,143 @@
+import argparse, json, time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import price_store
+import ticker_resolver
+import inst_store
+import strategy_engine
+from indicator_panel import IndicatorPanel
+from stock_common import tw_now
+
+# ==========================================
+# 向量化歷史回測：在 日期 × 股票 指標表上重播 strategies.json 的策略
+# ==========================================
+# 每個策略群組在整段歷史上一次算出布林遮罩 (與每日選股用的是同一份設定)，
+# 再用位移後的收盤價矩陣一次算出所有訊號的未來報酬、命中率與最大不利幅度，全程沒有逐檔迴圈。
+# 進場價以訊號當天收盤計。本地法人資料庫只保留近 35 天，長期回測預設不看籌碼 (--chips ignore)；
+# --chips history 時只有資料庫涵蓋的日期有值，報表會列出有籌碼資料的K棒比例。
+HORIZONS = (1, 5, 10, 20)
+CHIP_MODES = ("history", "ignore")
+
+def load_panel(tickers, period="3y"):
+    """從K線快取 (必要時先批次補齊) 組出依日期對齊的完整歷史指標表"""
+    price_store.prefetch(tickers, period)
+    frames = {}
+    for t in tickers:
+        try: frames[t] = price_store.get_history(t, period)
+        except Exception: continue
+    return IndicatorPanel.from_frames(frames, align_dates=True)
+
+def chip_fields(panel, mode="ignore"):
+    """法人連買欄位 (日期 × 股票)；ignore 模式全部設為無限大，讓籌碼條件一律成立，只回測價量部分。
+    mode 也可直接傳入已算好的欄位 {名稱: 陣列}"""
+    if isinstance(mode, dict): return mode
+    shape = panel.fields["close"].shape
+    if mode == "ignore": return {c: np.full(shape, np.inf) for c in inst_store.STREAK_COLUMNS}
+    return inst_store.streak_history(panel.dates, [t.split('.')[0] for t in panel.tickers])
+
+def chip_coverage(panel, fields):
+    """有法人連買資料的K棒數與全部K棒數 (ignore 模式視為全部涵蓋)"""
+    bars = ~np.isnan(panel.fields["close"])
+    covered = bars & ~np.isnan(fields[inst_store.STREAK_COLUMNS[0]])
+    return {"covered_bars": int(covered.sum()), "total_bars": int(bars.sum())}
+
+def print_chip_coverage(coverage):
+    ratio = coverage["covered_bars"] / coverage["total_bars"] if coverage["total_bars"] else 0.0
+    print(f"🏦 法人連買涵蓋：{coverage['covered_bars']:,} / {coverage['total_bars']:,} 根K棒 ({ratio:.1%})"
+          + ("，其餘K棒的籌碼條件一律不成立" if ratio < 1 else ""))
+
+def forward_returns(close, horizon):
+    """第 t 列 = 持有 horizon 根K棒後的報酬 (資料不足為 NaN)"""
+    out = np.full(close.shape, np.nan)
+    if len(close) > horizon: out[:-horizon] = close[horizon:] / close[:-horizon] - 1
+    return out
+
+def forward_drawdown(close, low, horizon):
+    """第 t 列 = 之後 horizon 根K棒內最低價相對進場收盤的跌幅 (最大不利幅度，<= 0 才有意義)"""
+    out = np.full(close.shape, np.nan)
+    if len(close) > horizon:
+        future_low = np.fmin.reduce(sliding_window_view(low[1:], horizon, axis=0), axis=-1)
+        out[:len(future_low)] = np.minimum(future_low / close[:len(future_low)] - 1, 0)
+    return out
+
+def portfolio_drawdown(mask, close):
+    """每天等權持有前一天出訊號的股票一天，回傳 (累積報酬, 最大回落)"""
+    daily = np.full(close.shape, np.nan)
+    daily[1:] = close[1:] / close[:-1] - 1
+    held = np.zeros(close.shape, dtype=bool)
+    held[1:] = mask[:-1]
+    picks = np.where(held & ~np.isnan(daily), daily, 0.0)
+    count = (held & ~np.isnan(daily)).sum(axis=1)
+    port = np.divide(picks.sum(axis=1), count, out=np.zeros(len(count)), where=count > 0)
+    equity = np.cumprod(1 + port)
+    if not len(equity): return 0.0, 0.0
+    return float(equity[-1] - 1), float((equity / np.maximum.accumulate(equity) - 1).min())
+
+def summarize(mask, close, returns, drawdowns):
+    """單一策略的回測統計：訊號數、各持有期命中率/平均/中位數報酬、平均最大不利幅度、等權組合回落"""
+    result = {"signals": int(mask.sum()), "days_active": int(mask.any(axis=1).sum())}
+    for h in returns:
+        r = returns[h][mask]
+        r = r[~np.isnan(r)]
+        dd = drawdowns[h][mask]
+        dd = dd[~np.isnan(dd)]
+        result[f"{h}d"] = {
+            "n": int(len(r)),
+            "hit_rate": round(float((r > 0).mean()), 4) if len(r) else None,
+            "mean": round(float(r.mean()), 4) if len(r) else None,
+            "median": round(float(np.median(r)), 4) if len(r) else None,
+            "avg_drawdown": round(float(dd.mean()), 4) if len(dd) else None,
+        }
+    total, mdd = portfolio_drawdown(mask, close)
+    result["portfolio_return"], result["portfolio_max_drawdown"] = round(total, 4), round(mdd, 4)
+    return result
+
+def run(group, panel, chips="ignore", horizons=HORIZONS):
+    """回測整個策略群組：回傳 {策略名稱: 統計}，只統計布林型的策略 (略過衍生數值)"""
+    close, low = panel.fields["close"], panel.fields["low"]
+    values = strategy_engine.evaluate_history(group, panel, extra=chip_fields(panel, chips))
+    returns = {h: forward_returns(close, h) for h in horizons}
+    drawdowns = {h: forward_drawdown(close, low, h) for h in horizons}
+    return {name: summarize(np.asarray(mask), close, returns, drawdowns) for name, mask in values.items() if mask.dtype == bool}
+
+def print_report(group, results, horizon):
+    print(f"\n📊 【{group}】回測結果 (持有 {horizon} 日)")
+    for name, r in results.items():
+        h = r.get(f"{horizon}d", {})
+        hit = f"{h['hit_rate']:.1%}" if h.get("hit_rate") is not None else "-"
+        mean = f"{h['mean']:+.2%}" if h.get("mean") is not None else "-"
+        dd = f"{h['avg_drawdown']:+.2%}" if h.get("avg_drawdown") is not None else "-"
+        print(f"  {name:<24} 訊號 {r['signals']:>6}  命中 {hit:>6}  平均 {mean:>7}  不利 {dd:>7}  組合回落 {r['portfolio_max_drawdown']:+.1%}")
+
+if __name__ == "__main__":
+    # 用法：python backtest.py --group v14 push --period 3y [--chips history] [--output backtest.json] [代號 ...]
+    # 不指定代號則回測後綴對照表內的全市場股票
+    parser = argparse.ArgumentParser(description="strategies.json 策略的向量化歷史回測")
+    parser.add_argument("tickers", nargs="*", help="完整代號 (含 .TW/.TWO)")
+    parser.add_argument("--group", nargs="+", default=["v14", "push", "pro"], help="要回測的策略群組")
+    parser.add_argument("--period", default="3y", help="回測期間 (yfinance period 字串)")
+    parser.add_argument("--chips", choices=CHIP_MODES, default="ignore",
+                        help="法人連買來源：ignore=不看籌碼 (預設)，history=本地法人資料庫 (只涵蓋近 35 天)")
+    parser.add_argument("--horizon", type=int, default=5, choices=HORIZONS, help="報表顯示的持有天數")
+    parser.add_argument("--output", help="另存完整結果 JSON")
+    args = parser.parse_args()
+
+    targets = args.tickers or ticker_resolver.known_tickers()
+    t0 = time.time()
+    panel = load_panel(targets, args.period)
+    print(f"📐 歷史指標表：{len(panel.tickers)} 檔 × {len(panel.dates)} 日，耗時 {time.time() - t0:.1f} 秒")
+
+    chips = chip_fields(panel, args.chips)
+    coverage = chip_coverage(panel, chips)
+    print_chip_coverage(coverage)
+
+    report = {"generated_at": tw_now().isoformat(timespec='seconds'), "period": args.period, "chips": args.chips, "chip_coverage": coverage,
+              "tickers": len(panel.tickers), "days": len(panel.dates), "groups": {}}
+    for group in args.group:
+        t1 = time.time()
+        report["groups"][group] = run(group, panel, chips)
+        print_report(group, report["groups"][group], args.horizon)
+        print(f"  ⏱️ 耗時 {time.time() - t1:.2f} 秒")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 已輸出 {args.output}")
@@ -0,0 +1,224 @@
+import argparse, datetime, json, os, resource, subprocess, sys, time
+
+# ==========================================
+# 端到端效能基準：在錄製好的固定行情 (replay.py fixture) 上計時各掃描函數與完整 main()
+# ==========================================
+# 每個項目在獨立子程序裡執行 (全新暫存快取 = 冷啟動，峰值記憶體也各自獨立)，
+# 結果以 JSON 存檔 (預設 bench_results/<commit>.json)，--compare 可與另一次的結果逐項比較。
+# 第一次使用先以 --record 連網錄製 (之後完全離線、結果可重現)：
+#   python benchmark.py --record          → 錄製 fixtures/bench
+#   python benchmark.py --compare bench_results/abc1234.json
+#   python benchmark.py import            → 只量 import 耗時並檢查 import 時沒有外部呼叫 (退步時結束碼為 1)
+# 注意：本模組在子程序設定好 STOCK_REPLAY 之前不得 import 任何股票模組 (stock_common 於 import 時安裝重播層)。
+FIXTURE_DIR = os.path.join("fixtures", "bench")
+RESULT_DIR = "bench_results"
+UNIVERSE_SIZE = 1700
+IMPORT_MODULES = ("DailyStockPush", "ManualStock", "DailyStockBot", "stock_bot_final")
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "10"))  # import 項目的總耗時上限 (超過視為退步)
+
+def _head_stock_info(df, limit):
+    """台股清單只留前 limit 檔四碼代號 (函數項目與 main 項目共用同一個股票池)"""
+    return df[df['stock_id'].str.len() == 4].drop_duplicates('stock_id').head(limit)
+
+def _universe(limit):
+    """固定股票池：錄製的台股清單中前 limit 檔四碼代號 [(代號, 名稱, 產業)]"""
+    from FinMind.data import DataLoader
+    import ticker_resolver
+    df = DataLoader().taiwan_stock_info()
+    ticker_resolver.update_from_stock_info(df)
+    df = _head_stock_info(df, limit)
+    return list(df[['stock_id', 'stock_name', 'industry_category']].itertuples(index=False, name=None))
+
+class Stages:
+    """依序記錄各階段耗時 (秒)"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def run(self, name, fn, *args):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        self.seconds[name] = round(time.perf_counter() - t0, 3)
+        return result
+
+# ------------------------------------------
+# 基準項目：回傳 (處理檔數, 各階段耗時, 附帶統計)
+# ------------------------------------------
+def case_analyze_v14(limit, workers):
+    stages = Stages()
+    DailyStockBot = stages.run("import", __import__, "DailyStockBot")
+    import inst_store, price_store, ticker_resolver
+    from indicator_panel import IndicatorPanel
+    from stock_common import parallel_map
+    rows = stages.run("universe", _universe, limit)
+    tickers = [t for t in (ticker_resolver.lookup(sid) for sid, _, _ in rows) if t]
+    stages.run("inst_sync", inst_store.sync)
+    stages.run("prefetch", price_store.prefetch, tickers, "1y")
+    DailyStockBot.INDICATOR_PANEL = stages.run("panel", IndicatorPanel.from_store, tickers, "1y")
+    stages.run("screen", DailyStockBot.cheap_screen, DailyStockBot.INDICATOR_PANEL)
+    DailyStockBot.SIGNALS = stages.run("signals", DailyStockBot.build_signals, DailyStockBot.INDICATOR_PANEL)
+    results = stages.run("analyze", parallel_map, lambda r: DailyStockBot.analyze_v14(r[0], r[1]), rows, workers)
+    return len(rows), stages.seconds, {"picks": sum(1 for _, s, _ in results if s), "funnel": dict(DailyStockBot.FUNNEL)}
+
+def case_analyze_pro(limit, workers):
+    stages = Stages()
+    stock_bot_final = stages.run("import", __import__, "stock_bot_final")
+    import price_store, strategy_engine, ticker_resolver
+    from indicator_panel import IndicatorPanel
+    from stock_common import parallel_map
+    rows = stages.run("universe", _universe, limit)
+    items = [(t, industry) for t, industry in ((ticker_resolver.lookup(sid), ind) for sid, _, ind in rows) if t]
+    tickers = [t for t, _ in items]
+    stages.run("prefetch", price_store.prefetch, tickers, "1y")
+    stock_bot_final.INDICATOR_PANEL = stages.run("panel", IndicatorPanel.from_store, tickers, "1y", True)
+    stock_bot_final.SIGNALS = stages.run("signals", strategy_engine.evaluate, "pro", stock_bot_final.INDICATOR_PANEL)
+    results = stages.run("analyze", parallel_map, lambda item: stock_bot_final.analyze_pro(*item), items, workers)
+    return len(items), stages.seconds, {"hits": sum(1 for msg, _ in results if msg)}
+
+def case_fetch_pro_metrics(limit, workers):
+    stages = Stages()
+    DailyStockPush = stages.run("import", __import__, "DailyStockPush")
+    import inst_store, price_store, strategy_engine, ticker_resolver
+    from indicator_panel import IndicatorPanel
+    rows = stages.run("universe", _universe, limit)
+    watch = [{'sid': sid, 'name': name, 'is_hold': False, 'cost': 0, 'skip_ai': True} for sid, name, _ in rows]
+    tickers = [t for t in (ticker_resolver.resolve(d['sid']) for d in watch) if t]
+    stages.run("prefetch", price_store.prefetch, tickers, "8mo")
+    panel = DailyStockPush.INDICATOR_PANEL = stages.run("panel", IndicatorPanel.from_store, tickers, "8mo")
+    chips = stages.run("chips", inst_store.streak_vectors, [''.join(filter(str.isdigit, t.split('.')[0])) for t in panel.tickers])
+    DailyStockPush.SIGNALS = stages.run("signals", lambda: strategy_engine.evaluate("push", panel, extra=chips) if chips else None)
+    results = stages.run("analyze", lambda: [DailyStockPush.fetch_pro_metrics(d) for d in watch])
+    return len(watch), stages.seconds, {"rows": sum(1 for r in results if r)}
+
+def case_import(limit, workers):
+    """依序冷啟動 import 各腳本 (後面的模組共用前面已載入的套件，只計增量)；import 期間不得有任何外部呼叫"""
+    stages = Stages()
+    for name in IMPORT_MODULES: stages.run(name, __import__, name)
+    import replay
+    return len(IMPORT_MODULES), stages.seconds, {"external_calls": replay.call_counts()}
+
+def check_import(r):
+    """import 項目的退步檢查，回傳問題清單"""
+    problems = []
+    if r.get("external_calls"): problems.append(f"import 時發出外部呼叫 {r['external_calls']}")
+    if r["total_seconds"] > IMPORT_BUDGET_SECONDS: problems.append(f"import 耗時 {r['total_seconds']:.1f}s 超過上限 {IMPORT_BUDGET_SECONDS:.0f}s")
+    return problems
+
+def _limit_market(module, limit):
+    """全市場腳本：把模組內的 DataLoader 換成台股清單只回傳前 limit 檔的版本"""
+    class LimitedLoader(module.DataLoader):
+        def taiwan_stock_info(self, *args, **kwargs):
+            return _head_stock_info(super().taiwan_stock_info(*args, **kwargs), limit)
+    module.DataLoader = LimitedLoader
+
+def _limit_watch_list(module, limit):
+    """DailyStockPush：WATCH_LIST 只取前 limit 列"""
+    read = module.get_watch_list_from_sheet
+    module.get_watch_list_from_sheet = lambda: (read() or [])[:limit]
+
+def _push_main(module, workers):
+    """DailyStockPush.main 沒有掃描執行緒參數，--workers 對應 AI 並行請求數"""
+    module.AI_WORKERS = workers
+    module.main()
+
+def _main_case(module_name, limit, limit_universe, call):
+    stages = Stages()
+    module = stages.run("import", __import__, module_name)
+    limit_universe(module, limit)
+    stages.run("main", call, module)
+    panel = getattr(module, "INDICATOR_PANEL", None)
+    return (len(panel.tickers) if panel is not None else 0), stages.seconds, {}
+
+CASES = {
+    "import": case_import,
+    "analyze_v14": case_analyze_v14,
+    "analyze_pro": case_analyze_pro,
+    "fetch_pro_metrics": case_fetch_pro_metrics,
+    "DailyStockBot.main": lambda limit, workers: _main_case("DailyStockBot", limit, _limit_market, lambda m: m.main(workers)),
+    "stock_bot_final.main": lambda limit, workers: _main_case("stock_bot_final", limit, _limit_market, lambda m: m.main(workers)),
+    "DailyStockPush.main": lambda limit, workers: _main_case("DailyStockPush", limit, _limit_watch_list, lambda m: _push_main(m, workers)),
+}
+
+def run_case(name, limit, workers):
+    """子程序內執行單一項目 (此時重播層已依環境變數安裝)"""
+    t0 = time.perf_counter()
+    count, stages, extra = CASES[name](limit, workers)
+    import stock_common
+    total = time.perf_counter() - t0
+    return {
+        "tickers": count,
+        "total_seconds": round(total, 3),
+        "tickers_per_second": round(count / total, 1) if total else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # Linux 單位為 KB
+        "stages": stages,
+        "pipeline": stock_common.stage_report(),  # 腳本內建的各階段統計 (次數 / p50 / p95 / 重試)
+        **extra,
+    }
+
+def spawn(name, args):
+    """以子程序執行一個項目，回傳結果 (失敗時回傳 error)"""
+    env = dict(os.environ, STOCK_REPLAY="record" if args.record else "replay", STOCK_REPLAY_DIR=args.fixtures)
+    if args.record: env["ENABLE_AI"] = "false"  # 錄製時不呼叫 Gemini (重播層不涵蓋)
+    cmd = [sys.executable, os.path.abspath(__file__), "--case", name, "--limit", str(args.limit), "--workers", str(args.workers)]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    try: return json.loads(proc.stdout.strip().splitlines()[-1])
+    except Exception: return {"error": (proc.stderr or proc.stdout).strip().splitlines()[-1:] or ["無輸出"]}
+
+def git_commit():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception: return "unknown"
+
+def compare(report, baseline):
+    print(f"\n📊 與 {baseline.get('commit', '?')} 比較 (總耗時 / 每秒檔數 / 峰值記憶體)")
+    for name, r in report["cases"].items():
+        b = baseline.get("cases", {}).get(name)
+        if "error" in r or not b or "error" in b:
+            print(f"  {name:<22} 無法比較")
+            continue
+        change = (r["total_seconds"] / b["total_seconds"] - 1) if b["total_seconds"] else 0
+        print(f"  {name:<22} {b['total_seconds']:>8.1f}s → {r['total_seconds']:>8.1f}s ({change:+.1%})  "
+              f"{b['tickers_per_second']} → {r['tickers_per_second']} 檔/秒  {b['peak_rss_mb']} → {r['peak_rss_mb']} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="股票掃描端到端效能基準 (離線重播固定行情)")
+    parser.add_argument("cases", nargs="*", help=f"要執行的項目 (預設全部)：{', '.join(CASES)}")
+    parser.add_argument("--record", action="store_true", help="連網錄製 fixture (其餘參數需與之後重播時相同)")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="fixture 目錄")
+    parser.add_argument("--limit", type=int, default=UNIVERSE_SIZE, help="固定股票池大小 (main 項目同樣只取台股清單前 N 檔 / WATCH_LIST 前 N 列)")
+    parser.add_argument("--workers", type=int, default=1, help="analyze_v14 / analyze_pro / main 的執行緒數 (DailyStockPush.main 為 AI 並行請求數)")
+    parser.add_argument("--output", help=f"結果 JSON 路徑 (預設 {RESULT_DIR}/<commit>.json)")
+    parser.add_argument("--compare", help="與另一份結果 JSON 比較")
+    parser.add_argument("--case", help=argparse.SUPPRESS)  # 子程序內部使用
+    args = parser.parse_args()
+
+    unknown = [c for c in args.cases if c not in CASES]
+    if unknown: parser.error(f"未知項目 {', '.join(unknown)}")
+    if args.case:
+        print(json.dumps(run_case(args.case, args.limit, args.workers)))
+        sys.exit(0)
+
+    commit = git_commit()
+    report = {"generated_at": datetime.datetime.now().isoformat(timespec='seconds'), "commit": commit, "python": sys.version.split()[0],
+              "fixtures": args.fixtures, "limit": args.limit, "workers": args.workers, "cases": {}}
+    regressions = []
+    for name in args.cases or CASES:
+        print(f"⏱️ {'錄製' if args.record else '執行'} {name} ...", flush=True)
+        r = report["cases"][name] = spawn(name, args)
+        if "error" in r: print(f"  ❌ 失敗：{r['error']}")
+        else: print(f"  {r['total_seconds']:.1f} 秒，{r['tickers']} 檔 ({r['tickers_per_second']} 檔/秒)，峰值記憶體 {r['peak_rss_mb']} MB，"
+                    + "、".join(f"{k} {v:.1f}s" for k, v in r["stages"].items()))
+        if name == "import" and "error" not in r and not args.record:
+            for problem in check_import(r): print(f"  ❌ {problem}")
+            regressions += check_import(r)
+    if args.record:
+        print(f"💾 已錄製至 {args.fixtures}")
+        sys.exit(0)
+
+    output = args.output or os.path.join(RESULT_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 已輸出 {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f: compare(report, json.load(f))
+    if regressions: sys.exit(1)
@@ -0,0 +1,92 @@
+import argparse, datetime, json, os, threading
+import yfinance as yf
+from stock_common import cache_path, tw_now, throttle, timed_stage, parallel_map, add_workers_arg
+
+# ==========================================
+# 基本面快取：yfinance .info 只保留用得到的欄位，過期 (TTL) 才重抓
+# ==========================================
+# 毛利率、EPS、殖利率等一季才變一次，卻是 yfinance 最慢的呼叫；
+# DailyStockBot / DailyStockPush / ManualStock 都透過 get_info() 讀取。
+FIELDS = ("grossMargins", "trailingEps", "profitMargins", "dividendYield", "sector", "industry", "trailingPE", "shortName")
+TTL_DAYS = float(os.getenv("FUNDAMENTALS_TTL_DAYS", "7"))
+
+_CACHE = None
+_LOCK = threading.Lock()
+
+def _cache_file():
+    return cache_path("fundamentals.json")
+
+def _load():
+    global _CACHE
+    if _CACHE is None:
+        try:
+            with open(_cache_file(), "r", encoding="utf-8") as f: _CACHE = json.load(f)
+        except Exception: _CACHE = {}
+    return _CACHE
+
+def _save():
+    path = _cache_file()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(_CACHE, f, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, path)
+
+def is_fresh(entry, now=None, ttl_days=TTL_DAYS):
+    if not entry or not entry.get("fetched_at"): return False
+    age = (now or tw_now()) - datetime.datetime.fromisoformat(entry["fetched_at"])
+    return age < datetime.timedelta(days=ttl_days)
+
+def fetch(ticker):
+    """連網抓 .info，只保留 FIELDS"""
+    throttle("yfinance")
+    with timed_stage("info"): info = yf.Ticker(ticker).info or {}
+    return {k: info.get(k) for k in FIELDS if info.get(k) is not None}
+
+def get_info(ticker, ttl_days=TTL_DAYS, persist=True):
+    """取代 yf.Ticker(ticker).info：快取未過期直接回傳；過期才重抓，重抓失敗時沿用舊資料"""
+    with _LOCK: entry = _load().get(ticker)
+    if is_fresh(entry, ttl_days=ttl_days): return dict(entry["info"])
+    try:
+        info = fetch(ticker)
+    except Exception:
+        if entry: return dict(entry["info"])
+        raise
+    with _LOCK:
+        _load()[ticker] = {"fetched_at": tw_now().isoformat(timespec='seconds'), "info": info}
+        if persist: _save()
+    return dict(info)
+
+def refresh(tickers, workers=1, force=False):
+    """批次更新：預設只重抓過期的，force=True 全部重抓；回傳實際連網筆數"""
+    with _LOCK:
+        cache = _load()
+        stale = [t for t in dict.fromkeys(tickers) if force or not is_fresh(cache.get(t))]
+
+    def update(t):
+        try:
+            get_info(t, ttl_days=0, persist=False)
+            return True
+        except Exception as e:
+            print(f"⚠️ {t} 基本面下載失敗: {e}")
+            return False
+
+    done = sum(parallel_map(update, stale, workers))
+    with _LOCK:
+        if done: _save()
+    print(f"✅ 基本面快取更新完成：{done}/{len(stale)} 檔 (共 {len(tickers)} 檔，TTL {TTL_DAYS:g} 天)")
+    return done
+
+if __name__ == "__main__":
+    # 用法：python fundamentals_store.py [2330.TW 6488.TWO ...] [--all] [--force] [--workers N]
+    # 不指定代號則更新快取內全部股票；--all 改用後綴對照表內的全市場代號 (預設只重抓過期的)
+    parser = add_workers_arg(argparse.ArgumentParser(description="批次更新 yfinance 基本面快取"))
+    parser.add_argument("tickers", nargs="*", help="完整代號 (含 .TW/.TWO)")
+    parser.add_argument("--all", action="store_true", help="更新後綴對照表內的全市場股票")
+    parser.add_argument("--force", action="store_true", help="忽略 TTL，全部重抓")
+    args = parser.parse_args()
+    if args.tickers: targets = args.tickers
+    elif args.all:
+        import ticker_resolver
+        targets = ticker_resolver.known_tickers()
+    else:
+        with _LOCK: targets = sorted(_load())
+    refresh(targets, args.workers, args.force)
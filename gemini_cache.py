@@ -0,0 +1,65 @@
+import datetime, hashlib, json, os, threading
+from stock_common import cache_path, tw_now
+
+# ==========================================
+# Gemini 回應快取：以「模型 + 提示詞雜湊」為鍵，同一份提示詞在有效期內不重複付費
+# ==========================================
+# 一筆回應一個檔案 (.stock_cache/gemini/，CI 隨K線快取一起保存)，命中時更新檔案時間作為最近使用紀錄；
+# 超過 TTL 視為過期，總容量超過上限時從最久未使用的開始刪除 (LRU)。GEMINI_CACHE=false 可整個關閉。
+TTL_HOURS = float(os.getenv("GEMINI_CACHE_TTL_HOURS", "12"))
+MAX_MB = float(os.getenv("GEMINI_CACHE_MAX_MB", "20"))
+ENABLED = os.getenv("GEMINI_CACHE", "true").lower() == "true"
+
+_LOCK = threading.Lock()
+
+def _dir():
+    return os.path.dirname(cache_path("gemini", "_"))
+
+def cache_key(model, prompt, config=None):
+    """模型名稱 + 提示詞 (含回應格式設定) 的 SHA-256"""
+    payload = json.dumps([prompt, config], ensure_ascii=False, sort_keys=True, default=str)
+    return f"{model}-{hashlib.sha256(payload.encode()).hexdigest()}"
+
+def _path(model, prompt, config):
+    return cache_path("gemini", f"{cache_key(model, prompt, config)}.json")
+
+def get(model, prompt, config=None, ttl_hours=TTL_HOURS):
+    """命中回傳 {"text", "usage", ...}；沒有或已過期回傳 None"""
+    if not ENABLED: return None
+    path = _path(model, prompt, config)
+    with _LOCK:
+        try:
+            with open(path, "r", encoding="utf-8") as f: entry = json.load(f)
+        except Exception: return None
+        age = tw_now() - datetime.datetime.fromisoformat(entry["created_at"])
+        if age >= datetime.timedelta(hours=ttl_hours):
+            os.remove(path)
+            return None
+        os.utime(path)
+    return entry
+
+def put(model, prompt, text, usage=None, config=None):
+    """寫入一筆回應 (usage 為原始 Token 用量，命中時用來計算省下的費用)，並視需要淘汰舊資料"""
+    if not ENABLED or not text: return
+    path = _path(model, prompt, config)
+    entry = {"model": model, "created_at": tw_now().isoformat(timespec='seconds'), "text": text, "usage": usage or {}}
+    with _LOCK:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        _evict()
+
+def _evict(max_bytes=None):
+    """總容量超過上限時，從最久未使用的檔案開始刪除"""
+    max_bytes = MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    folder = _dir()
+    files = []
+    for name in os.listdir(folder):
+        if not name.endswith(".json"): continue
+        st = os.stat(os.path.join(folder, name))
+        files.append((st.st_mtime, st.st_size, os.path.join(folder, name)))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes: break
+        os.remove(path)
+        total -= size
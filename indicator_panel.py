@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+import price_store
+from stock_common import timed_stage
+
+# ==========================================
+# 全市場橫斷面指標引擎 (K棒 × 股票 二維陣列)
+# ==========================================
+# 每檔股票的K線「靠右對齊」疊成一張二維表 (最後一列 = 各股最新一根K棒，較短的歷史在上方補 NaN)，
+# 所有指標以少數幾次 NumPy 向量運算一次算完，選股函數只需查表，不再逐檔跑 pandas rolling。
+MA_WINDOWS = (5, 10, 20, 60)
+RSI_WINDOW = 14
+KD_WINDOW = 9
+KD_COM = 2
+
+def rolling_mean(x, window):
+    """等同 pandas rolling(window).mean()：視窗內有 NaN 即為 NaN"""
+    out = np.full(x.shape, np.nan)
+    if len(x) >= window: out[window - 1:] = sliding_window_view(x, window, axis=0).mean(axis=-1)
+    return out
+
+def rolling_min(x, window):
+    out = np.full(x.shape, np.nan)
+    if len(x) >= window: out[window - 1:] = sliding_window_view(x, window, axis=0).min(axis=-1)
+    return out
+
+def rolling_max(x, window):
+    out = np.full(x.shape, np.nan)
+    if len(x) >= window: out[window - 1:] = sliding_window_view(x, window, axis=0).max(axis=-1)
+    return out
+
+def ewm_mean_adjusted(x, com):
+    """等同 pandas ewm(com=com).mean() (adjust=True, ignore_na=False)：NaN 位置沿用前值，但權重照樣衰減"""
+    decay = com / (1.0 + com)
+    out = np.full(x.shape, np.nan)
+    num = np.zeros(x.shape[1:])
+    den = np.zeros(x.shape[1:])
+    for i in range(len(x)):
+        valid = ~np.isnan(x[i])
+        num = num * decay + np.where(valid, x[i], 0.0)
+        den = den * decay + valid
+        with np.errstate(invalid='ignore', divide='ignore'): out[i] = np.where(den > 0, num / den, np.nan)
+    return out
+
+def ewm_mean_wilder(x, window):
+    """等同 ta 的 ewm(alpha=1/window, adjust=False, min_periods=window).mean()"""
+    alpha = 1.0 / window
+    out = np.full(x.shape, np.nan)
+    prev = np.full(x.shape[1:], np.nan)
+    count = np.zeros(x.shape[1:])
+    for i in range(len(x)):
+        valid = ~np.isnan(x[i])
+        prev = np.where(valid, np.where(np.isnan(prev), x[i], (1 - alpha) * prev + alpha * x[i]), prev)
+        count += valid
+        out[i] = np.where(count >= window, prev, np.nan)
+    return out
+
+def _prev_mean(x, window):
+    """前 window 根 (不含當根) 的平均，等同 df['Volume'].iloc[-window-1:-1].mean()"""
+    shifted = np.full(x.shape, np.nan)
+    shifted[1:] = x[:-1]
+    return rolling_mean(shifted, window)
+
+def compute_indicators(close, high, low, volume):
+    """輸入 K棒 × 股票 的二維陣列，回傳所有指標欄位 (同樣形狀)"""
+    f = {}
+    for w in MA_WINDOWS: f[f"ma{w}"] = rolling_mean(close, w)
+
+    delta = np.full(close.shape, np.nan)
+    delta[1:] = close[1:] - close[:-1]
+    has_bar = ~np.isnan(close)
+    # pandas 的 delta.where(delta > 0, 0) 會把第一根的 NaN 變成 0，這裡只保留補位區的 NaN
+    gain = np.where(has_bar, np.where(delta > 0, delta, 0.0), np.nan)
+    loss = np.where(has_bar, np.where(delta < 0, -delta, 0.0), np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # DailyStockBot / DailyStockPush 的 RSI (簡單平均)
+        f["rsi_gain"], f["rsi_loss"] = rolling_mean(gain, RSI_WINDOW), rolling_mean(loss, RSI_WINDOW)
+        f["rsi"] = 100 - (100 / (1 + f["rsi_gain"] / f["rsi_loss"]))
+        # ta.momentum.RSIIndicator 的 RSI (Wilder 平滑)
+        up, down = ewm_mean_wilder(gain, RSI_WINDOW), ewm_mean_wilder(loss, RSI_WINDOW)
+        f["rsi_wilder"] = np.where(down == 0, 100, 100 - (100 / (1 + up / down)))
+
+        low_min, high_max = rolling_min(low, KD_WINDOW), rolling_max(high, KD_WINDOW)
+        rsv = (close - low_min) / (high_max - low_min) * 100
+        f["k"] = ewm_mean_adjusted(rsv, KD_COM)
+        f["d"] = ewm_mean_adjusted(f["k"], KD_COM)
+
+        for w in (5, 10):
+            avg = _prev_mean(volume, w)
+            f[f"vol_avg{w}"] = avg
+            f[f"vol_ratio{w}"] = np.where(avg > 0, volume / avg, 0.0)
+        for w in (5, 20, 60):
+            f[f"bias{w}"] = (close - f[f"ma{w}"]) / f[f"ma{w}"] * 100
+    f["high_max"] = np.fmax.accumulate(high, axis=0)  # 載入區間內的最高價 (analyze_pro 的壓力價)
+    return f
+
+def _clean_frames(frames, drop_zero_volume_tail=False):
+    """去除空表；drop_zero_volume_tail 對應 analyze_pro 丟棄成交量為 0 的最後一根"""
+    frames = {t: df for t, df in frames.items() if df is not None and not df.empty}
+    if drop_zero_volume_tail:
+        frames = {t: (df.iloc[:-1] if df.iloc[-1]['Volume'] == 0 else df) for t, df in frames.items()}
+    return frames
+
+class IndicatorPanel:
+    """全市場指標表：fields[name] 為 K棒 × 股票 陣列，最後一列為各股最新K棒"""
+
+    def __init__(self, tickers, fields, lengths, dates=None):
+        self.tickers = list(tickers)
+        self.col = {t: j for j, t in enumerate(self.tickers)}
+        self.fields = fields
+        self.lengths = lengths
+        self.dates = dates  # 依日期對齊時為每一列的日期 (回測用)；靠右對齊時為 None
+
+    @classmethod
+    def from_frames(cls, frames, drop_zero_volume_tail=False, align_dates=False):
+        """frames: {ticker: OHLCV DataFrame}，整段向量化計算 (回測等需要完整歷史時使用)。
+        align_dates=True 時改以全部交易日的聯集對齊 (列 = 日期)，停牌日補 NaN"""
+        frames = _clean_frames(frames, drop_zero_volume_tail)
+        tickers = list(frames)
+        dates = pd.DatetimeIndex(sorted(set().union(*(df.index for df in frames.values())))) if align_dates else None
+        n = len(dates) if align_dates else max((len(df) for df in frames.values()), default=0)
+        raw = {c: np.full((n, len(tickers)), np.nan) for c in price_store.PRICE_COLUMNS}
+        lengths = np.zeros(len(tickers), dtype=int)
+        for j, t in enumerate(tickers):
+            df = frames[t]
+            lengths[j] = len(df)
+            rows = dates.get_indexer(df.index) if align_dates else slice(n - len(df), None)
+            for c in price_store.PRICE_COLUMNS: raw[c][rows, j] = df[c].to_numpy(float)
+        fields = {c.lower(): raw[c] for c in price_store.PRICE_COLUMNS}
+        fields.update(compute_indicators(fields["close"], fields["high"], fields["low"], fields["volume"]))
+        return cls(tickers, fields, lengths, dates)
+
+    @classmethod
+    @timed_stage("indicators")
+    def from_store(cls, tickers, period="1y", drop_zero_volume_tail=False, incremental=True):
+        """從本地K線快取組出指標表 (請先用 price_store.prefetch 批次補齊)。
+        incremental=True 時透過 indicator_state 只推進新K棒，回傳只含前一根與最新一根的兩列指標表"""
+        frames = {}
+        for t in tickers:
+            try: frames[t] = price_store.get_history(t, period)
+            except Exception: continue
+        if not incremental: return cls.from_frames(frames, drop_zero_volume_tail)
+        import indicator_state
+        return indicator_state.build_panel(_clean_frames(frames), drop_zero_volume_tail)  # 零量尾端在狀態推進後才丟棄，各呼叫端共用同一份狀態
+
+    def has(self, ticker):
+        return ticker in self.col
+
+    def length(self, ticker):
+        return int(self.lengths[self.col[ticker]])
+
+    def get(self, ticker, name, offset=-1):
+        """單一股票某指標的值；offset=-1 為最新一根，-2 為前一根 (回傳 numpy 純量，運算行為同 pandas)"""
+        return self.fields[name][offset, self.col[ticker]]
+
+    def column(self, ticker, name):
+        """單一股票某欄位的完整序列 (去除上方補位的 NaN；增量指標表只有最後兩根)"""
+        j = self.col[ticker]
+        if self.dates is not None: return self.fields[name][~np.isnan(self.fields['close'][:, j]), j]
+        return self.fields[name][len(self.fields[name]) - self.lengths[j]:, j]
+
+    def latest(self, name, offset=-1):
+        """全市場某指標在最新一根 (或前 N 根) 的橫斷面向量"""
+        return self.fields[name][offset]
+
+def panel_for(panel, ticker, period="1y", drop_zero_volume_tail=False):
+    """全市場指標表裡有這檔就直接用；沒有 (例如單檔診斷) 則臨時組一張只含該股的指標表"""
+    if panel is not None and panel.has(ticker): return panel
+    return IndicatorPanel.from_store([ticker], period, drop_zero_volume_tail)
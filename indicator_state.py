@@ -0,0 +1,200 @@
+import copy, json, math, os, sys, threading
+import numpy as np
+import price_store
+from stock_common import cache_path
+from indicator_panel import MA_WINDOWS, RSI_WINDOW, KD_WINDOW, KD_COM, IndicatorPanel
+
+# ==========================================
+# 指標增量狀態庫：每日只用最新一根K棒更新
+# ==========================================
+# 每檔股票保存固定長度的視窗緩衝 (收盤/高低/漲跌/成交量)、KD 的 EWM 累加器與 Wilder RSI 平滑值，
+# 新K棒進來只需常數時間即可得到 MA/RSI/KD/量比；結果與整段重算一致 (verify 模式可檢查)。
+# 狀態只推進到「倒數第二根」，最新一根 (盤中可能還會變動) 每次臨時套用、不寫回，避免盤中K棒污染狀態。
+VOL_WINDOWS = (5, 10)
+BIAS_WINDOWS = (5, 20, 60)
+MAX_CLOSE_BUF = max(MA_WINDOWS)
+MAX_VOL_BUF = max(VOL_WINDOWS)
+KD_DECAY = KD_COM / (1.0 + KD_COM)
+WILDER_ALPHA = 1.0 / RSI_WINDOW
+VERIFY_TOLERANCE = 1e-6
+
+_STATE = None
+_LOCK = threading.RLock()  # --workers 並行掃描時，單檔臨時建表也會讀寫同一份狀態
+
+def _state_path():
+    return cache_path("indicator_state.json")
+
+def load():
+    global _STATE
+    if _STATE is None:
+        try:
+            with open(_state_path(), "r", encoding="utf-8") as f: _STATE = json.load(f)
+        except Exception: _STATE = {}
+    return _STATE
+
+def save():
+    if _STATE is None: return
+    path = _state_path()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(_STATE, f)
+    os.replace(tmp, path)
+
+def new_state():
+    return {"last_date": None, "last_close": None, "closes": [], "highs": [], "lows": [], "gains": [], "losses": [], "vols": [],
+            "k_num": 0.0, "k_den": 0.0, "d_num": 0.0, "d_den": 0.0, "up": None, "down": None, "wilder_n": 0, "out": None, "prev_out": None}
+
+def _mean_tail(buf, window):
+    return math.fsum(buf[-window:]) / window if len(buf) >= window else math.nan
+
+def _ewm_step(num, den, x):
+    valid = not math.isnan(x)
+    num = num * KD_DECAY + (x if valid else 0.0)
+    den = den * KD_DECAY + (1.0 if valid else 0.0)
+    return num, den, (num / den if den > 0 else math.nan)
+
+def _div(a, b):
+    if b == 0: return math.inf if a > 0 else (-math.inf if a < 0 else math.nan)
+    return a / b
+
+def step(state, date, o, h, l, c, v):
+    """把一根K棒推進狀態 (就地修改)，回傳該根的所有指標，欄位名稱同 IndicatorPanel"""
+    prev_close = state["closes"][-1] if state["closes"] else math.nan
+    delta = c - prev_close
+    gain = delta if delta > 0 else 0.0
+    loss = -delta if delta < 0 else 0.0
+    out = {"open": o, "high": h, "low": l, "close": c, "volume": v}
+
+    for w in VOL_WINDOWS:
+        avg = _mean_tail(state["vols"], w)
+        out[f"vol_avg{w}"] = avg
+        out[f"vol_ratio{w}"] = v / avg if avg > 0 else 0.0
+
+    for key, val, size in (("closes", c, MAX_CLOSE_BUF), ("highs", h, KD_WINDOW), ("lows", l, KD_WINDOW),
+                           ("gains", gain, RSI_WINDOW), ("losses", loss, RSI_WINDOW), ("vols", v, MAX_VOL_BUF)):
+        state[key] = (state[key] + [val])[-size:]
+
+    for w in MA_WINDOWS: out[f"ma{w}"] = _mean_tail(state["closes"], w)
+    out["rsi_gain"], out["rsi_loss"] = _mean_tail(state["gains"], RSI_WINDOW), _mean_tail(state["losses"], RSI_WINDOW)
+    out["rsi"] = 100 - (100 / (1 + _div(out["rsi_gain"], out["rsi_loss"]))) if not math.isnan(out["rsi_gain"] + out["rsi_loss"]) else math.nan
+
+    if state["up"] is None: state["up"], state["down"] = gain, loss
+    else:
+        state["up"] = (1 - WILDER_ALPHA) * state["up"] + WILDER_ALPHA * gain
+        state["down"] = (1 - WILDER_ALPHA) * state["down"] + WILDER_ALPHA * loss
+    state["wilder_n"] += 1
+    if state["wilder_n"] < RSI_WINDOW: out["rsi_wilder"] = math.nan
+    else: out["rsi_wilder"] = 100.0 if state["down"] == 0 else 100 - (100 / (1 + state["up"] / state["down"]))
+
+    if len(state["highs"]) >= KD_WINDOW:
+        lo, hi = min(state["lows"]), max(state["highs"])
+        rsv = (c - lo) / (hi - lo) * 100 if hi != lo else math.nan
+    else: rsv = math.nan
+    state["k_num"], state["k_den"], out["k"] = _ewm_step(state["k_num"], state["k_den"], rsv)
+    state["d_num"], state["d_den"], out["d"] = _ewm_step(state["d_num"], state["d_den"], out["k"])
+
+    for w in BIAS_WINDOWS:
+        ma = out[f"ma{w}"]
+        out[f"bias{w}"] = (c - ma) / ma * 100 if not math.isnan(ma) else math.nan
+
+    state["prev_out"] = state["out"]
+    state["last_date"], state["last_close"], state["out"] = date, c, out
+    return out
+
+def _feed(state, df):
+    out = state["out"]
+    for date, o, h, l, c, v in zip(df.index.strftime('%Y-%m-%d'), df['Open'], df['High'], df['Low'], df['Close'], df['Volume']):
+        out = step(state, date, float(o), float(h), float(l), float(c), float(v))
+    return out
+
+def _resume_position(state, committed):
+    """狀態最後一根在資料中的位置；找不到或收盤價不一致 (除權息還原) 回傳 -1 代表需整段重建"""
+    if not state or not state.get("last_date") or not state.get("last_close") or "prev_out" not in state or committed.empty: return -1
+    dates = list(committed.index.strftime('%Y-%m-%d'))
+    if state["last_date"] not in dates: return -1
+    pos = dates.index(state["last_date"])
+    close = float(committed['Close'].iloc[pos])
+    return pos if abs(close / state["last_close"] - 1) <= price_store.READJUST_TOLERANCE else -1
+
+def _advance(ticker, committed):
+    """把狀態推進到 committed 的最後一根 (只推進自上次以來新增的K棒)"""
+    states = load()
+    state = states.get(ticker)
+    pos = _resume_position(state, committed)
+    if pos >= 0:
+        _feed(state, committed.iloc[pos + 1:])
+    else:
+        state = new_state()
+        _feed(state, committed)
+    states[ticker] = state
+    return state
+
+def advance(ticker, committed):
+    """盤中監控用：狀態推進到 committed (全部為已收盤K棒) 的最後一根並回傳複本，之後每個 tick 只需對複本 step 一次"""
+    with _LOCK: return copy.deepcopy(_advance(ticker, committed))
+
+def latest_rows(ticker, df, drop_zero_volume_tail=False):
+    """回傳 (prev, latest) 兩根K棒的指標；只推進自上次以來新增的K棒。
+    drop_zero_volume_tail=True 且最新一根成交量為 0 時改回傳前兩根，狀態仍推進到同一根，與不丟棄的呼叫端共用"""
+    committed = df.iloc[:-1]
+    state = _advance(ticker, committed)
+    if drop_zero_volume_tail and df['Volume'].iloc[-1] == 0:
+        prev, latest = dict(state["prev_out"] or {}), dict(state["out"])
+        prev["high_max"] = float(committed['High'].iloc[:-1].max()) if len(committed) > 1 else math.nan
+        latest["high_max"] = float(committed['High'].max())
+        return prev, latest
+    prev = dict(state["out"]) if state["out"] else {}
+    latest = step(copy.deepcopy(state), df.index[-1].strftime('%Y-%m-%d'), *(float(df[c].iloc[-1]) for c in price_store.PRICE_COLUMNS))
+    prev["high_max"] = float(committed['High'].max()) if not committed.empty else math.nan
+    latest["high_max"] = float(df['High'].max())
+    return prev, latest
+
+def build_panel(frames, drop_zero_volume_tail=False):
+    """以增量狀態組出只有兩列 (前一根、最新一根) 的指標表，欄位與 IndicatorPanel.from_frames 相同"""
+    tickers, rows, lengths = [], [], []
+    with _LOCK:
+        for t, df in frames.items():
+            if df is None or df.empty: continue
+            n = len(df) - (1 if drop_zero_volume_tail and df['Volume'].iloc[-1] == 0 else 0)
+            if n < 2: continue
+            tickers.append(t)
+            rows.append(latest_rows(t, df, drop_zero_volume_tail))
+            lengths.append(n)
+        save()
+    return rows_to_panel(tickers, rows, lengths)
+
+def rows_to_panel(tickers, rows, lengths):
+    """[(prev, latest)] 指標列 → 兩列指標表"""
+    names = list(rows[0][1]) if rows else []
+    fields = {n: np.array([[p.get(n, math.nan) for p, _ in rows], [l[n] for _, l in rows]], dtype=float).reshape(2, len(rows)) for n in names}
+    return IndicatorPanel(tickers, fields, np.array(lengths, dtype=int))
+
+# ==========================================
+# 驗證模式：增量結果 vs 整段重算
+# ==========================================
+def verify(tickers, period="1y"):
+    """比對增量狀態與整段重算的最新兩根指標，回傳 {ticker: [(欄位, 差異)]} 不一致清單"""
+    mismatches = {}
+    for t in tickers:
+        df = price_store.get_history(t, period)
+        if len(df) < 2: continue
+        prev, latest = latest_rows(t, df)
+        full = IndicatorPanel.from_frames({t: df})
+        for offset, row in ((-2, prev), (-1, latest)):
+            for name, val in row.items():
+                ref = full.get(t, name, offset)
+                same = (math.isnan(val) and math.isnan(ref)) or val == ref or abs(val - ref) <= VERIFY_TOLERANCE * max(1.0, abs(ref))
+                if not same: mismatches.setdefault(t, []).append((f"{name}[{offset}]", val, float(ref)))
+    save()
+    return mismatches
+
+if __name__ == "__main__":
+    # 用法：python indicator_state.py --verify [股票代號 ...]  (不指定則檢查狀態庫內全部股票)
+    if "--verify" not in sys.argv:
+        print("用法：python indicator_state.py --verify [2330.TW 6488.TWO ...]")
+        sys.exit(0)
+    targets = [a for a in sys.argv[1:] if not a.startswith("--")] or sorted(load())
+    bad = verify(targets)
+    for t, items in bad.items():
+        for name, val, ref in items: print(f"❌ {t} {name}: 增量 {val} ≠ 重算 {ref}")
+    print(f"{'✅' if not bad else '⚠️'} 指標增量狀態驗證完成：{len(targets)} 檔，不一致 {len(bad)} 檔")
+    sys.exit(1 if bad else 0)
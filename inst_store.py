@@ -0,0 +1,189 @@
+import os, datetime, threading
+import numpy as np
+import pandas as pd
+from FinMind.data import DataLoader
+from stock_common import cache_path, tw_now, throttle, timed_stage
+
+# ==========================================
+# 全市場三大法人買賣超本地滾動資料庫 (近 35 天)
+# ==========================================
+# 依「日期」一次下載全市場資料 (一天一個 Parquet 檔)，取代每檔股票各打一次 FinMind；
+# 籌碼查詢全部由記憶體中的資料表回應。
+WINDOW_DAYS = 35
+INST_COLUMNS = ['date', 'stock_id', 'buy', 'name', 'sell']
+STREAK_WINDOW = 20
+STREAK_COLUMNS = ['fs_streak', 'ss_streak', 'fs_days', 'ss_days']
+FINMIND_TOKEN = os.getenv("FINMIND_TOKEN")
+
+_BY_STOCK = None
+_STREAKS = None
+_LATEST = None
+_SYNCED = False  # 本程序已同步過就不再補抓 (當天資料未公布前，今天永遠是缺的)
+_LOCK = threading.RLock()
+
+def _inst_dir():
+    return os.path.dirname(cache_path("inst", "_"))
+
+def _date_path(d):
+    return cache_path("inst", f"{d}.parquet")
+
+def _data_loader():
+    return DataLoader(token=FINMIND_TOKEN) if FINMIND_TOKEN else DataLoader()
+
+def window_dates(days=WINDOW_DAYS):
+    """視窗內的所有平日 (國定假日在下載時以空檔案標記)"""
+    today = tw_now().date()
+    dates = [today - datetime.timedelta(days=n) for n in range(days, -1, -1)]
+    return [d.strftime('%Y-%m-%d') for d in dates if d.weekday() < 5]
+
+def _missing_dates(days=WINDOW_DAYS):
+    return [d for d in window_dates(days) if not os.path.exists(_date_path(d))]
+
+def _stored_dates():
+    return sorted(f[:-8] for f in os.listdir(_inst_dir()) if f.endswith('.parquet'))
+
+def _has_data():
+    return any(not pd.read_parquet(_date_path(d)).empty for d in _stored_dates())
+
+def sync(days=WINDOW_DAYS):
+    """補下載缺少日期的全市場法人資料，並刪除超出滾動視窗的舊檔"""
+    global _BY_STOCK, _STREAKS, _LATEST
+    with _LOCK:
+        fetched = _download_missing(days)
+        _BY_STOCK, _STREAKS, _LATEST = None, None, None
+    return fetched
+
+def _download_missing(days):
+    global _SYNCED
+    _SYNCED = True
+    dates = window_dates(days)
+    today = tw_now().date().strftime('%Y-%m-%d')
+    missing = _missing_dates(days)
+    fetched, empty_dates = 0, []
+    try: dl = _data_loader() if missing else None
+    except Exception as e:
+        print(f"⚠️ FinMind 連線失敗，法人資料庫沿用既有資料: {e}")
+        missing = []
+    for d in missing:
+        try:
+            throttle("finmind")
+            with timed_stage("chips"): df = dl.taiwan_stock_institutional_investors(start_date=d, end_date=d)
+        except Exception as e:
+            print(f"⚠️ 法人資料下載失敗 ({d}): {e}")
+            continue
+        if df is None or df.empty:
+            if d < today: empty_dates.append(d)
+            continue
+        df[INST_COLUMNS].to_parquet(_date_path(d), index=False)
+        fetched += 1
+
+    # 只有確定全市場下載可用時，才把沒資料的過去日期標記為休市日，避免權限不足時誤標
+    if empty_dates and (fetched or _has_data()):
+        for d in empty_dates: pd.DataFrame(columns=INST_COLUMNS).to_parquet(_date_path(d), index=False)
+
+    for d in _stored_dates():
+        if d < dates[0]: os.remove(_date_path(d))
+    if missing: print(f"🏦 法人資料庫同步完成：新增 {fetched} 個交易日 (視窗 {days} 天)")
+    if missing and not fetched and not _has_data():
+        print("🚨 [警告] 全市場法人資料下載不到任何資料 (依日期查詢需要 FinMind Token，請確認已設定 FINMIND_TOKEN)，"
+              "籌碼連買改為逐檔查詢，速度會明顯變慢")
+    return fetched
+
+def load():
+    """把視窗內所有日期合併成一張全市場資料表"""
+    frames = [pd.read_parquet(_date_path(d)) for d in _stored_dates()]
+    frames = [f for f in frames if not f.empty]
+    if not frames: return pd.DataFrame(columns=INST_COLUMNS)
+    df = pd.concat(frames, ignore_index=True)
+    df['stock_id'] = df['stock_id'].astype(str)
+    return df
+
+def _ensure_loaded():
+    global _BY_STOCK, _STREAKS, _LATEST
+    with _LOCK:
+        if _BY_STOCK is None:
+            if not _SYNCED and _missing_dates(): _download_missing(WINDOW_DAYS)
+            df = load()
+            _BY_STOCK = {sid: g.reset_index(drop=True) for sid, g in df.groupby('stock_id', sort=False)}
+            _STREAKS = compute_streak_table(df)
+            _LATEST = df['date'].astype(str).max()[:10] if not df.empty else None
+        return _BY_STOCK
+
+def latest_date():
+    """資料庫中最新一個有資料的交易日 ('YYYY-MM-DD')；完全沒有資料時回傳 None"""
+    _ensure_loaded()
+    return _LATEST
+
+# ==========================================
+# 向量化連買引擎：股票 × 日期矩陣一次算完全市場
+# ==========================================
+def _investor_streaks(df, name, window=STREAK_WINDOW):
+    """回傳 (stock_ids, streak, buy_days)：每檔股票最近 window 個交易日的連續買超天數與買超天數"""
+    d = df[df['name'] == name].sort_values(['stock_id', 'date'], ascending=[True, False])
+    if d.empty: return pd.Index([]), np.zeros(0, int), np.zeros(0, int)
+    sids, row = np.unique(d['stock_id'].to_numpy(), return_inverse=True)
+    pos = d.groupby('stock_id', sort=True).cumcount().to_numpy()  # 0 = 該股最新一天
+    keep = pos < window
+    net = np.full((len(sids), window), np.nan)
+    net[row[keep], pos[keep]] = (d['buy'].to_numpy(float) - d['sell'].to_numpy(float))[keep]
+    buy = net > 0
+    streak = np.where(buy.all(axis=1), window, buy.argmin(axis=1))
+    return pd.Index(sids), streak, buy.sum(axis=1)
+
+def compute_streak_table(df, window=STREAK_WINDOW):
+    """全市場外資/投信連買天數與近 window 日買超天數，index 為 stock_id，欄位同 get_inst_stats 回傳順序"""
+    table = pd.DataFrame(0, index=pd.Index(df['stock_id'].unique(), name='stock_id'), columns=STREAK_COLUMNS)
+    for prefix, name in (('fs', 'Foreign_Investor'), ('ss', 'Investment_Trust')):
+        sids, streak, days = _investor_streaks(df, name, window)
+        table.loc[sids, f'{prefix}_streak'] = streak
+        table.loc[sids, f'{prefix}_days'] = days
+    return table
+
+def get_streaks(sid_clean):
+    """回傳 (fs_streak, ss_streak, fs_days, ss_days)，直接查預先算好的全市場連買表"""
+    _ensure_loaded()
+    table = _STREAKS
+    if table is None or table.empty:
+        df = _fetch_single(sid_clean)
+        if df is None or df.empty: return 0, 0, 0, 0
+        table = compute_streak_table(df.assign(stock_id=df['stock_id'].astype(str)))
+    sid = str(sid_clean)
+    if sid not in table.index: return 0, 0, 0, 0
+    return tuple(int(v) for v in table.loc[sid, STREAK_COLUMNS])
+
+def streak_vectors(sids):
+    """把全市場連買表對齊到 sids 順序 {欄位: 陣列} (策略引擎用)；資料庫沒有資料時回傳 None，交由逐檔查詢"""
+    _ensure_loaded()
+    if _STREAKS is None or _STREAKS.empty: return None
+    table = _STREAKS.reindex([str(s) for s in sids], fill_value=0)
+    return {c: table[c].to_numpy(float) for c in STREAK_COLUMNS}
+
+def streak_history(dates, sids, window=STREAK_WINDOW):
+    """回測用：每個日期收盤後可得的連買表 {欄位: 日期 × 股票 陣列}。
+    只有資料庫已累積滿 window 個交易日的日期才有值，其餘為 NaN (策略條件視為不成立)"""
+    out = {c: np.full((len(dates), len(sids)), np.nan) for c in STREAK_COLUMNS}
+    df = load()
+    if df.empty: return out
+    stored = sorted(df['date'].astype(str).unique())
+    if len(stored) < window: return out
+    first, last = stored[window - 1], stored[-1]
+    sid_index = pd.Index([str(s) for s in sids])
+    for i, d in enumerate(pd.DatetimeIndex(dates).strftime('%Y-%m-%d')):
+        if not first <= d <= last: continue
+        table = compute_streak_table(df[df['date'].astype(str) <= d], window).reindex(sid_index, fill_value=0)
+        for c in STREAK_COLUMNS: out[c][i] = table[c].to_numpy(float)
+    return out
+
+def _fetch_single(sid_clean):
+    """資料庫無任何資料 (例如全市場查詢權限不足) 或單檔診斷時才退回單檔查詢"""
+    start = (tw_now().date() - datetime.timedelta(days=WINDOW_DAYS)).strftime('%Y-%m-%d')
+    throttle("finmind")
+    with timed_stage("chips"): return _data_loader().taiwan_stock_institutional_investors(stock_id=sid_clean, start_date=start)
+
+def get_stock_frame(sid_clean, sync=True):
+    """回傳單一股票近 35 天的法人買賣資料 (date/stock_id/buy/name/sell)。
+    sync=False 給單檔診斷用：本地資料庫不完整時直接單檔查詢，不為了一檔股票下載整個市場"""
+    if not sync and _BY_STOCK is None and not _SYNCED and _missing_dates(): return _fetch_single(sid_clean)
+    by_stock = _ensure_loaded()
+    if not by_stock: return _fetch_single(sid_clean)
+    return by_stock.get(str(sid_clean), pd.DataFrame(columns=INST_COLUMNS))
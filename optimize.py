@@ -0,0 +1,158 @@
+import argparse, itertools, json, os, random, shutil, tempfile, time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import ticker_resolver
+import strategy_engine
+import backtest
+from stock_common import cache_path, tw_now
+
+# ==========================================
+# 門檻參數掃描：多核心平行重播策略，依未來報酬排名
+# ==========================================
+# 歷史指標表與未來報酬只在主程序算一次，存成 .npy 後以 np.memmap 唯讀共享給所有工作程序；
+# 每組參數只需重跑目標策略 (及其相依項) 的布林運算，不必重算任何指標。
+# 可調參數就是 strategies.json 各群組 "params" 裡的名稱。
+
+def parse_values(spec):
+    """'1.0:2.0:0.25' → 等差數列 (含終點)；'8,10,12' → 清單；'1.2' → 單一值"""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 10) for i in range(count)]
+    return [float(x) for x in spec.split(",")]
+
+def parse_grid(param_specs, defaults):
+    grid = {}
+    for spec in param_specs:
+        name, _, values = spec.partition("=")
+        if name not in defaults: raise SystemExit(f"❌ 未知參數 {name}，可用參數：{', '.join(defaults)}")
+        grid[name] = parse_values(values)
+    return grid
+
+def combinations(grid, samples=None, seed=0):
+    """網格全展開；samples 指定時改為隨機抽樣 (不重複)"""
+    names = list(grid)
+    total = int(np.prod([len(v) for v in grid.values()])) if grid else 1
+    if samples is None or samples >= total:
+        return [dict(zip(names, combo)) for combo in itertools.product(*grid.values())]
+    rng = random.Random(seed)
+    picked = set()
+    while len(picked) < samples: picked.add(tuple(rng.choice(grid[n]) for n in names))
+    return [dict(zip(names, combo)) for combo in sorted(picked)]
+
+# ------------------------------------------
+# 共享唯讀資料：主程序寫 .npy，工作程序以 memmap 開啟 (每次掃描各用一個暫存子目錄，並行掃描不會互相覆蓋)
+# ------------------------------------------
+_SHARED = None
+_JOB = None
+
+def _shared_dir():
+    return os.path.dirname(cache_path("sweep", "_"))
+
+def share_arrays(arrays, folder):
+    """把陣列寫成 folder 下的 .npy 檔，回傳 {名稱: 路徑}"""
+    paths = {}
+    for name, arr in arrays.items():
+        paths[name] = os.path.join(folder, f"{name}.npy")
+        np.save(paths[name], np.ascontiguousarray(arr))
+    return paths
+
+def _init_worker(paths, job):
+    global _SHARED, _JOB
+    _SHARED = {name: np.load(path, mmap_mode="r") for name, path in paths.items()}
+    _JOB = job
+
+def score(params):
+    """工作程序：用一組參數重算目標策略，回傳該策略在指定持有期的統計"""
+    group, target = _JOB["group"], _JOB["target"]
+    mask = np.asarray(strategy_engine.evaluate_namespace(group, _SHARED, params=params, only=[target])[target])
+    r = _SHARED["__fwd_return"][mask]
+    dd = _SHARED["__fwd_drawdown"][mask]
+    r, dd = r[~np.isnan(r)], dd[~np.isnan(dd)]
+    return {
+        "params": params,
+        "n": int(len(r)),
+        "mean": float(r.mean()) if len(r) else None,
+        "median": float(np.median(r)) if len(r) else None,
+        "hit_rate": float((r > 0).mean()) if len(r) else None,
+        "avg_drawdown": float(dd.mean()) if len(dd) else None,
+    }
+
+def needed_inputs(group, target, ns):
+    """目標策略實際引用到的歷史變數 (只共享這些，避免把整張指標表都寫成檔案)"""
+    rules = strategy_engine.load_rules()[group]["rules"]
+    keep = set(strategy_engine.required_rules(group, [target]))
+    names = set().union(*(names for name, _, names in rules if name in keep))
+    return {n: ns[n] for n in names if n in ns}
+
+def sweep(panel, group, target, grid, horizon=5, chips="ignore", samples=None, workers=None, min_signals=100):
+    """回傳依平均報酬排序的結果清單 (訊號數不足 min_signals 的組合排在最後)"""
+    ns = strategy_engine.panel_namespace(panel, row=None)
+    ns.update(backtest.chip_fields(panel, chips))
+    shared = needed_inputs(group, target, ns)
+    shared["close"] = ns["close"]
+    shared["__fwd_return"] = backtest.forward_returns(panel.fields["close"], horizon)
+    shared["__fwd_drawdown"] = backtest.forward_drawdown(panel.fields["close"], panel.fields["low"], horizon)
+    defaults = strategy_engine.group_params(group)
+    combos = [defaults] + [dict(defaults, **c) for c in combinations(grid, samples)]
+    job = {"group": group, "target": target}
+    workers = workers or os.cpu_count()
+    print(f"🧪 參數掃描：{group}.{target}，{len(combos) - 1} 組參數，{workers} 個工作程序 (持有 {horizon} 日)")
+    folder = tempfile.mkdtemp(prefix="run-", dir=_shared_dir())
+    try:
+        paths = share_arrays(shared, folder)
+        del shared, ns
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(paths, job)) as pool:
+            results = list(pool.map(score, combos, chunksize=max(1, len(combos) // (workers * 4))))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)  # 掃描用的暫存陣列不留在快取目錄 (CI 會整包保存)
+    baseline, results = results[0], results[1:]
+    results.sort(key=lambda r: (r["n"] >= min_signals, r["mean"] if r["mean"] is not None else -np.inf), reverse=True)
+    return baseline, results
+
+def _fmt(r, grid):
+    tuned = ", ".join(f"{k}={r['params'][k]:g}" for k in grid)
+    mean = f"{r['mean']:+.2%}" if r["mean"] is not None else "-"
+    hit = f"{r['hit_rate']:.1%}" if r["hit_rate"] is not None else "-"
+    dd = f"{r['avg_drawdown']:+.2%}" if r["avg_drawdown"] is not None else "-"
+    return f"平均 {mean:>7}  命中 {hit:>6}  不利 {dd:>7}  訊號 {r['n']:>6}  | {tuned}"
+
+if __name__ == "__main__":
+    # 用法：python optimize.py --group v14 --target is_stable --param stable_vol_ratio=1.0:2.0:0.1 --param stable_rsi_low=40,45,50,55
+    #       [--random 500] [--horizon 5] [--chips history] [--workers 8] [--top 20] [--output sweep.json] [代號 ...]
+    parser = argparse.ArgumentParser(description="strategies.json 門檻參數的平行掃描")
+    parser.add_argument("tickers", nargs="*", help="完整代號 (含 .TW/.TWO)，不指定則用後綴對照表內的全市場股票")
+    parser.add_argument("--group", required=True, help="策略群組 (v14 / push / pro ...)")
+    parser.add_argument("--target", required=True, help="要最佳化的策略名稱 (例如 is_pick)")
+    parser.add_argument("--param", action="append", default=[], help="名稱=起:迄:間距 或 名稱=值1,值2,... (可重複)")
+    parser.add_argument("--random", type=int, help="改為隨機抽樣 N 組參數")
+    parser.add_argument("--period", default="3y", help="回測期間 (yfinance period 字串)")
+    parser.add_argument("--horizon", type=int, default=5, help="持有天數")
+    parser.add_argument("--chips", choices=backtest.CHIP_MODES, default="ignore", help="法人連買來源 (history 只涵蓋近 35 天)")
+    parser.add_argument("--min-signals", type=int, default=100, help="訊號數低於此值的組合不參與排名")
+    parser.add_argument("--workers", type=int, help="工作程序數 (預設 CPU 核心數)")
+    parser.add_argument("--top", type=int, default=20, help="顯示前幾名")
+    parser.add_argument("--output", help="另存完整結果 JSON")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.param, strategy_engine.group_params(args.group))
+    t0 = time.time()
+    panel = backtest.load_panel(args.tickers or ticker_resolver.known_tickers(), args.period)
+    print(f"📐 歷史指標表：{len(panel.tickers)} 檔 × {len(panel.dates)} 日，耗時 {time.time() - t0:.1f} 秒")
+
+    chips = backtest.chip_fields(panel, args.chips)
+    coverage = backtest.chip_coverage(panel, chips)
+    backtest.print_chip_coverage(coverage)
+
+    t1 = time.time()
+    baseline, results = sweep(panel, args.group, args.target, grid, args.horizon, chips, args.random, args.workers, args.min_signals)
+    print(f"⏱️ 掃描完成，耗時 {time.time() - t1:.1f} 秒")
+    print(f"📌 目前設定：{_fmt(baseline, grid)}")
+    for rank, r in enumerate(results[:args.top], 1): print(f"{rank:>3}. {_fmt(r, grid)}")
+
+    if args.output:
+        report = {"generated_at": tw_now().isoformat(timespec='seconds'), "group": args.group, "target": args.target,
+                  "horizon": args.horizon, "chips": args.chips, "chip_coverage": coverage, "period": args.period, "grid": grid,
+                  "baseline": baseline, "results": results}
+        with open(args.output, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 已輸出 {args.output}")
@@ -0,0 +1,180 @@
+import os, datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import yfinance as yf
+from stock_common import cache_path, tw_now, last_close_mark, is_market_open, throttle, timed_stage, count_retry
+
+# ==========================================
+# 本地 OHLCV 欄式快取 (Parquet，一檔股票一個檔案)
+# ==========================================
+# 每次執行只下載「最後一根快取K棒之後」的資料並接在後面；
+# 四支選股腳本 (DailyStockBot / DailyStockPush / stock_bot_final / ManualStock) 都透過這裡讀歷史K線。
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+MIN_FILL_PERIOD = "1y"  # 第一次建檔至少抓一年，讓 5d 探測也能順便把 1y 分析要用的資料補齊
+PERIOD_DAYS = {"1mo": 31, "3mo": 92, "6mo": 183, "8mo": 245, "1y": 366, "2y": 731, "3y": 1096, "5y": 1827, "10y": 3653}
+READJUST_TOLERANCE = 0.001  # 重疊K棒收盤價差超過 0.1% 視為除權息還原，整段重抓
+
+def _path(ticker):
+    return cache_path("prices", f"{ticker}.parquet")
+
+def _period_start(period):
+    """把 yfinance 的 period 字串轉成起始日期字串 ('5d' 這類交易日數則以一年為準，讀取時再取尾端)"""
+    days = PERIOD_DAYS.get(period, PERIOD_DAYS[MIN_FILL_PERIOD])
+    return (tw_now().date() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
+
+def _slice(df, period):
+    if period.endswith('d') and period[:-1].isdigit(): return df.tail(int(period[:-1])).copy()
+    return df.loc[_period_start(period):].copy()
+
+def _normalize(df):
+    if df is None or df.empty: return pd.DataFrame(columns=PRICE_COLUMNS, dtype=float)
+    df = df[[c for c in PRICE_COLUMNS if c in df.columns]].copy()
+    idx = pd.DatetimeIndex(df.index)
+    if idx.tz is not None: idx = idx.tz_localize(None)
+    df.index = idx.normalize()
+    df.index.name = "Date"
+    df = df[~df.index.duplicated(keep='last')].dropna(subset=['Close'])
+    return df.astype(float)
+
+def read_cached(ticker):
+    """讀取本地快取，回傳 (df, meta)；沒有快取時回傳 (None, {})"""
+    path = _path(ticker)
+    if not os.path.exists(path): return None, {}
+    try:
+        table = pq.read_table(path)
+        meta = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items() if k in (b"since", b"fetched_at")}
+        return table.to_pandas(), meta
+    except Exception:
+        return None, {}
+
+def write_cached(ticker, df, since, fetched_at=None):
+    """原子寫入：先寫暫存檔再 rename，避免中斷時留下壞檔"""
+    table = pa.Table.from_pandas(df)
+    meta = dict(table.schema.metadata or {})
+    meta[b"since"] = since.encode()
+    meta[b"fetched_at"] = (fetched_at or tw_now()).isoformat(timespec='seconds').encode()
+    path = _path(ticker)
+    tmp = f"{path}.tmp"
+    pq.write_table(table.replace_schema_metadata(meta), tmp)
+    os.replace(tmp, path)
+
+def is_fresh(meta, now=None):
+    """收盤後已抓過就不必再連網；盤中一律更新最後一根K棒"""
+    now = now or tw_now()
+    fetched_at = meta.get("fetched_at")
+    if not fetched_at or is_market_open(now): return False
+    return datetime.datetime.fromisoformat(fetched_at) >= last_close_mark(now)
+
+def download(ticker, start):
+    throttle("yfinance")
+    with timed_stage("price"): return _normalize(yf.Ticker(ticker).history(start=start, auto_adjust=True))
+
+def partial_tail(cached, meta):
+    """快取最後一根是否為盤中抓到、尚未收盤的K棒 (收盤價之後還會變，不能拿來判斷除權息)"""
+    fetched_at = meta.get("fetched_at")
+    if cached is None or cached.empty or not fetched_at: return False
+    close = datetime.datetime.combine(cached.index[-1].date(), datetime.time(14, 30))
+    return datetime.datetime.fromisoformat(fetched_at) < close
+
+def merge_bars(cached, new, partial=False):
+    """把新K棒接到快取尾端；若重疊那根的收盤價變了 (除權息還原) 回傳 None 代表需整段重抓。
+    partial=True 表示快取最後一根是盤中K棒：直接由新資料覆蓋，不列入還原檢查"""
+    if new.empty: return cached
+    if partial: cached = cached.iloc[:-1]
+    overlap = new.index[0]
+    if overlap in cached.index:
+        old_close = cached.at[overlap, 'Close']
+        if old_close and abs(new.at[overlap, 'Close'] / old_close - 1) > READJUST_TOLERANCE: return None
+    merged = pd.concat([cached[cached.index < overlap], new])
+    return merged[~merged.index.duplicated(keep='last')]
+
+def _apply_update(ticker, cached, meta, new_bars):
+    """把增量K棒寫回快取，回傳更新後的完整資料。
+    下載結果為空 (yf.download 被限流時不拋例外而是回傳空表) 時不寫檔，保留 fetched_at 讓下次重抓"""
+    if new_bars.empty: return cached
+    merged = merge_bars(cached, new_bars, partial_tail(cached, meta))
+    if merged is None:
+        merged = download(ticker, meta["since"])
+        print(f"🔁 {ticker} 偵測到除權息還原價變動，已整段重建快取")
+    if merged.empty: return cached
+    write_cached(ticker, merged, meta["since"])  # 只有重疊那根也重寫一次，更新 fetched_at 避免重複連網
+    return merged
+
+def _update_start(cached, meta):
+    """從最後一根「收盤後抓到」的K棒開始補抓，讓重疊檢查比對的是定案收盤價"""
+    if partial_tail(cached, meta): cached = cached.iloc[:-1]
+    return cached.index[-1].strftime('%Y-%m-%d') if not cached.empty else meta["since"]
+
+def get_history(ticker, period="1y"):
+    """取代 yf.Ticker(ticker).history(period=...)：優先讀快取，只補抓缺少的尾端K棒"""
+    cached, meta = read_cached(ticker)
+    fill_start = min(_period_start(period), _period_start(MIN_FILL_PERIOD))
+
+    if cached is None or meta.get("since", "9999") > fill_start:
+        df = download(ticker, fill_start)
+        if df.empty: return df
+        write_cached(ticker, df, fill_start)
+        return _slice(df, period)
+
+    if not is_fresh(meta):
+        try:
+            cached = _apply_update(ticker, cached, meta, download(ticker, _update_start(cached, meta)))
+        except Exception as e:
+            print(f"⚠️ {ticker} 增量更新失敗，改用既有快取: {e}")
+    return _slice(cached, period)
+
+# ==========================================
+# 批次下載：全市場掃描前一次補齊所有股票的快取
+# ==========================================
+BATCH_SIZE = 100
+
+def _split_batch(data, batch):
+    """把 yf.download 的多股票寬表拆回每檔股票自己的 OHLCV 表"""
+    if data is None or data.empty: return {t: _normalize(None) for t in batch}
+    if not isinstance(data.columns, pd.MultiIndex): return {batch[0]: _normalize(data)}
+    level = 0 if set(batch) & set(data.columns.get_level_values(0)) else 1
+    tickers = set(data.columns.get_level_values(level))
+    return {t: _normalize(data.xs(t, axis=1, level=level) if t in tickers else None) for t in batch}
+
+def download_batch(batch, start):
+    throttle("yfinance")
+    with timed_stage("price"): data = yf.download(batch, start=start, group_by='ticker', auto_adjust=True, threads=True, progress=False)
+    return _split_batch(data, batch)
+
+def prefetch(tickers, period="1y", batch_size=BATCH_SIZE):
+    """一次把多檔股票的快取補到最新：依起始日分組，每 batch_size 檔只發一個 yf.download 請求"""
+    fill_start = min(_period_start(period), _period_start(MIN_FILL_PERIOD))
+    groups, states = {}, {}
+    for t in dict.fromkeys(tickers):
+        cached, meta = read_cached(t)
+        if cached is None or meta.get("since", "9999") > fill_start:
+            groups.setdefault(fill_start, []).append(t)
+        elif not is_fresh(meta):
+            states[t] = (cached, meta)
+            groups.setdefault(_update_start(cached, meta), []).append(t)
+
+    pending = sum(len(v) for v in groups.values())
+    if not pending:
+        print(f"✅ K線快取皆為最新 (共 {len(tickers)} 檔)，無需下載")
+        return 0
+    print(f"📥 批次更新K線快取：{pending} 檔需下載 (每批 {batch_size} 檔)")
+
+    updated = 0
+    for start, group in groups.items():
+        for i in range(0, len(group), batch_size):
+            batch = group[i:i + batch_size]
+            try: frames = download_batch(batch, start)
+            except Exception as e:
+                count_retry("price")  # 這批的快取維持舊狀，之後 get_history 會逐檔重抓
+                print(f"⚠️ 批次下載失敗 ({start}, {len(batch)} 檔): {e}")
+                continue
+            for t, df in frames.items():
+                if df.empty: continue  # 空結果不算更新，快取維持原狀等下次重抓
+                try:
+                    if t in states: _apply_update(t, *states[t], df)
+                    else: write_cached(t, df, fill_start)
+                    updated += 1
+                except Exception as e: print(f"⚠️ {t} 寫入快取失敗: {e}")
+    print(f"✅ K線快取批次更新完成：{updated}/{pending} 檔")
+    return updated
@@ -0,0 +1,243 @@
+import atexit, collections, datetime, hashlib, importlib, json, os, pickle, shutil, tempfile, threading, time
+import stock_common
+
+# ==========================================
+# 外部服務錄製 / 重播層 (yfinance / FinMind / LINE / Google Sheets)
+# ==========================================
+# STOCK_REPLAY=record：照常連網，並把每個回應存成 fixture (STOCK_REPLAY_DIR，預設 fixtures/replay)；
+# STOCK_REPLAY=replay：完全離線，由 fixture 回應；LINE 推播與 Sheets 寫入改記到 outbox.jsonl 方便比對輸出。
+# 兩種模式都用全新的暫存快取目錄並凍結台北時間，讓重播時發出的請求與錄製時一模一樣。
+# 由 stock_common 在 import 時依環境變數自動安裝，四支腳本不需任何修改。
+MODES = ("record", "replay")
+DEFAULT_DIR = os.path.join("fixtures", "replay")
+SECRET_ENV = ("LINE_ACCESS_TOKEN", "GOOGLE_SHEETS_JSON", "FINMIND_TOKEN", "GEMINI_API_KEY", "MAIL_USERNAME", "MAIL_PASSWORD")
+SHEET_WRITES = {"append_row", "append_rows", "update", "update_cell", "update_cells", "update_acell", "batch_update", "clear",
+                "batch_clear", "add_worksheet", "del_worksheet", "insert_row", "insert_rows", "delete_rows", "format",
+                "batch_format", "resize", "update_title", "freeze", "set_basic_filter"}
+
+class ReplayMiss(ConnectionError):
+    """重播模式下找不到對應的 fixture"""
+
+class ReplayError(Exception):
+    """錄製時拋出的例外無法以原型別重建時，重播改拋這個 (訊息相同)"""
+
+class _Raised:
+    """錄製時拋出的例外：只存型別路徑與訊息 (例外物件本身常帶連線/回應，不一定能 pickle)"""
+    def __init__(self, exc):
+        self.module, self.kind, self.message = type(exc).__module__, type(exc).__qualname__, str(exc)
+
+    def rebuild(self):
+        try:
+            cls = importlib.import_module(self.module)
+            for part in self.kind.split("."): cls = getattr(cls, part)
+            return cls(self.message)
+        except Exception:
+            return ReplayError(f"{self.kind}: {self.message}")
+
+class _ProxyRef:
+    """fixture 中代表「回傳了一個 gspread 物件」，重播時換成對應路徑的代理"""
+    def __init__(self, path):
+        self.path = path
+
+class Recorder:
+    def __init__(self, mode, root):
+        self.mode, self.root = mode, root
+        self._lock = threading.Lock()
+        self.calls = collections.Counter()  # 本程序經過重播層的外部呼叫次數 {服務: 次數}
+        self._index_path = os.path.join(root, "index.json")
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f: self.index = json.load(f)
+        except Exception: self.index = {}
+
+    @staticmethod
+    def key(service, name, args, kwargs):
+        raw = json.dumps([service, name, list(args), kwargs], sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _path(self, service, key):
+        return os.path.join(self.root, service, f"{key}.pkl")
+
+    def _load(self, service, key):
+        with open(self._path(service, key), "rb") as f: value = pickle.load(f)
+        if isinstance(value, _Raised): raise value.rebuild()
+        return value
+
+    def call(self, service, name, args, kwargs, real, encode=None, loose=False):
+        """錄製：執行 real() 並存檔 (encode 決定存進 fixture 的形式)；重播：讀檔回傳。
+        loose=True 時找不到完全相同的參數就退回同一個呼叫名稱的第一筆錄製 (參數含當天日期的寫入類呼叫)"""
+        key = self.key(service, name, args, kwargs)
+        with self._lock: self.calls[service] += 1
+        if self.mode == "replay":
+            if os.path.exists(self._path(service, key)): return self._load(service, key)
+            if loose:
+                for k, meta in self.index.items():
+                    if meta["service"] == service and meta["name"] == name: return self._load(service, k)
+            raise ReplayMiss(f"找不到重播資料：{service} {name} {list(args)}")
+        try:
+            result = real()
+            stored = encode(result) if encode else result
+        except Exception as e:
+            result, stored = e, _Raised(e)
+        path = self._path(service, key)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f: pickle.dump(stored, f)
+            self.index.setdefault(key, {"service": service, "name": name, "args": json.dumps(list(args), default=str, ensure_ascii=False)[:200]})
+        if isinstance(result, Exception): raise result
+        return result
+
+    def outbox(self, service, name, payload):
+        """重播模式的對外輸出 (LINE 推播、Sheets 寫入) 依序記錄，供前後版本比對"""
+        with self._lock: self.calls[service] += 1
+        with self._lock, open(os.path.join(self.root, "outbox.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps({"service": service, "name": name, "payload": payload}, default=str, ensure_ascii=False) + "\n")
+
+    def save_index(self):
+        with self._lock, open(self._index_path, "w", encoding="utf-8") as f: json.dump(self.index, f, ensure_ascii=False, indent=1)
+
+# ------------------------------------------
+# 各服務的替換函數
+# ------------------------------------------
+def _patch_yfinance(rec):
+    import yfinance as yf
+    history, info, download = yf.Ticker.history, yf.Ticker.info, yf.download
+
+    def _history(self, *args, **kwargs):
+        return rec.call("yfinance", "history", [self.ticker, *args], kwargs, lambda: history(self, *args, **kwargs))
+
+    yf.Ticker.history = _history
+    yf.Ticker.info = property(lambda self: rec.call("yfinance", "info", [self.ticker], {}, lambda: info.fget(self)))
+    yf.download = lambda *args, **kwargs: rec.call("yfinance", "download", list(args), kwargs, lambda: download(*args, **kwargs))
+
+def _patch_finmind(rec):
+    from FinMind.data import DataLoader
+    init = DataLoader.__init__
+
+    def _init(self, *args, **kwargs):
+        if rec.mode == "record": init(self, *args, **kwargs)  # 重播時不登入、不連網
+
+    def _wrap(name, method):
+        def wrapper(self, *args, **kwargs):
+            return rec.call("finmind", name, args, kwargs, lambda: method(self, *args, **kwargs))
+        return wrapper
+
+    DataLoader.__init__ = _init
+    for name in dir(DataLoader):
+        if name.startswith("taiwan_") and callable(getattr(DataLoader, name)): setattr(DataLoader, name, _wrap(name, getattr(DataLoader, name)))
+
+def _snapshot(resp):
+    """只保留回應內容，不保留原始 request (標頭裡有 Bearer token)"""
+    import requests
+    out = requests.Response()
+    out._content, out.status_code, out.url, out.encoding = resp.content, resp.status_code, resp.url, resp.encoding
+    out.headers.update(resp.headers)
+    return out
+
+def _ok_response(url):
+    import requests
+    out = requests.Response()
+    out._content, out.status_code, out.url = b"{}", 200, url
+    return out
+
+def _patch_requests(rec):
+    import requests
+    real = {"get": requests.get, "post": requests.post}
+
+    def _wrap(method):
+        def wrapper(url, *args, **kwargs):
+            is_line = "api.line.me" in url
+            if is_line and method == "post" and rec.mode == "replay":
+                rec.outbox("line", url, kwargs.get("json"))
+                return _ok_response(url)
+            params = {k: v for k, v in (kwargs.get("params") or {}).items() if k != "token"}
+            return rec.call("http", f"{method.upper()} {url}", [] if is_line else [params], {},
+                            lambda: _snapshot(real[method](url, *args, **kwargs)), loose=is_line)
+        return wrapper
+
+    requests.get, requests.post = _wrap("get"), _wrap("post")
+
+class SheetProxy:
+    """gspread 物件代理：每個屬性與方法呼叫依「呼叫路徑」錄製；回傳的 gspread 物件再包一層代理"""
+
+    def __init__(self, rec, path, target=None):
+        self._rec, self._path, self._target = rec, path, target
+
+    def _encode(self, child_path):
+        return lambda value: _ProxyRef(child_path) if type(value).__module__.startswith("gspread") else value
+
+    def _wrap(self, child_path, value):
+        if self._rec.mode == "record":
+            return SheetProxy(self._rec, child_path, value) if type(value).__module__.startswith("gspread") else value
+        return SheetProxy(self._rec, value.path) if isinstance(value, _ProxyRef) else value
+
+    def __getattr__(self, attr):
+        rec, path = self._rec, f"{self._path}.{attr}"
+        kind = rec.call("gspread", path, ["__kind__"], {}, lambda: "method" if callable(getattr(self._target, attr)) else "attr")
+        if kind == "attr":
+            return self._wrap(path, rec.call("gspread", path, [], {}, lambda: getattr(self._target, attr), self._encode(path)))
+
+        def method(*args, **kwargs):
+            child = f"{path}#{Recorder.key('gspread', path, args, kwargs)[:8]}"
+            if rec.mode == "replay" and attr in SHEET_WRITES: rec.outbox("gspread", path, {"args": args, "kwargs": kwargs})
+            value = rec.call("gspread", path, args, kwargs, lambda: getattr(self._target, attr)(*args, **kwargs), self._encode(child), loose=True)
+            return self._wrap(child, value)
+        return method
+
+    def __iter__(self):
+        return iter(self.__getattr__("worksheets")())
+
+def _patch_gspread(rec):
+    try: import gspread
+    except ImportError: return
+    authorize = gspread.authorize
+    gspread.authorize = lambda creds, *a, **k: SheetProxy(rec, "client", authorize(creds, *a, **k) if rec.mode == "record" else None)
+    if rec.mode == "replay":
+        try:
+            from oauth2client.service_account import ServiceAccountCredentials
+            ServiceAccountCredentials.from_json_keyfile_dict = classmethod(lambda cls, *a, **k: None)
+        except ImportError: pass
+
+# ------------------------------------------
+# 安裝
+# ------------------------------------------
+_RECORDER = None
+
+def _prepare_env(rec):
+    """錄製時記下凍結時間與哪些金鑰存在；重播時以假值補上同一組金鑰，讓程式走相同的分支。
+    已有 meta.json 的目錄再錄製時沿用原本的凍結時間 (多支腳本分次錄進同一組 fixture)，要重錄請先刪除目錄"""
+    meta_path = os.path.join(rec.root, "meta.json")
+    if rec.mode == "record":
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f: meta = json.load(f)
+        except Exception: meta = {"now": stock_common.tw_now().isoformat(timespec='seconds'), "env": {}}
+        meta["env"] = {k: bool(os.getenv(k)) or meta["env"].get(k, False) for k in SECRET_ENV}
+        with open(meta_path, "w", encoding="utf-8") as f: json.dump(meta, f, ensure_ascii=False, indent=1)
+    else:
+        with open(meta_path, "r", encoding="utf-8") as f: meta = json.load(f)
+        for k, present in meta["env"].items():
+            if present: os.environ[k] = "{}" if k == "GOOGLE_SHEETS_JSON" else "replay"
+            else: os.environ.pop(k, None)
+        os.environ["ENABLE_AI"] = "false"  # Gemini 不在重播範圍內
+        time.sleep = lambda seconds: None  # 離線全速執行
+        outbox = os.path.join(rec.root, "outbox.jsonl")
+        if os.path.exists(outbox): os.remove(outbox)
+    stock_common.freeze_clock(datetime.datetime.fromisoformat(meta["now"]))
+
+def call_counts():
+    """目前為止經過重播層的外部呼叫次數 {服務: 次數}；未安裝重播層時為空"""
+    return dict(_RECORDER.calls) if _RECORDER else {}
+
+def install(mode, root=DEFAULT_DIR):
+    """依模式替換 yfinance / FinMind / requests(LINE) / gspread，並改用暫存快取目錄"""
+    global _RECORDER
+    if mode not in MODES: raise ValueError(f"STOCK_REPLAY 只接受 {MODES}，收到 {mode!r}")
+    if _RECORDER: return _RECORDER
+    os.makedirs(root, exist_ok=True)
+    rec = _RECORDER = Recorder(mode, root)
+    _prepare_env(rec)
+    stock_common.CACHE_DIR = tempfile.mkdtemp(prefix=f"stock_{mode}_")
+    atexit.register(shutil.rmtree, stock_common.CACHE_DIR, True)
+    for patch in (_patch_yfinance, _patch_finmind, _patch_requests, _patch_gspread): patch(rec)
+    if mode == "record": atexit.register(rec.save_index)
+    print(f"🎞️ 外部服務{'錄製' if mode == 'record' else '重播'}模式：{root}")
+    return rec
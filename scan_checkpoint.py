@@ -0,0 +1,57 @@
+import json, os, threading
+from stock_common import cache_path, tw_today
+
+# ==========================================
+# 全市場掃描的斷點續跑：定期把已完成的代號與結果寫到快取目錄
+# ==========================================
+# 檔案放在 .stock_cache/checkpoints/ (CI 隨K線快取一起保存)，只對同一天的掃描有效；
+# 每完成 CHECKPOINT_EVERY 檔寫一次 (原子替換，寫到一半被中斷也不會損毀)，全部推播完成後刪除。
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "50"))
+
+def _json_default(o):
+    """numpy 純量轉回 Python 數值"""
+    return o.item() if hasattr(o, "item") else str(o)
+
+class Checkpoint:
+    """results[代號] = 該檔的掃描結果 (需可轉 JSON)；add() 可由多個工作執行緒同時呼叫"""
+
+    def __init__(self, name, every=CHECKPOINT_EVERY, tag=None):
+        self.path = cache_path("checkpoints", f"{name}.json")
+        self.every = every
+        self.tag = tag or tw_today().isoformat()
+        self.results = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def load(self):
+        """讀回同一個 tag (預設為今天日期) 的進度，回傳已完成檔數；日期不同或檔案損毀就從頭開始"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: data = json.load(f)
+        except Exception: return 0
+        if data.get("tag") == self.tag: self.results = data.get("results", {})
+        return len(self.results)
+
+    def done(self, key):
+        return key in self.results
+
+    def add(self, key, result):
+        with self._lock:
+            self.results[key] = result
+            self._pending += 1
+            if self._pending < self.every: return
+            self._pending = 0
+            self._write()
+
+    def flush(self):
+        with self._lock:
+            self._pending = 0
+            self._write()
+
+    def _write(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump({"tag": self.tag, "results": self.results}, f, ensure_ascii=False, default=_json_default)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        with self._lock:
+            if os.path.exists(self.path): os.remove(self.path)
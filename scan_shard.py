@@ -0,0 +1,64 @@
+import argparse, glob, json, os, zlib
+from stock_common import tw_today
+
+# ==========================================
+# 分片掃描：--shard i/N 只掃全市場的第 i 份，結果寫成分片檔；--merge 合併後才同步報表與推播
+# ==========================================
+# 代號依 crc32 雜湊分配到 N 份 (與清單順序無關，各台機器各自下載的股票清單略有差異也不會重複或漏掃)；
+# 分片檔放在 SHARD_DIR (預設 shards/)，CI 以 artifact 交給合併工作。
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+
+def parse_shard(spec):
+    """'2/4' → (2, 4)；i 從 1 起算"""
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"分片格式應為 i/N (例如 1/4)，收到 {spec!r}")
+    if not 1 <= index <= count: raise ValueError(f"分片序號需介於 1 到 {count}，收到 {spec!r}")
+    return index, count
+
+def in_shard(key, shard):
+    """shard 為 None 時 (不分片) 一律為 True"""
+    if shard is None: return True
+    index, count = shard
+    return zlib.crc32(str(key).encode()) % count == index - 1
+
+def _shard_arg(spec):
+    try: return parse_shard(spec)
+    except ValueError as e: raise argparse.ArgumentTypeError(str(e))
+
+def add_shard_args(parser):
+    parser.add_argument("--shard", type=_shard_arg, help="只掃第 i/N 份並寫出分片檔，不同步報表與推播")
+    parser.add_argument("--merge", nargs="+", metavar="FILE", help="合併分片檔 (可用萬用字元) 後統一同步報表與推播，不再掃描")
+    return parser
+
+def shard_name(script, shard):
+    return f"{script}_{shard[0]}of{shard[1]}"
+
+def write_shard(script, shard, payload):
+    """寫出分片結果 (原子替換)，回傳路徑"""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    path = os.path.join(SHARD_DIR, f"{shard_name(script, shard)}.json")
+    data = {"script": script, "shard": list(shard), "tag": tw_today().isoformat(), **payload}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+    os.replace(tmp, path)
+    print(f"🧩 分片 {shard[0]}/{shard[1]} 結果已寫入 {path}")
+    return path
+
+def load_shards(script, patterns):
+    """讀取並檢查分片檔：同一支腳本、同一天、分片數一致且 1..N 剛好各一份，否則中止 (避免推播不完整的結果)"""
+    paths = sorted({p for pattern in patterns for p in (glob.glob(pattern) or [pattern])})
+    shards = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f: shards.append(json.load(f))
+    if not shards: raise SystemExit("❌ 找不到任何分片檔")
+    wrong = [p for p, s in zip(paths, shards) if s.get("script") != script]
+    if wrong: raise SystemExit(f"❌ 分片檔不屬於 {script}：{', '.join(wrong)}")
+    counts, tags = {s["shard"][1] for s in shards}, {s["tag"] for s in shards}
+    if len(counts) > 1 or len(tags) > 1: raise SystemExit(f"❌ 分片數或日期不一致：分片數 {sorted(counts)}，日期 {sorted(tags)}")
+    count = counts.pop()
+    indexes = sorted(s["shard"][0] for s in shards)
+    if indexes != list(range(1, count + 1)): raise SystemExit(f"❌ 分片不完整：需要 1..{count}，收到 {indexes}")
+    print(f"🧩 已載入 {count} 個分片 ({tags.pop()})")
+    return shards
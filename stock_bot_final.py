@@ -1,12 +1,15 @@
 import os
-import yfinance as yf
 import pandas as pd
 import requests
-import time
 import datetime
+import argparse
 from FinMind.data import DataLoader
-from ta.momentum import RSIIndicator
-from ta.trend import SMAIndicator
+import price_store
+import ticker_resolver
+import strategy_engine
+import scan_shard
+from indicator_panel import IndicatorPanel, panel_for
+from stock_common import parallel_map, add_workers_arg, timed_stage, stage_summary, save_run_report
 
 # ==========================================
 # 1. 設定環境參數
@@ -15,7 +18,10 @@ LINE_ACCESS_TOKEN = os.getenv("LINE_ACCESS_TOKEN")
 # [優化] 改為優先讀取環境變數，若無則使用預設值
 LINE_USER_ID = os.getenv("LINE_USER_ID") or "U2e9b79c2f71cb2a3db62e5d75254270c"
 FINMIND_TOKEN = os.getenv("FINMIND_TOKEN") # [新增] 避免 API 限流
+INDICATOR_PANEL = None  # 全市場指標表 (main 批次下載後一次算好)
+SIGNALS = None  # strategies.json「pro」在全市場的計算結果
 
+@timed_stage("line")
 def send_line_message(message):
     if not LINE_ACCESS_TOKEN: return
     url = "https://api.line.me/v2/bot/message/push"
@@ -31,83 +37,85 @@ def get_stock_info_map():
         if FINMIND_TOKEN:
             dl = DataLoader(token=FINMIND_TOKEN)
             
-        df = dl.taiwan_stock_info()
+        with timed_stage("stock_list"): df = dl.taiwan_stock_info()
         stock_map = {}
-        m_col = 'market_type' if 'market_type' in df.columns else ('category' if 'category' in df.columns else None)
+        ticker_resolver.update_from_stock_info(df)
         for _, row in df.iterrows():
             sid = str(row['stock_id'])
             if 4 <= len(sid) <= 5:
-                suffix = ".TWO" if m_col and str(row[m_col]) in ['上櫃', 'OTC'] else ".TW"
-                stock_map[f"{sid}{suffix}"] = row.get('industry_category', '股票')
+                ticker = ticker_resolver.lookup(sid) or f"{sid}.TW"
+                stock_map[ticker] = row.get('industry_category', '股票')
         return stock_map
     except: return {"2330.TW": "半導體"}
 
 def analyze_pro(ticker, industry):
     """整合深度診斷的掃描函數"""
     try:
-        stock = yf.Ticker(ticker)
-        df = stock.history(period="1y", progress=False)
-        if len(df) < 60: return None, []
+        # 📐 指標直接查全市場指標表 (成交量為 0 的最後一根已在建表時剔除)
+        panel = panel_for(INDICATOR_PANEL, ticker, "1y", drop_zero_volume_tail=True)
+        if not panel.has(ticker) or panel.length(ticker) < 60: return None, []
         
-        if df.iloc[-1]['Volume'] == 0: df = df.iloc[:-1]
+        curr_p = panel.get(ticker, 'close')
+        prev_close = panel.get(ticker, 'close', -2)
+        ma60 = panel.get(ticker, 'ma60')
+        rsi = panel.get(ticker, 'rsi_wilder')
+        vol_ratio = panel.get(ticker, 'volume') / panel.get(ticker, 'vol_avg10')
         
-        close = df['Close']
-        df['RSI'] = RSIIndicator(close).rsi()
-        df['MA20'] = SMAIndicator(close, 20).sma_indicator()
-        df['MA60'] = SMAIndicator(close, 60).sma_indicator()
-        
-        latest = df.iloc[-1]
-        prev = df.iloc[-2]
-        curr_p = latest['Close']
-        ma60 = latest['MA60']
-        rsi = latest['RSI']
-        
-        # --- 潛力篩選邏輯 ---
-        signals = []
-        tags = []
-        # 1. 底部轉強
-        if prev['RSI'] < 45 and rsi > prev['RSI']: signals.append("底部轉強"); tags.append("轉強")
-        # 2. 回測月線
-        dist_ma20 = (curr_p - latest['MA20']) / latest['MA20']
-        if 0 < dist_ma20 < 0.025 and curr_p > prev['Close']: signals.append("回測月線"); tags.append("支撐")
-        # 3. 金流爆量
-        avg_vol = df['Volume'].iloc[-11:-1].mean()
-        vol_ratio = latest['Volume'] / avg_vol
-        if vol_ratio > 1.5 and latest['Volume'] > 1000000: signals.append("金流湧入"); tags.append("爆量")
+        # --- 潛力篩選邏輯 (底部轉強 / 回測月線 / 金流爆量，條件定義在 strategies.json 的 pro 群組) ---
+        sig = strategy_engine.row_for(SIGNALS, "pro", panel, ticker)
+        signals = [label for key, label in (("rebound", "底部轉強"), ("support", "回測月線"), ("money_flow", "金流湧入")) if sig[key]]
+        tags = [tag for key, tag in (("rebound", "轉強"), ("support", "支撐"), ("money_flow", "爆量")) if sig[key]]
 
-        # 判定是否值得推薦
-        is_hit = (len(signals) >= 2) or ("金流湧入" in signals and curr_p > prev['Close'])
-        # 排除過熱
+        # 判定是否值得推薦 (三訊號取二或金流湧入收紅，並排除季線乖離過熱)
+        is_hit = sig['is_hit']
         bias_60 = (curr_p - ma60) / ma60
-        if bias_60 > 0.20: is_hit = False
 
-        if is_hit and curr_p >= 10:
+        if is_hit:
             # 計算戰略數據
-            high_1y = df['High'].max()
+            high_1y = panel.get(ticker, 'high_max')
             stop_loss = ma60 * 0.97
             action = "🟡 支撐區佈局" if bias_60 < 0.07 else "🔥 強勢跟進"
             
             # 籌碼簡易抓取 (當前 turn)
-            info_msg = f"📍{ticker} [{industry}]\n現價: {curr_p:.2f} ({((curr_p/prev['Close'])-1)*100:+.1f}%)\n量比: {vol_ratio:.1f} / RSI: {rsi:.1f}\n訊號: {'/'.join(signals)}\n\n【🚀 戰略指引】\n● 建議：{action}\n● 壓力：{high_1y:.1f}\n● 支撐：{ma60:.1f}\n● 停損：{stop_loss:.1f}"
+            info_msg = f"📍{ticker} [{industry}]\n現價: {curr_p:.2f} ({((curr_p/prev_close)-1)*100:+.1f}%)\n量比: {vol_ratio:.1f} / RSI: {rsi:.1f}\n訊號: {'/'.join(signals)}\n\n【🚀 戰略指引】\n● 建議：{action}\n● 壓力：{high_1y:.1f}\n● 支撐：{ma60:.1f}\n● 停損：{stop_loss:.1f}"
             return info_msg, tags
         return None, tags
     except: return None, []
 
-def main():
+def scan_market(workers=1, shard=None):
+    """掃描全市場 (shard 指定時只掃該分片)：回傳 {stats, results=[[全市場順序, 報告]]}"""
+    global INDICATOR_PANEL, SIGNALS
     print(f"🚀 啟動 Pro 級全台股潛力掃描...")
     stock_map = get_stock_info_map()
-    results = []
     stats = {"轉強": 0, "支撐": 0, "爆量": 0, "總掃描": 0}
+    # 🧩 分片：只保留本分片的代號 (順序編號仍以全市場清單為準，合併後推播順序不變)
+    items = [(i, t, industry) for i, (t, industry) in enumerate(stock_map.items()) if scan_shard.in_shard(t, shard)]
+    tickers = [t for _, t, _ in items]
+    if shard: print(f"🧩 分片 {shard[0]}/{shard[1]}：負責 {len(items)} / {len(stock_map)} 檔")
     
     total = len(stock_map)
-    for i, (ticker, industry) in enumerate(stock_map.items()):
+    # 📦 批次預先下載全市場K線至本地快取，之後 analyze_pro 只讀快取，不再逐檔連網
+    price_store.prefetch(tickers, "1y")
+    # 📐 全市場 RSI/均線/量比 由增量狀態只推進新K棒，逐檔分析只查表
+    INDICATOR_PANEL = IndicatorPanel.from_store(tickers, "1y", drop_zero_volume_tail=True)
+    SIGNALS = strategy_engine.evaluate("pro", INDICATOR_PANEL)
+
+    def scan(item):
+        i, ticker, industry = item
         if i % 100 == 0: print(f"進度: {i}/{total}...")
-        res_msg, tags = analyze_pro(ticker, industry)
+        return analyze_pro(ticker, industry)
+
+    # --workers N 時並行分析，結果依原本股票順序彙整，推播內容與序列執行相同
+    results = []
+    for (i, _, _), (res_msg, tags) in zip(items, parallel_map(scan, items, workers)):
         stats["總掃描"] += 1
         for t in tags: stats[t] += 1
-        if res_msg: results.append(res_msg)
-        time.sleep(0.05)
-    
+        if res_msg: results.append([i, res_msg])
+    return {"stats": stats, "results": results}
+
+def publish(stats, results):
+    """推播個股報告與市場結構摘要 (單機掃描或合併分片後只執行一次)"""
+    results = [msg for _, msg in sorted(results, key=lambda r: r[0])]
     if results:
         # 每一檔發一則詳細報告，或 3 檔一組避免訊息太長
         for i in range(0, len(results), 3):
@@ -121,10 +129,26 @@ def main():
         f"🌟 底部轉強：{stats['轉強']} 檔\n"
         f"🛡️ 回測支撐：{stats['支撐']} 檔\n"
         f"💥 金流異動：{stats['爆量']} 檔\n\n"
-        f"💡 建議：優先挑選符合「支撐區佈局」且量比 > 1.5 的標的。"
+        f"💡 建議：優先挑選符合「支撐區佈局」且量比 > 1.5 的標的。\n\n"
+        f"{stage_summary()}"
     )
     send_line_message(summary)
     print("🏁 掃描結束")
 
+def main(workers=1, shard=None):
+    scanned = scan_market(workers, shard)
+    if shard: scan_shard.write_shard("stock_bot_final", shard, scanned)
+    else: publish(**scanned)
+
+def merge(patterns):
+    """合併各分片：統計逐項相加、個股報告依全市場順序排列，再統一推播"""
+    shards = scan_shard.load_shards("stock_bot_final", patterns)
+    stats = {k: sum(s["stats"][k] for s in shards) for k in shards[0]["stats"]}
+    publish(stats, [r for s in shards for r in s["results"]])
+
 if __name__ == "__main__":
-    main()
+    args = scan_shard.add_shard_args(add_workers_arg(argparse.ArgumentParser(description="Pro 級全台股潛力掃描"))).parse_args()
+    try:
+        if args.merge: merge(args.merge)
+        else: main(args.workers, args.shard)
+    finally: save_run_report(scan_shard.shard_name("stock_bot_final", args.shard) if args.shard else "stock_bot_final", workers=args.workers)
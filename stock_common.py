@@ -0,0 +1,154 @@
+import os, contextlib, datetime, json, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# 股票腳本共用設定：本地快取目錄與台北時間
+# ==========================================
+CACHE_DIR = os.getenv("STOCK_CACHE_DIR", ".stock_cache")
+
+def cache_path(*parts):
+    """回傳快取目錄下的路徑，並確保上層資料夾存在"""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+_FROZEN_NOW = None
+
+def tw_now():
+    """台北時間 (naive datetime)；freeze_clock 之後固定回傳凍結的時間"""
+    if _FROZEN_NOW: return _FROZEN_NOW
+    return datetime.datetime.utcnow() + datetime.timedelta(hours=8)
+
+def freeze_clock(now):
+    """固定 tw_now() 的回傳值 (錄製/重播時讓日期區間與判斷分支保持一致)，傳 None 解除"""
+    global _FROZEN_NOW
+    _FROZEN_NOW = now
+
+def tw_today():
+    return tw_now().date()
+
+def last_close_mark(now=None):
+    """最近一次台股收盤後資料可取得的時間點 (週一至週五 14:30，不處理國定假日)"""
+    now = now or tw_now()
+    mark = now.replace(hour=14, minute=30, second=0, microsecond=0)
+    if now < mark: mark -= datetime.timedelta(days=1)
+    while mark.weekday() >= 5: mark -= datetime.timedelta(days=1)
+    return mark
+
+def is_market_open(now=None):
+    now = now or tw_now()
+    return now.weekday() < 5 and datetime.time(9, 0) <= now.time() < datetime.time(14, 30)
+
+# ==========================================
+# 並行掃描：全域節流器 + 固定順序的執行緒池
+# ==========================================
+# 同一資料源的請求 (不論來自哪個執行緒) 間隔至少 interval 秒，可用環境變數調整
+RATE_LIMITS = {
+    "yfinance": float(os.getenv("YF_MIN_INTERVAL", "0.4")),
+    "finmind": float(os.getenv("FINMIND_MIN_INTERVAL", "0.5")),
+    "gemini": 60.0 / float(os.getenv("GEMINI_RPM", "15")),  # 每分鐘請求數上限換算成最小間隔
+}
+
+class RateLimiter:
+    """執行緒安全的最小間隔節流器：每次 wait() 預約下一個可用時段，超前就睡到該時段"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+_LIMITERS = {name: RateLimiter(interval) for name, interval in RATE_LIMITS.items()}
+
+def throttle(source):
+    """對外部資料源發請求前呼叫 ('yfinance' / 'finmind' / 'gemini')，所有工作執行緒共用同一個節流器"""
+    limiter = _LIMITERS.get(source)
+    if limiter:
+        with timed_stage("throttle"): limiter.wait()
+
+def parallel_map(fn, items, workers=1):
+    """回傳 [fn(x) for x in items]；workers > 1 時以執行緒池並行，結果順序仍與輸入一致"""
+    items = list(items)
+    if workers <= 1: return [fn(x) for x in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool: return list(pool.map(fn, items))
+
+def add_workers_arg(parser):
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SCAN_WORKERS", "1")),
+                        help="並行分析的執行緒數 (預設 1 = 逐檔依序)；所有執行緒共用 yfinance / FinMind 節流器")
+    return parser
+
+# ==========================================
+# 執行耗時統計：各階段的次數、總耗時、p50/p95 延遲與重試次數，結束時寫成 JSON 報告
+# ==========================================
+# 階段可以巢狀 (例如後綴探測裡的 K 線下載同時計入 suffix 與 price)，總耗時因此不等於各階段相加
+STAGE_LABELS = {
+    "stock_list": "股票清單", "suffix": "後綴辨識", "price": "K線", "info": "基本面", "chips": "籌碼",
+    "indicators": "指標", "gemini": "Gemini", "sheets": "Sheets", "line": "LINE", "throttle": "節流等待",
+}
+# 有重試路徑且呼叫 count_retry 的階段；其他階段 (FinMind 法人、LINE 推播等) 失敗即略過不重試，報告不列重試欄位以免誤讀為 0 次
+RETRY_STAGES = ("stock_list", "price", "gemini")
+RUN_REPORT_DIR = os.getenv("RUN_REPORT_DIR", "run_reports")
+_RUN_START = time.perf_counter()
+_STAGE_TIMES = {}
+_STAGE_RETRIES = {}
+_STAGE_LOCK = threading.Lock()
+
+@contextlib.contextmanager
+def timed_stage(name):
+    """計時一次呼叫 (with 區塊或函數裝飾器皆可)，例外也照樣計入"""
+    t0 = time.perf_counter()
+    try: yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        with _STAGE_LOCK: _STAGE_TIMES.setdefault(name, []).append(elapsed)
+
+def count_retry(name):
+    with _STAGE_LOCK: _STAGE_RETRIES[name] = _STAGE_RETRIES.get(name, 0) + 1
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def stage_report():
+    """{階段: {count, total, p50, p95[, retries]}} (秒)，依 STAGE_LABELS 順序；retries 只列 RETRY_STAGES"""
+    with _STAGE_LOCK: times, retries = {k: sorted(v) for k, v in _STAGE_TIMES.items()}, dict(_STAGE_RETRIES)
+    names = [n for n in STAGE_LABELS if n in times or n in retries] + sorted((set(times) | set(retries)) - set(STAGE_LABELS))
+    report = {}
+    for name in names:
+        v = times.get(name, [])
+        report[name] = {"count": len(v), "total": round(sum(v), 3),
+                        "p50": round(_percentile(v, 0.5), 3) if v else None,
+                        "p95": round(_percentile(v, 0.95), 3) if v else None}
+        if name in RETRY_STAGES or name in retries: report[name]["retries"] = retries.get(name, 0)
+    return report
+
+def stage_summary(top=4):
+    """一行摘要 (附在 LINE 完成訊息)：總耗時 + 最耗時的幾個階段"""
+    report = stage_report()
+    busiest = sorted((n for n in report if report[n]["count"]), key=lambda n: report[n]["total"], reverse=True)[:top]
+    parts = [f"{STAGE_LABELS.get(n, n)} {report[n]['total']:.0f}s/{report[n]['count']}次" for n in busiest]
+    retries = sum(r.get("retries", 0) for r in report.values())
+    if retries: parts.append(f"重試 {retries}")
+    return f"⏱️ 總耗時 {time.perf_counter() - _RUN_START:.0f}s｜" + "｜".join(parts)
+
+def save_run_report(script, **extra):
+    """寫出 run_reports/<腳本>_<時間>.json (CI 以 artifact 保存)，回傳路徑"""
+    os.makedirs(RUN_REPORT_DIR, exist_ok=True)
+    path = os.path.join(RUN_REPORT_DIR, f"{script}_{tw_now().strftime('%Y%m%d_%H%M%S')}.json")
+    report = {"script": script, "started_at": (tw_now() - datetime.timedelta(seconds=time.perf_counter() - _RUN_START)).isoformat(timespec='seconds'),
+              "elapsed": round(time.perf_counter() - _RUN_START, 3), "stages": stage_report(), **extra}
+    with open(path, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"⏱️ 執行耗時報告：{path}")
+    return path
+
+# ==========================================
+# 離線錄製 / 重播 (見 replay.py)：STOCK_REPLAY=record|replay，STOCK_REPLAY_DIR 指定 fixture 目錄
+# ==========================================
+if os.getenv("STOCK_REPLAY"):
+    import replay
+    replay.install(os.getenv("STOCK_REPLAY"), os.getenv("STOCK_REPLAY_DIR", replay.DEFAULT_DIR))
@@ -0,0 +1,166 @@
+import ast, json, operator, os
+import numpy as np
+
+# ==========================================
+# 宣告式策略引擎：strategies.json 的條件字串 → 全市場 NumPy 布林遮罩
+# ==========================================
+# 每個策略群組是一串「名稱: 運算式」，依序在整張指標表的橫斷面向量上計算一次；
+# 前面算出的結果 (數值或布林) 可被後面的運算式引用。新增策略只要改設定檔，不必再加逐檔 if 判斷。
+# 運算式語法沿用 Python：and / or / not、連續比較 (50 <= rsi <= 75)、+ - * /，
+# 函數只開放 abs / round / min / max；變數為指標表欄位、prev_欄位 (前一根)、length、呼叫端傳入的額外欄位 (如法人連買)，
+# 以及群組內 "params" 的門檻參數 (參數掃描 optimize.py 只覆寫這些值)。
+STRATEGY_FILE = os.getenv("STRATEGY_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "strategies.json"))
+
+_BIN_OPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+_CMP_OPS = {ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt, ast.LtE: operator.le, ast.Eq: operator.eq, ast.NotEq: operator.ne}
+_FUNCS = {"abs": np.abs, "round": np.round, "min": np.minimum, "max": np.maximum}
+
+_RULES = {}
+
+def _numeric(x):
+    """布林遮罩參與加減時當 0/1 計數 (numpy 的 bool + bool 是邏輯或)"""
+    x = np.asarray(x)
+    return x.astype(int) if x.dtype == bool else x
+
+def _compile_node(node, expr):
+    if isinstance(node, ast.Expression): return _compile_node(node.body, expr)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        value = node.value
+        return lambda ns: value
+    if isinstance(node, ast.Name):
+        name = node.id
+        def lookup(ns):
+            if name not in ns: raise KeyError(f"策略運算式「{expr}」用到未知欄位 {name}")
+            return ns[name]
+        return lookup
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile_node(v, expr) for v in node.values]
+        reduce = np.logical_and.reduce if isinstance(node.op, ast.And) else np.logical_or.reduce
+        return lambda ns: reduce([np.asarray(p(ns), dtype=bool) for p in parts])
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+        inner = _compile_node(node.operand, expr)
+        if isinstance(node.op, ast.Not): return lambda ns: np.logical_not(inner(ns))
+        return lambda ns: -_numeric(inner(ns))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op, left, right = _BIN_OPS[type(node.op)], _compile_node(node.left, expr), _compile_node(node.right, expr)
+        return lambda ns: op(_numeric(left(ns)), _numeric(right(ns)))
+    if isinstance(node, ast.Compare) and all(type(o) in _CMP_OPS for o in node.ops):
+        # 連續比較 a < b < c 拆成 (a < b) and (b < c)，NaN 一律視為不成立 (同 Python 純量比較)
+        operands = [_compile_node(n, expr) for n in [node.left] + node.comparators]
+        ops = [_CMP_OPS[type(o)] for o in node.ops]
+        def compare(ns):
+            values = [f(ns) for f in operands]
+            return np.logical_and.reduce([op(values[i], values[i + 1]) for i, op in enumerate(ops)])
+        return compare
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCS and not node.keywords:
+        fn, args = _FUNCS[node.func.id], [_compile_node(a, expr) for a in node.args]
+        return lambda ns: fn(*(_numeric(a(ns)) for a in args))
+    raise ValueError(f"策略運算式「{expr}」含不支援的語法: {ast.dump(node)[:60]}")
+
+def compile_expr(expr):
+    """把一條運算式編譯成 fn(namespace) → 向量 (語法錯誤在載入時就拋出)"""
+    return _compile_node(ast.parse(expr, mode="eval"), expr)
+
+def expr_names(expr):
+    """運算式引用到的變數名稱 (用來找出策略之間的相依關係)"""
+    return frozenset(n.id for n in ast.walk(ast.parse(expr, mode="eval")) if isinstance(n, ast.Name) and n.id not in _FUNCS)
+
+def load_rules(path=STRATEGY_FILE):
+    """讀取並編譯策略設定檔：{群組: {"params": 門檻參數, "rules": [(名稱, 編譯後函數, 引用名稱)]}}，以 _comment 開頭的鍵略過"""
+    if path not in _RULES:
+        with open(path, "r", encoding="utf-8") as f: config = json.load(f)
+        _RULES[path] = {
+            group: {"params": {k: v for k, v in rules.get("params", {}).items() if not k.startswith("_comment")},
+                    "rules": [(name, compile_expr(expr), expr_names(expr)) for name, expr in rules.items()
+                              if name != "params" and not name.startswith("_comment")]}
+            for group, rules in config.items() if not group.startswith("_comment")}
+    return _RULES[path]
+
+def group_params(group, path=STRATEGY_FILE):
+    """策略群組的預設門檻參數 (複本)"""
+    return dict(load_rules(path)[group]["params"])
+
+def required_rules(group, targets, path=STRATEGY_FILE):
+    """計算 targets 所需的最小策略集合 (含間接引用)，依設定檔順序回傳名稱"""
+    rules = load_rules(path)[group]["rules"]
+    deps = {name: names for name, _, names in rules}
+    needed, stack = set(), list(targets)
+    while stack:
+        name = stack.pop()
+        if name in deps and name not in needed:
+            needed.add(name)
+            stack.extend(deps[name])
+    return [name for name, _, _ in rules if name in needed]
+
+def panel_namespace(panel, tickers=None, row=-1):
+    """指標表某一列 (預設最新一根) 的橫斷面變數：欄位、prev_欄位與 length (截至該列的K棒數)。
+    row=None 時回傳整段歷史 (日期 × 股票)，供回測一次算完所有日期"""
+    cols = [panel.col[t] for t in tickers] if tickers is not None else slice(None)
+    ns = {}
+    if row is None:
+        for name, arr in panel.fields.items():
+            ns[name] = arr[:, cols]
+            ns[f"prev_{name}"] = np.vstack([np.full((1, ns[name].shape[1]), np.nan), ns[name][:-1]])
+        ns["length"] = np.cumsum(~np.isnan(ns["close"]), axis=0)
+        return ns
+    for name, arr in panel.fields.items():
+        ns[name] = arr[row, cols]
+        ns[f"prev_{name}"] = arr[row - 1, cols]
+    n = len(next(iter(panel.fields.values()))) if panel.fields else 0
+    ns["length"] = np.asarray(panel.lengths)[cols] - (n - 1 - row % n if n else 0)
+    return ns
+
+class Signals:
+    """策略群組的計算結果：values[name] 為與 tickers 對齊的向量"""
+
+    def __init__(self, tickers, values):
+        self.tickers = list(tickers)
+        self.col = {t: j for j, t in enumerate(self.tickers)}
+        self.values = values
+
+    def has(self, ticker):
+        return ticker in self.col
+
+    def row(self, ticker):
+        """單一股票所有策略的結果 (布林遮罩轉成 bool，其餘保留 numpy 純量)"""
+        j = self.col[ticker]
+        return {name: (bool(v[j]) if v.dtype == bool else v[j]) for name, v in self.values.items()}
+
+    def passing(self, name):
+        """某策略成立的股票清單 (依 tickers 順序)"""
+        return [t for t, ok in zip(self.tickers, self.values[name]) if ok]
+
+def _run(group, ns, shape, path, params=None, only=None):
+    spec = load_rules(path)[group]
+    ns.update(spec["params"])
+    if params: ns.update(params)
+    keep = set(required_rules(group, only, path)) if only is not None else None
+    values = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name, fn, _ in spec["rules"]:
+            if keep is not None and name not in keep: continue
+            ns[name] = values[name] = np.broadcast_to(np.asarray(fn(ns)), shape)
+    return values
+
+def evaluate(group, panel, tickers=None, extra=None, row=-1, path=STRATEGY_FILE, params=None):
+    """在指標表上一次算完整個策略群組；extra 為額外欄位 {名稱: 與 tickers 對齊的向量}，params 可覆寫門檻參數"""
+    tickers = list(panel.tickers if tickers is None else tickers)
+    ns = panel_namespace(panel, None if tickers == panel.tickers else tickers, row)
+    if extra: ns.update(extra)
+    return Signals(tickers, _run(group, ns, (len(tickers),), path, params))
+
+def evaluate_history(group, panel, extra=None, path=STRATEGY_FILE, params=None, only=None):
+    """整段歷史 (日期 × 股票) 一次算完：回傳 {名稱: 二維陣列}；extra 的陣列形狀需與指標表相同"""
+    return evaluate_namespace(group, panel_namespace(panel, row=None), extra, path, params, only)
+
+def evaluate_namespace(group, ns, extra=None, path=STRATEGY_FILE, params=None, only=None):
+    """在既有的變數表上計算 (不修改傳入的 ns，參數掃描可重複使用同一份歷史變數表)；only 只算指定策略及其相依項"""
+    ns = dict(ns)
+    if extra: ns.update(extra)
+    return _run(group, ns, ns["close"].shape, path, params, only)
+
+def row_for(signals, group, panel, ticker, extra=None):
+    """全市場結果裡有這檔就直接查；沒有 (例如單檔臨時指標表) 則只對這檔計算一次"""
+    if signals is not None and signals.has(ticker): return signals.row(ticker)
+    extra = {k: np.array([v], dtype=float) for k, v in (extra or {}).items()}
+    return evaluate(group, panel, [ticker], extra).row(ticker)
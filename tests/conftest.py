@@ -0,0 +1,4 @@
+import os, sys
+
+# 測試直接匯入專案根目錄的腳本模組
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
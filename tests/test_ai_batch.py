@@ -0,0 +1,50 @@
+import json
+import DailyStockPush
+
+IDS = {"2330", "2317", "1101"}
+
+def test_parse_full_reply():
+    text = json.dumps([{"id": "2330", "strategy": "拉回 600 佈局\n防守 580"}, {"id": "2317", "strategy": "觀望"}], ensure_ascii=False)
+    assert DailyStockPush.parse_batch_strategies(text, IDS) == {"2330": "拉回 600 佈局 防守 580", "2317": "觀望"}
+
+def test_parse_code_fence():
+    text = '```json\n[{"id": "1101", "strategy": "續抱"}]\n```'
+    assert DailyStockPush.parse_batch_strategies(text, IDS) == {"1101": "續抱"}
+
+def test_parse_malformed_or_partial_json():
+    for text in (None, "", "not json", '[{"id": "2330", "strategy": "續抱"', '{"id": "2330", "strategy": "續抱"}', '"2330"'):
+        assert DailyStockPush.parse_batch_strategies(text, IDS) == {}
+
+def test_parse_skips_foreign_ids_and_bad_items():
+    text = json.dumps([{"id": "9999", "strategy": "不在本批"}, {"id": 2330, "strategy": "數字代號也接受"},
+                       {"id": "2317", "strategy": ""}, {"id": "1101", "strategy": None}, "2317", ["1101"]], ensure_ascii=False)
+    assert DailyStockPush.parse_batch_strategies(text, IDS) == {"2330": "數字代號也接受"}
+
+def _results(*ids, skip=()):
+    return [{"id": sid, "name": f"股{sid}", "p": 100, "ma5": 99, "ma20": 98, "is_hold": False, "cost": 0,
+             "ai_strategy": None, "skip_ai": sid in skip} for sid in ids]
+
+def test_fill_falls_back_per_stock_only_for_missing_ids(monkeypatch):
+    prompts = []
+    def fake_call(prompt, config=None):
+        prompts.append((prompt, config))
+        if config: return json.dumps([{"id": "2330", "strategy": "批次回答"}, {"id": "2317", "strategy": " "}], ensure_ascii=False)
+        return "逐檔回答"
+    monkeypatch.setattr(DailyStockPush, "ai_ready", lambda: True)
+    monkeypatch.setattr(DailyStockPush, "call_gemini", fake_call)
+    results = _results("2330", "2317", "1101", "2454", skip=("2454",))
+    DailyStockPush.fill_ai_strategies(results)
+
+    assert [r["ai_strategy"] for r in results] == ["批次回答", "逐檔回答", "逐檔回答", "⏸️ 已手動關閉 AI 分析"]
+    assert sum(1 for _, config in prompts if config) == 1  # 一次批次請求
+    single = [p for p, config in prompts if not config]
+    assert len(single) == 2 and "2317" in single[0] + single[1] and "1101" in single[0] + single[1]
+
+def test_fill_keeps_existing_strategies(monkeypatch):
+    def fail(prompt, config=None): raise AssertionError("不應呼叫 AI")
+    monkeypatch.setattr(DailyStockPush, "ai_ready", lambda: True)
+    monkeypatch.setattr(DailyStockPush, "call_gemini", fail)
+    results = _results("2330")
+    results[0]["ai_strategy"] = "上次的結果"
+    DailyStockPush.fill_ai_strategies(results)
+    assert results[0]["ai_strategy"] == "上次的結果"
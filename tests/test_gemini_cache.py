@@ -0,0 +1,48 @@
+import datetime, os
+import pytest
+import stock_common
+import gemini_cache
+
+@pytest.fixture(autouse=True)
+def _cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_common, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(gemini_cache, "ENABLED", True)
+    monkeypatch.setattr(gemini_cache, "tw_now", lambda: datetime.datetime(2025, 10, 15, 9, 0))
+
+def _files():
+    return sorted(os.listdir(gemini_cache._dir()))
+
+def test_hit_and_key_includes_model_and_config():
+    gemini_cache.put("m1", "prompt", "answer", {"prompt_tokens": 12})
+    assert gemini_cache.get("m1", "prompt")["text"] == "answer"
+    assert gemini_cache.get("m1", "prompt")["usage"] == {"prompt_tokens": 12}
+    assert gemini_cache.get("m2", "prompt") is None
+    assert gemini_cache.get("m1", "prompt", {"response_mime_type": "application/json"}) is None
+
+def test_ttl_expiry_removes_entry(monkeypatch):
+    gemini_cache.put("m", "prompt", "answer")
+    later = datetime.datetime(2025, 10, 15, 9, 0) + datetime.timedelta(hours=gemini_cache.TTL_HOURS)
+    monkeypatch.setattr(gemini_cache, "tw_now", lambda: later - datetime.timedelta(seconds=1))
+    assert gemini_cache.get("m", "prompt") is not None
+    monkeypatch.setattr(gemini_cache, "tw_now", lambda: later)
+    assert gemini_cache.get("m", "prompt") is None
+    assert _files() == []
+
+def test_lru_eviction_under_size_cap(monkeypatch):
+    body = "x" * 1000
+    for i, name in enumerate("abc"):
+        gemini_cache.put("m", name, body)
+        os.utime(gemini_cache._path("m", name, None), (1_000_000 + i, 1_000_000 + i))  # a 最舊、c 最新
+    entry_size = os.path.getsize(gemini_cache._path("m", "a", None))
+    monkeypatch.setattr(gemini_cache, "MAX_MB", (3 * entry_size + 10) / 1024 / 1024)  # 容量剛好放得下 3 筆
+
+    assert gemini_cache.get("m", "a") is not None  # 命中後 a 變成最近使用
+    gemini_cache.put("m", "d", body)
+    assert gemini_cache.get("m", "b") is None  # 最久未使用的 b 被淘汰
+    assert all(gemini_cache.get("m", name) is not None for name in "acd")
+    assert len(_files()) == 3
+
+def test_disabled_cache_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(gemini_cache, "ENABLED", False)
+    gemini_cache.put("m", "prompt", "answer")
+    assert gemini_cache.get("m", "prompt") is None
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import stock_common
+import indicator_state
+from indicator_panel import IndicatorPanel
+from test_strategy_engine import _fixture_frames
+
+@pytest.fixture(autouse=True)
+def _fresh_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_common, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(indicator_state, "_STATE", None)
+
+def _assert_matches_full(frames, drop_zero_volume_tail=False):
+    """增量兩列指標表 vs 整段重算的最後兩列"""
+    panel = indicator_state.build_panel(frames, drop_zero_volume_tail)
+    full = IndicatorPanel.from_frames(frames, drop_zero_volume_tail)
+    assert panel.tickers == full.tickers
+    assert list(panel.lengths) == list(full.lengths)
+    for name in full.fields:
+        for offset in (-2, -1):
+            got = panel.latest(name, offset)
+            want = np.array([full.get(t, name, offset) for t in panel.tickers], dtype=float)
+            np.testing.assert_allclose(got, want, rtol=indicator_state.VERIFY_TOLERANCE, atol=1e-9, equal_nan=True, err_msg=f"{name}[{offset}]")
+
+def _count_fed(monkeypatch):
+    fed = []
+    feed = indicator_state._feed
+    monkeypatch.setattr(indicator_state, "_feed", lambda state, df: fed.append(len(df)) or feed(state, df))
+    return fed
+
+def test_first_run_then_new_bars(monkeypatch):
+    frames = _fixture_frames(6, n_bars=150)
+    head = {t: df.iloc[:140] for t, df in frames.items()}
+    _assert_matches_full(head)  # 第一次：整段建立狀態
+
+    fed = _count_fed(monkeypatch)
+    _assert_matches_full({t: df.iloc[:141] for t, df in frames.items()})  # 多一根
+    assert fed == [1] * 6
+    fed.clear()
+    _assert_matches_full(frames)  # 一次多好幾根
+    assert fed == [9] * 6
+
+def test_rerun_same_day_does_not_refeed(monkeypatch):
+    frames = _fixture_frames(4)
+    _assert_matches_full(frames)
+    fed = _count_fed(monkeypatch)
+    _assert_matches_full(frames)
+    assert fed == [0] * 4
+
+def test_zero_volume_tail_shares_state_across_policies(monkeypatch):
+    frames = _fixture_frames(5)
+    for df in list(frames.values())[::2]: df.iloc[-1, df.columns.get_loc('Volume')] = 0
+    _assert_matches_full(frames, drop_zero_volume_tail=True)
+
+    fed = _count_fed(monkeypatch)
+    for drop in (False, True, False):  # 兩種呼叫端輪流使用同一份狀態也不會重建
+        _assert_matches_full(frames, drop_zero_volume_tail=drop)
+    assert sum(fed) == 0
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import inst_store
+
+def _old_analyze_investor(df, name):
+    """舊版 DailyStockBot.get_inst_stats 的逐檔 iterrows 迴圈"""
+    d = df[df['name'] == name].sort_values('date', ascending=False).head(20)
+    if d.empty: return 0, 0
+    streak = 0
+    buy_days = 0
+    for idx, (_, r) in enumerate(d.iterrows()):
+        net = r['buy'] - r['sell']
+        if net > 0:
+            buy_days += 1
+            if streak == idx:
+                streak += 1
+    return streak, buy_days
+
+def _fixture(n_dates=26, seed=5):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2025-09-01", periods=n_dates).strftime('%Y-%m-%d')
+    rows = []
+    def add(sid, name, nets):
+        for d, net in zip(dates[-len(nets):], nets):
+            rows.append({"date": d, "stock_id": sid, "buy": 1000 + max(net, 0), "name": name, "sell": 1000 + max(-net, 0)})
+    for i in range(12):
+        for name in ("Foreign_Investor", "Investment_Trust"):
+            add(str(2000 + i), name, list(rng.choice([-300, -1, 0, 0, 1, 500], n_dates)))
+    add("3000", "Foreign_Investor", [100] * n_dates)                     # 連買超過視窗 → 20
+    add("3000", "Investment_Trust", [100] * (n_dates - 1) + [0])          # 最新一天淨額 0 → 連買中斷
+    add("3001", "Foreign_Investor", [100] * (n_dates - 2) + [-5, 100])    # 賣超中斷後再買 → 1
+    add("3002", "Foreign_Investor", [50] * 5)                            # 只有 5 天資料、沒有投信
+    add("3003", "Dealer_self", [100] * n_dates)                           # 其他法人不影響
+    return pd.DataFrame(rows, columns=inst_store.INST_COLUMNS).sample(frac=1, random_state=1)  # 打亂順序
+
+def test_streak_table_matches_old_per_stock_loop():
+    df = _fixture()
+    table = inst_store.compute_streak_table(df)
+    for sid, g in df.groupby('stock_id'):
+        fs_streak, fs_days = _old_analyze_investor(g, 'Foreign_Investor')
+        ss_streak, ss_days = _old_analyze_investor(g, 'Investment_Trust')
+        assert tuple(int(v) for v in table.loc[sid, inst_store.STREAK_COLUMNS]) == (fs_streak, ss_streak, fs_days, ss_days), sid
+
+def test_streak_break_cases():
+    table = inst_store.compute_streak_table(_fixture())
+    assert table.loc["3000", "fs_streak"] == 20 and table.loc["3000", "fs_days"] == 20
+    assert table.loc["3000", "ss_streak"] == 0 and table.loc["3000", "ss_days"] == 19
+    assert table.loc["3001", "fs_streak"] == 1
+    assert tuple(table.loc["3002", inst_store.STREAK_COLUMNS]) == (5, 0, 5, 0)
+    assert tuple(table.loc["3003", inst_store.STREAK_COLUMNS]) == (0, 0, 0, 0)
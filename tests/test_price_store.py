@@ -0,0 +1,54 @@
+import pandas as pd
+import price_store
+
+def _bars(dates, closes):
+    idx = pd.DatetimeIndex(pd.to_datetime(dates), name="Date")
+    return pd.DataFrame({"Open": closes, "High": closes, "Low": closes, "Close": closes, "Volume": [1000.0] * len(closes)}, index=idx)
+
+CACHED = _bars(["2025-10-13", "2025-10-14", "2025-10-15"], [100.0, 101.0, 102.0])
+
+def test_merge_bars_appends_new_bars():
+    merged = price_store.merge_bars(CACHED, _bars(["2025-10-15", "2025-10-16"], [102.0, 103.0]))
+    assert list(merged['Close']) == [100.0, 101.0, 102.0, 103.0]
+
+def test_merge_bars_detects_readjust():
+    assert price_store.merge_bars(CACHED, _bars(["2025-10-15", "2025-10-16"], [98.0, 99.0])) is None
+
+def test_partial_last_bar_is_overwritten_without_readjust():
+    # 10/15 那根是盤中 10:30 抓的，收盤價後來從 102 變成 105：不能當成除權息
+    meta = {"since": "2024-10-14", "fetched_at": "2025-10-15T10:30:00"}
+    assert price_store.partial_tail(CACHED, meta)
+    assert price_store._update_start(CACHED, meta) == "2025-10-14"
+    merged = price_store.merge_bars(CACHED, _bars(["2025-10-14", "2025-10-15"], [101.0, 105.0]), partial=True)
+    assert list(merged['Close']) == [100.0, 101.0, 105.0]
+    # 重疊的已收盤K棒變動仍然要整段重抓
+    assert price_store.merge_bars(CACHED, _bars(["2025-10-14", "2025-10-15"], [97.0, 105.0]), partial=True) is None
+
+def test_bar_fetched_after_close_is_final():
+    meta = {"since": "2024-10-14", "fetched_at": "2025-10-15T15:00:00"}
+    assert not price_store.partial_tail(CACHED, meta)
+    assert price_store._update_start(CACHED, meta) == "2025-10-15"
+
+def test_empty_batch_keeps_fetched_at(tmp_path, monkeypatch):
+    # yf.download 被限流時回傳空表：不能蓋掉 fetched_at，否則 is_fresh 會把舊K棒當成最新
+    import datetime, stock_common
+    monkeypatch.setattr(stock_common, "CACHE_DIR", str(tmp_path))
+    old = datetime.datetime(2025, 10, 15, 15, 0)
+    price_store.write_cached("2330.TW", CACHED, "2024-10-14", fetched_at=old)
+    monkeypatch.setattr(price_store, "download_batch", lambda batch, start: price_store._split_batch(pd.DataFrame(), batch))
+    assert price_store.prefetch(["2330.TW"]) == 0
+    _, meta = price_store.read_cached("2330.TW")
+    assert meta["fetched_at"] == old.isoformat(timespec='seconds')
+
+def test_failed_batch_counts_price_retry(tmp_path, monkeypatch):
+    # 批次失敗後由 get_history 逐檔重抓：run report 的 price 重試要計入，沒有重試路徑的 line 不列重試欄位
+    import stock_common
+    monkeypatch.setattr(stock_common, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(stock_common, "_STAGE_RETRIES", {})
+    monkeypatch.setattr(stock_common, "_STAGE_TIMES", {"line": [0.1]})
+    def fail(batch, start): raise ConnectionError("429")
+    monkeypatch.setattr(price_store, "download_batch", fail)
+    assert price_store.prefetch(["2330.TW", "2317.TW"]) == 0
+    report = stock_common.stage_report()
+    assert report["price"]["retries"] == 1
+    assert "retries" not in report["line"]
@@ -0,0 +1,28 @@
+import pytest
+import stock_common
+import scan_checkpoint
+
+@pytest.fixture(autouse=True)
+def _cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_common, "CACHE_DIR", str(tmp_path))
+
+def test_load_done_clear_round_trip():
+    cp = scan_checkpoint.Checkpoint("scan", every=2, tag="2025-10-15")
+    cp.add("2330", {"stage": "picked", "sheet": [1, 2], "rec": None})
+    assert scan_checkpoint.Checkpoint("scan", tag="2025-10-15").load() == 0  # 未滿 every 檔還沒寫檔
+    cp.add("2317", {"stage": "screened", "sheet": None, "rec": None})
+
+    resumed = scan_checkpoint.Checkpoint("scan", tag="2025-10-15")
+    assert resumed.load() == 2
+    assert resumed.done("2330") and resumed.done("2317") and not resumed.done("1101")
+    assert resumed.results["2330"] == {"stage": "picked", "sheet": [1, 2], "rec": None}
+
+    resumed.clear()
+    assert scan_checkpoint.Checkpoint("scan", tag="2025-10-15").load() == 0
+
+def test_other_day_starts_over():
+    cp = scan_checkpoint.Checkpoint("scan", tag="2025-10-14")
+    cp.add("2330", {"stage": "picked"})
+    cp.flush()
+    stale = scan_checkpoint.Checkpoint("scan", tag="2025-10-15")
+    assert stale.load() == 0 and not stale.done("2330")
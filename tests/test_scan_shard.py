@@ -0,0 +1,69 @@
+import os
+import pytest
+import scan_shard
+import DailyStockBot
+
+def test_parse_shard():
+    assert scan_shard.parse_shard("2/4") == (2, 4)
+    for bad in ("0/4", "5/4", "x/4", "2"):
+        with pytest.raises(ValueError): scan_shard.parse_shard(bad)
+
+def test_every_key_lands_in_exactly_one_shard():
+    keys = [str(1000 + i) for i in range(500)]
+    for n in (1, 2, 4, 7):
+        owners = [[i for i in range(1, n + 1) if scan_shard.in_shard(k, (i, n))] for k in keys]
+        assert all(len(o) == 1 for o in owners)
+    assert all(scan_shard.in_shard(k, None) for k in keys)
+
+# ==========================================
+# 分片掃描 → 合併 vs 一次掃完
+# ==========================================
+def _scan(universe, shard):
+    """仿 DailyStockBot.scan_market 的輸出：results 為 [全市場順序, 報表列, 推薦]"""
+    funnel = dict.fromkeys(DailyStockBot.FUNNEL_STAGES, 0)
+    results = []
+    for i, sid in enumerate(universe):
+        if not scan_shard.in_shard(sid, shard): continue
+        reached = i % 4  # 0 = 沒過初篩，1..3 = 通過到第幾個階段
+        for stage in DailyStockBot.FUNNEL_STAGES[:reached]: funnel[stage] += 1
+        if not reached: continue
+        sheet = [sid, f"名{sid}"] if reached == 3 else None
+        rec = {"id": sid, "name": f"名{sid}", "reason": "測試"} if reached == 3 and i % 8 == 3 else None
+        results.append([i, sheet, rec])
+    return {"universe": len(universe), "name_map": {sid: f"名{sid}" for sid in universe}, "funnel": funnel, "results": results}
+
+def _publish_capture(monkeypatch):
+    """攔下 publish 的報表同步與推播，回傳 {sheet, watch, msg}"""
+    seen = {}
+    def capture(key, result=None):
+        def fn(value, *_):
+            seen[key] = value
+            return result
+        return fn
+    monkeypatch.setattr(DailyStockBot, "sync_to_sheets", capture("sheet"))
+    monkeypatch.setattr(DailyStockBot, "update_watch_list_sheet", capture("watch"))
+    monkeypatch.setattr(DailyStockBot, "send_line", capture("msg"))
+    monkeypatch.setattr(DailyStockBot, "get_line_quota_report", lambda: "")
+    return seen
+
+def test_merged_shards_match_unsharded_run(tmp_path, monkeypatch):
+    universe = [str(1101 + i * 7) for i in range(120)]
+    monkeypatch.setattr(scan_shard, "SHARD_DIR", str(tmp_path))
+
+    whole = _scan(universe, None)
+    expected = _publish_capture(monkeypatch)
+    DailyStockBot.publish(**whole)
+
+    for i in range(1, 4): scan_shard.write_shard("DailyStockBot", (i, 3), _scan(universe, (i, 3)))
+    merged = _publish_capture(monkeypatch)
+    DailyStockBot.merge([os.path.join(str(tmp_path), "DailyStockBot_*of3.json")])
+
+    assert merged["sheet"] == expected["sheet"] and expected["sheet"]
+    assert merged["watch"] == expected["watch"] and expected["watch"]
+    assert DailyStockBot.FUNNEL == whole["funnel"]
+    assert merged["msg"] == expected["msg"]
+
+def test_incomplete_shards_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(scan_shard, "SHARD_DIR", str(tmp_path))
+    for i in (1, 3): scan_shard.write_shard("DailyStockBot", (i, 3), _scan(["2330"], (i, 3)))
+    with pytest.raises(SystemExit): scan_shard.load_shards("DailyStockBot", [os.path.join(str(tmp_path), "*.json")])
@@ -0,0 +1,132 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import strategy_engine
+from indicator_panel import IndicatorPanel
+
+# ==========================================
+# 策略設定檔編譯：白名單以外的語法一律拒絕
+# ==========================================
+def _write_rules(tmp_path, rules):
+    path = tmp_path / "strategies.json"
+    path.write_text(json.dumps({"g": rules}), encoding="utf-8")
+    return str(path)
+
+@pytest.mark.parametrize("expr", [
+    "__import__('os').system('echo hi')",
+    "close.real > 0",
+    "(lambda: 1)()",
+    "open('x')",
+    "[close][0] > 0",
+    "close if rsi > 50 else 0",
+    "close ** 2 > 0",
+    "'abc' == 'abc'",
+    "abs(close, key=1)",
+])
+def test_rejects_disallowed_syntax(tmp_path, expr):
+    with pytest.raises(ValueError):
+        strategy_engine.load_rules(_write_rules(tmp_path, {"bad": expr}))
+
+def test_rejects_unknown_names(tmp_path):
+    path = _write_rules(tmp_path, {"bad": "close > no_such_field"})
+    panel = IndicatorPanel.from_frames(_fixture_frames(3))
+    with pytest.raises(KeyError):
+        strategy_engine.evaluate("g", panel, path=path)
+
+# ==========================================
+# v14 策略遮罩 vs 舊版 analyze_v14 逐檔判斷
+# ==========================================
+def _fixture_frames(n_stocks, n_bars=120, seed=7):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2025-01-01", periods=n_bars)
+    frames = {}
+    for i in range(n_stocks):
+        close = 50 * np.exp(np.cumsum(rng.normal(0.002, 0.02, n_bars)))
+        high, low = close * (1 + rng.uniform(0, 0.02, n_bars)), close * (1 - rng.uniform(0, 0.02, n_bars))
+        volume = rng.integers(1_000, 10_000, n_bars).astype(float)
+        volume[-1] *= rng.uniform(0.5, 4)  # 最新一根量比分散在門檻兩側
+        frames[f"{1000 + i}.TW"] = pd.DataFrame({"Open": close, "High": high, "Low": low, "Close": close, "Volume": volume}, index=dates)
+    return frames
+
+def _old_v14(df, fs_streak, ss_streak, fs_days, ss_days):
+    """舊版 DailyStockBot.analyze_v14 / calculate_indicators 的計算方式"""
+    close = df['Close']
+    cp = close.iloc[-1]
+    ma5, ma20 = close.rolling(5).mean().iloc[-1], close.rolling(20).mean().iloc[-1]
+    ma60_series = close.rolling(60).mean()
+    ma60, ma60_prev = ma60_series.iloc[-1], ma60_series.iloc[-2]
+    delta = close.diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    rsi_val = (100 - (100 / (1 + (gain / loss)))).iloc[-1]
+    low_min, high_max = df['Low'].rolling(window=9).min(), df['High'].rolling(window=9).max()
+    k_val = ((close - low_min) / (high_max - low_min) * 100).ewm(com=2).mean().iloc[-1]
+    vol_avg = df['Volume'].iloc[-11:-1].mean()
+    vol_ratio = df.iloc[-1]['Volume'] / vol_avg if vol_avg > 0 else 0
+    bias_5 = ((cp - ma5) / ma5) * 100
+
+    is_overheated = bias_5 > 7 or rsi_val > 75 or k_val > 85
+    is_stable = ((ss_streak >= 2 or fs_streak >= 3) and (vol_ratio > 1.2) and (50 <= rsi_val <= 75) and (k_val <= 80) and cp > ma60)
+    is_aggressive = ((ss_streak >= 1 or fs_streak >= 2) and (vol_ratio > 2.5) and (rsi_val > 60) and (cp > ma5) and cp > ma60)
+    is_long_term_trend = (cp > ma20 and cp > ma60 and ma60 > ma60_prev and (fs_days + ss_days >= 12) and vol_ratio > 1.0)
+    is_pick = ((fs_streak >= 2 or ss_streak >= 1) and cp > ma60 and vol_ratio > 1.1) or is_long_term_trend
+    return {"is_overheated": is_overheated, "is_stable": is_stable, "is_aggressive": is_aggressive,
+            "is_long_term_trend": is_long_term_trend, "is_pick": is_pick}
+
+def test_v14_masks_match_old_analyze_v14():
+    frames = _fixture_frames(60)
+    panel = IndicatorPanel.from_frames(frames)
+    rng = np.random.default_rng(11)
+    chips = {"fs_streak": rng.integers(0, 5, len(frames)), "ss_streak": rng.integers(0, 4, len(frames)),
+             "fs_days": rng.integers(0, 12, len(frames)), "ss_days": rng.integers(0, 8, len(frames))}
+    signals = strategy_engine.evaluate("v14", panel, extra={k: v.astype(float) for k, v in chips.items()})
+
+    hits = dict.fromkeys(_old_v14(frames[panel.tickers[0]], 0, 0, 0, 0), 0)
+    for j, t in enumerate(panel.tickers):
+        expected = _old_v14(frames[t], *(int(chips[c][j]) for c in ("fs_streak", "ss_streak", "fs_days", "ss_days")))
+        row = signals.row(t)
+        for name, want in expected.items():
+            assert row[name] == bool(want), f"{t} {name}"
+            hits[name] += bool(want)
+    # 夾具要讓每個策略都有成立的股票，否則比對沒有意義
+    assert all(hits.values()), hits
+
+# ==========================================
+# pro 策略遮罩 vs 舊版 stock_bot_final.analyze_pro
+# ==========================================
+def _wilder_rsi(close, window=14):
+    """ta.momentum.RSIIndicator 的計算方式"""
+    diff = close.diff(1)
+    up, down = diff.where(diff > 0, 0.0), -diff.where(diff < 0, 0.0)
+    emaup = up.ewm(alpha=1 / window, min_periods=window, adjust=False).mean()
+    emadn = down.ewm(alpha=1 / window, min_periods=window, adjust=False).mean()
+    return pd.Series(np.where(emadn == 0, 100, 100 - (100 / (1 + emaup / emadn))), index=close.index)
+
+def _old_pro(df):
+    if df.iloc[-1]['Volume'] == 0: df = df.iloc[:-1]
+    close = df['Close']
+    rsi_series = _wilder_rsi(close)
+    ma20, ma60 = close.rolling(20).mean().iloc[-1], close.rolling(60).mean().iloc[-1]
+    curr_p, prev_p = close.iloc[-1], close.iloc[-2]
+    rsi, prev_rsi = rsi_series.iloc[-1], rsi_series.iloc[-2]
+    signals = []
+    if prev_rsi < 45 and rsi > prev_rsi: signals.append("底部轉強")
+    dist_ma20 = (curr_p - ma20) / ma20
+    if 0 < dist_ma20 < 0.025 and curr_p > prev_p: signals.append("回測月線")
+    vol_ratio = df.iloc[-1]['Volume'] / df['Volume'].iloc[-11:-1].mean()
+    if vol_ratio > 1.5 and df.iloc[-1]['Volume'] > 1000000: signals.append("金流湧入")
+    is_hit = (len(signals) >= 2) or ("金流湧入" in signals and curr_p > prev_p)
+    if (curr_p - ma60) / ma60 > 0.20: is_hit = False
+    return is_hit and curr_p >= 10
+
+def test_pro_masks_match_old_analyze_pro():
+    frames = _fixture_frames(80, seed=3)
+    for i, df in enumerate(frames.values()):
+        df['Volume'] *= 300
+        if i % 5 == 0: df.iloc[-1, df.columns.get_loc('Volume')] = 0  # 零量尾端由 drop_zero_volume_tail 丟棄
+    panel = IndicatorPanel.from_frames(frames, drop_zero_volume_tail=True)
+    signals = strategy_engine.evaluate("pro", panel)
+    expected = {t: bool(_old_pro(frames[t])) for t in panel.tickers}
+    assert {t: signals.row(t)["is_hit"] for t in panel.tickers} == expected
+    assert any(expected.values()) and not all(expected.values())
@@ -0,0 +1,77 @@
+import random
+import pytest
+import stock_common
+import gemini_cache
+import DailyStockPush
+
+@pytest.fixture(autouse=True)
+def _isolated(tmp_path, monkeypatch):
+    monkeypatch.setattr(stock_common, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(gemini_cache, "ENABLED", True)
+    monkeypatch.setattr(DailyStockPush, "SUMMARY_STATS", {})
+
+def _rows(n=60, seed=1):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        rows.append({"id": f"{2000 + i}", "name": f"股{i}", "p": 100.5, "score": rng.randint(5, 11), "ma5": 99.1, "ma10": 98.2, "ma20": 97.3, "ma60": 90.4,
+                     "d1": rng.uniform(-0.03, 0.08), "fs": rng.randint(0, 6), "ss": rng.randint(0, 4), "v_today": rng.randint(100, 30000), "v_ma5": 5000,
+                     "vol_r": round(rng.uniform(0.5, 3), 1), "ma_alert": "⚡回測5日線", "is_hold": False, "cost": 0,
+                     "is_golden": rng.random() < 0.2, "golden_msg": "🔥量縮回後買上漲", "is_long_term": rng.random() < 0.3,
+                     "is_incubation": rng.random() < 0.3, "is_first_golden_cross": rng.random() < 0.2, "is_intraday_breakout": rng.random() < 0.2,
+                     "bias_20_str": "+3.3%", "skip_ai": i == 0})
+    return rows
+
+def _ranked_ids(rows):
+    tagged = [(r, DailyStockPush._summary_tags(r)) for r in rows if not r["skip_ai"]]
+    return [r["id"] for r, tags in sorted(((r, t) for r, t in tagged if t), key=DailyStockPush._summary_rank)]
+
+def test_fits_without_trimming():
+    rows = _rows()
+    prompt, kept, omitted = DailyStockPush.build_summary_prompt(rows, budget=100_000)
+    assert (kept, omitted) == (len(_ranked_ids(rows)), 0)
+    assert "2000|" not in prompt  # skip_ai 不列入
+    assert "🔥量縮回後買上漲" in prompt and "⚡回測5日線" in prompt
+
+def test_trims_lowest_ranked_stocks_under_budget():
+    rows = _rows()
+    ranked = _ranked_ids(rows)
+    prompt, kept, omitted = DailyStockPush.build_summary_prompt(rows, budget=1500)
+    assert DailyStockPush.estimate_tokens(prompt) <= 1500
+    assert 0 < kept < len(ranked) and kept + omitted == len(ranked)
+    assert f"另有 {omitted} 檔" in prompt
+    table = [line.split("|")[0] for line in prompt.splitlines() if line[:4].isdigit()]
+    assert table == ranked[:kept]
+
+def test_retrims_when_measured_count_exceeds_budget(monkeypatch):
+    rows, budget = _rows(), 2000
+    sent = []
+    monkeypatch.setattr(DailyStockPush, "SUMMARY_TOKEN_BUDGET", budget)
+    monkeypatch.setattr(DailyStockPush, "ai_requested", lambda: True)
+    monkeypatch.setattr(DailyStockPush, "count_prompt_tokens", lambda p: (int(DailyStockPush.estimate_tokens(p) * 1.5), "count_tokens"))
+    monkeypatch.setattr(DailyStockPush, "call_gemini", lambda p, config=None: sent.append(p) or "總結")
+
+    assert DailyStockPush.generate_and_save_summary(rows, "2025-10-15 16:00") == "總結"
+    _, estimate_only, _ = DailyStockPush.build_summary_prompt(rows, budget)
+    stats = DailyStockPush.SUMMARY_STATS
+    assert stats["prompt_tokens"] <= budget and stats["source"] == "count_tokens"
+    assert stats["stocks"] < estimate_only
+    assert int(DailyStockPush.estimate_tokens(sent[0]) * 1.5) == stats["prompt_tokens"]
+
+class _FakeModels:
+    def __init__(self): self.counted = 0
+    def count_tokens(self, model, contents):
+        self.counted += 1
+        return type("Count", (), {"total_tokens": 321})()
+
+def test_count_uses_cache_before_count_tokens(monkeypatch):
+    models = _FakeModels()
+    monkeypatch.setattr(DailyStockPush, "AI_CLIENT", type("Client", (), {"models": models})())
+    monkeypatch.setattr(DailyStockPush, "ai_ready", lambda: True)
+    monkeypatch.setattr(DailyStockPush, "throttle", lambda source: None)
+    model = (DailyStockPush.models_to_try() or DailyStockPush.MODEL_CANDIDATES)[0]
+
+    assert DailyStockPush.count_prompt_tokens("新的提示詞") == (321, "count_tokens")
+    gemini_cache.put(model, "快取過的提示詞", "回答", {"prompt_tokens": 1234})
+    assert DailyStockPush.count_prompt_tokens("快取過的提示詞") == (1234, "快取")
+    assert models.counted == 1
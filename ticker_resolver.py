@@ -0,0 +1,80 @@
+import json, os, threading
+import price_store
+from stock_common import cache_path, timed_stage
+
+# ==========================================
+# 台股代號後綴 (.TW / .TWO) 對照索引
+# ==========================================
+# 以 FinMind taiwan_stock_info 的市場別一次建好對照表並存檔；
+# 只有表上查不到的代號才用 K 線探測，探測成功的結果會寫回表中。
+SUFFIX_BY_MARKET = {"twse": ".TW", "上市": ".TW", "tpex": ".TWO", "上櫃": ".TWO", "OTC": ".TWO"}
+
+_SUFFIX_MAP = None
+_LOCK = threading.Lock()
+
+def _map_path():
+    return cache_path("suffix_map.json")
+
+def _load():
+    global _SUFFIX_MAP
+    if _SUFFIX_MAP is None:
+        try:
+            with open(_map_path(), "r", encoding="utf-8") as f: _SUFFIX_MAP = json.load(f)
+        except Exception: _SUFFIX_MAP = {}
+    return _SUFFIX_MAP
+
+def _save():
+    path = _map_path()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(_SUFFIX_MAP, f, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, path)
+
+def market_column(stock_df):
+    for col in ('market_type', 'type'):
+        if col in stock_df.columns: return col
+    return None
+
+def update_from_stock_info(stock_df):
+    """用 taiwan_stock_info 的市場別更新對照表 (興櫃等未知市場別留給探測處理)"""
+    m_col = market_column(stock_df) if stock_df is not None else None
+    if not m_col: return 0
+    with _LOCK:
+        suffix_map = _load()
+        added = 0
+        for sid, market in zip(stock_df['stock_id'], stock_df[m_col]):
+            suffix = SUFFIX_BY_MARKET.get(str(market).strip())
+            if suffix and suffix_map.get(str(sid)) != suffix:
+                suffix_map[str(sid)] = suffix
+                added += 1
+        if added: _save()
+    return added
+
+def lookup(sid):
+    """只查表、不連網；查不到回傳 None"""
+    clean_id = str(sid).strip().upper()
+    with _LOCK: suffix = _load().get(clean_id)
+    return f"{clean_id}{suffix}" if suffix else None
+
+def known_tickers():
+    """對照表內所有完整代號 (批次更新其他快取時當作全市場清單)"""
+    with _LOCK: return [f"{sid}{suffix}" for sid, suffix in sorted(_load().items())]
+
+def resolve(sid):
+    """查表取得完整代號；查不到才依代碼特徵順序探測 K 線，並把結果寫回對照表"""
+    known = lookup(sid)
+    if known: return known
+    clean_id = str(sid).strip().upper()
+    # 3, 4, 5, 6, 8 開頭通常是上櫃(.TWO)；其他通常是上市(.TW)
+    suffixes = [".TWO", ".TW"] if clean_id.startswith(('3', '4', '5', '6', '8')) else [".TW", ".TWO"]
+    with timed_stage("suffix"):
+        for suffix in suffixes:
+            target = f"{clean_id}{suffix}"
+            try:
+                if not price_store.get_history(target, "5d").empty:
+                    with _LOCK:
+                        _load()[clean_id] = suffix
+                        _save()
+                    return target
+            except Exception:
+                continue
+    return None